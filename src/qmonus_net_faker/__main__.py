@@ -12,11 +12,28 @@ from . import (
     action,
     constants,
 )
-from .libs import file_lib
+from .libs import file_lib, str_utils
 
 logger = logging.getLogger(__name__)
 
 
+def parse_stub_ids(value: str) -> list[str]:
+    # 'edge-{01..03},core-1' -> ['edge-01', 'edge-02', 'edge-03', 'core-1']
+    stub_ids: list[str] = []
+    for item in value.split(","):
+        if item.strip():
+            stub_ids.extend(str_utils.expand_range(item.strip()))
+    return stub_ids
+
+
+def parse_manager_endpoints(value: str) -> list[str]:
+    # 'http://m0:10080,http://m1:10080' -> one endpoint per shard, in shard-index order
+    manager_endpoints = [e.strip() for e in value.split(",") if e.strip()]
+    if not manager_endpoints:
+        raise argparse.ArgumentTypeError("manager endpoints must not be empty")
+    return manager_endpoints
+
+
 def parse_args(args: list[str]) -> argparse.Namespace:
     # Parse args
     parser = argparse.ArgumentParser(
@@ -49,6 +66,21 @@ def parse_args(args: list[str]) -> argparse.Namespace:
         help="run stub",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
+    stubs_parser = run_sub_parser_action.add_parser(
+        "stubs",
+        help="run many stubs in one process",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    router_parser = run_sub_parser_action.add_parser(
+        "router",
+        help="run router in front of sharded managers",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    embedded_parser = run_sub_parser_action.add_parser(
+        "embedded",
+        help="run manager and stubs in one process",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
 
     # version
     parser.add_argument(
@@ -228,6 +260,119 @@ def parse_args(args: list[str]) -> argparse.Namespace:
         default=10080,
         help="port to listen on",
     )
+    manager_parser.add_argument(
+        "--unix-socket-path",
+        type=str,
+        dest="unix_socket_path",
+        default=None,
+        help="unix socket path to listen on in addition to host:port",
+    )
+    manager_parser.add_argument(
+        "--workers",
+        type=int,
+        dest="workers",
+        default=1,
+        help="number of manager processes; each owns the stubs placed on it by consistent hashing of stub-id",
+    )
+    manager_parser.add_argument(
+        "--shard-index",
+        type=int,
+        dest="shard_index",
+        default=0,
+        help="index of this manager among sharded managers",
+    )
+    manager_parser.add_argument(
+        "--shard-count",
+        type=int,
+        dest="shard_count",
+        default=1,
+        help="number of sharded managers; stubs are placed by consistent hashing of stub-id",
+    )
+    manager_parser.add_argument(
+        "--hot-reload",
+        type=str,
+        dest="hot_reload",
+        choices=["auto", "inotify", "poll", "off"],
+        default=constants.DEFAULT_HOT_RELOAD,
+        help="how to detect changes in module and yangs directories; auto uses inotify if available, otherwise poll",
+    )
+    manager_parser.add_argument(
+        "--hot-reload-interval",
+        type=float,
+        dest="hot_reload_interval",
+        default=constants.DEFAULT_HOT_RELOAD_INTERVAL,
+        help="polling interval in seconds for poll",
+    )
+    manager_parser.add_argument(
+        "--executor-threads",
+        type=int,
+        dest="executor_threads",
+        default=constants.DEFAULT_EXECUTOR_THREADS,
+        help="number of threads for datastore operations such as edit-config; 0 runs them on the event loop",
+    )
+    manager_parser.add_argument(
+        "--max-inflight",
+        type=int,
+        dest="max_inflight",
+        default=constants.DEFAULT_MAX_INFLIGHT,
+        help="maximum number of requests handled at once; 0 is unlimited",
+    )
+    manager_parser.add_argument(
+        "--max-inflight-per-stub",
+        type=int,
+        dest="max_inflight_per_stub",
+        default=constants.DEFAULT_MAX_INFLIGHT_PER_STUB,
+        help="maximum number of requests handled at once for each stub; 0 is unlimited",
+    )
+    manager_parser.add_argument(
+        "--max-queue",
+        type=int,
+        dest="max_queue",
+        default=constants.DEFAULT_MAX_QUEUE,
+        help="maximum number of requests waiting for the limits above; requests beyond it fail with 503; 0 is unlimited",
+    )
+    manager_parser.add_argument(
+        "--queue-timeout",
+        type=float,
+        dest="queue_timeout",
+        default=constants.DEFAULT_QUEUE_TIMEOUT,
+        help="seconds a request may wait for the limits above before failing with 503; 0 fails at once instead of waiting",
+    )
+    manager_parser.add_argument(
+        "--snapshot-path",
+        type=str,
+        dest="snapshot_path",
+        default=None,
+        help="file to save the state of the stubs to periodically and to restore it from at startup",
+    )
+    manager_parser.add_argument(
+        "--snapshot-interval",
+        type=float,
+        dest="snapshot_interval",
+        default=constants.DEFAULT_SNAPSHOT_INTERVAL,
+        help="interval in seconds between snapshots; 0 saves only on shutdown",
+    )
+    manager_parser.add_argument(
+        "--config-idle-timeout",
+        type=float,
+        dest="config_idle_timeout",
+        default=constants.DEFAULT_CONFIG_IDLE_TIMEOUT,
+        help="seconds after which configs not accessed are kept compressed until the next access; 0 keeps them parsed",
+    )
+    manager_parser.add_argument(
+        "--memory-budget",
+        type=int,
+        dest="memory_budget",
+        default=constants.DEFAULT_MEMORY_BUDGET,
+        help="bytes of stub state (configs, SNMP objects, metadata) kept in memory; the least recently used beyond it are spilled to disk; 0 is unlimited",
+    )
+    manager_parser.add_argument(
+        "--spill-path",
+        type=str,
+        dest="spill_path",
+        default=None,
+        help="directory for spilled stub state; a temporary directory if omitted",
+    )
     manager_parser.add_argument(
         "--log-level",
         type=str,
@@ -267,7 +412,7 @@ def parse_args(args: list[str]) -> argparse.Namespace:
     stub_parser.add_argument(
         "manager_endpoint",
         type=str,
-        help="manager endpoint: http://{manager_host}:{manager_port}",
+        help="manager endpoint: http://{manager_host}:{manager_port} or unix://{unix_socket_path}; comma-separated in shard-index order for sharded managers",
     )
     stub_parser.add_argument(
         "--host",
@@ -320,6 +465,35 @@ def parse_args(args: list[str]) -> argparse.Namespace:
         choices=["ssh", "http", "https", "telnet", "snmp"],
         help="protocol",
     )
+    stub_parser.add_argument(
+        "--manager-pool-size",
+        type=int,
+        dest="manager_pool_size",
+        default=constants.DEFAULT_MANAGER_POOL_SIZE,
+        help="max number of pooled connections to manager",
+    )
+    stub_parser.add_argument(
+        "--manager-keepalive-timeout",
+        type=float,
+        dest="manager_keepalive_timeout",
+        default=constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+        help="seconds to keep idle connections to manager alive",
+    )
+    stub_parser.add_argument(
+        "--manager-timeout",
+        type=int,
+        dest="manager_timeout",
+        default=constants.DEFAULT_MANAGER_TIMEOUT,
+        help="timeout in seconds for each request to manager",
+    )
+    stub_parser.add_argument(
+        "--manager-transport",
+        type=str,
+        dest="manager_transport",
+        choices=["http", "websocket"],
+        default=constants.DEFAULT_MANAGER_TRANSPORT,
+        help="transport to manager",
+    )
     stub_parser.add_argument(
         "--log-level",
         type=str,
@@ -350,6 +524,407 @@ def parse_args(args: list[str]) -> argparse.Namespace:
         help="log file backup count",
     )
 
+    # run stubs command
+    stubs_parser.add_argument(
+        "stub_ids",
+        type=parse_stub_ids,
+        help="comma-separated stub-ids; ranges like 'edge-{0001..2000}' are expanded",
+    )
+    stubs_parser.add_argument(
+        "manager_endpoint",
+        type=str,
+        help="manager endpoint: http://{manager_host}:{manager_port} or unix://{unix_socket_path}; comma-separated in shard-index order for sharded managers",
+    )
+    stubs_parser.add_argument(
+        "--allocation",
+        type=str,
+        dest="allocation",
+        choices=["ip-alias", "port"],
+        default="ip-alias",
+        help="ip-alias: stubs share listeners and are told apart by local address, port: each stub listens on its own ports",
+    )
+    stubs_parser.add_argument(
+        "--first-address",
+        type=str,
+        dest="first_address",
+        default="127.0.0.1",
+        help="address of the first stub in ip-alias allocation; the n-th stub gets first-address + n",
+    )
+    stubs_parser.add_argument(
+        "--host",
+        type=str,
+        dest="host",
+        default="0.0.0.0",
+        help="host to listen on",
+    )
+    stubs_parser.add_argument(
+        "--http-port",
+        type=int,
+        dest="http_port",
+        default=20080,
+        help="port to listen on; in port allocation, the first of consecutive ports",
+    )
+    stubs_parser.add_argument(
+        "--https-port",
+        type=int,
+        dest="https_port",
+        default=20443,
+        help="port to listen on; in port allocation, the first of consecutive ports",
+    )
+    stubs_parser.add_argument(
+        "--ssh-port",
+        type=int,
+        dest="ssh_port",
+        default=20022,
+        help="port to listen on; in port allocation, the first of consecutive ports",
+    )
+    stubs_parser.add_argument(
+        "--telnet-port",
+        type=int,
+        dest="telnet_port",
+        default=20023,
+        help="port to listen on; in port allocation, the first of consecutive ports",
+    )
+    stubs_parser.add_argument(
+        "--snmp-port",
+        type=int,
+        dest="snmp_port",
+        default=20161,
+        help="port to listen on; in port allocation, the first of consecutive ports",
+    )
+    stubs_parser.add_argument(
+        "--protocol",
+        type=str,
+        dest="protocols",
+        nargs="+",
+        default=["ssh", "http", "https", "telnet", "snmp"],
+        choices=["ssh", "http", "https", "telnet", "snmp"],
+        help="protocol",
+    )
+    stubs_parser.add_argument(
+        "--manager-pool-size",
+        type=int,
+        dest="manager_pool_size",
+        default=constants.DEFAULT_MANAGER_POOL_SIZE,
+        help="max number of pooled connections to manager",
+    )
+    stubs_parser.add_argument(
+        "--manager-keepalive-timeout",
+        type=float,
+        dest="manager_keepalive_timeout",
+        default=constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+        help="seconds to keep idle connections to manager alive",
+    )
+    stubs_parser.add_argument(
+        "--manager-timeout",
+        type=int,
+        dest="manager_timeout",
+        default=constants.DEFAULT_MANAGER_TIMEOUT,
+        help="timeout in seconds for each request to manager",
+    )
+    stubs_parser.add_argument(
+        "--manager-transport",
+        type=str,
+        dest="manager_transport",
+        choices=["http", "websocket"],
+        default=constants.DEFAULT_MANAGER_TRANSPORT,
+        help="transport to manager",
+    )
+    stubs_parser.add_argument(
+        "--log-level",
+        type=str,
+        dest="log_level",
+        choices=["debug", "info"],
+        default=constants.DEFAULT_LOG_LEVEL,
+        help="log level",
+    )
+    stubs_parser.add_argument(
+        "--log-file-path",
+        type=str,
+        dest="log_file_path",
+        default="",
+        help="log file path",
+    )
+    stubs_parser.add_argument(
+        "--log-file-size",
+        type=int,
+        dest="log_file_size",
+        default=constants.DEFAULT_MAX_LOG_FILE_SIZE,
+        help="max log file size",
+    )
+    stubs_parser.add_argument(
+        "--log-file-backup-count",
+        type=int,
+        dest="log_file_backup_count",
+        default=constants.DEFAULT_MAX_LOG_FILE_BACKUP_COUNT,
+        help="log file backup count",
+    )
+
+    # run router command
+    router_parser.add_argument(
+        "manager_endpoints",
+        type=parse_manager_endpoints,
+        help="comma-separated manager endpoints in shard-index order",
+    )
+    router_parser.add_argument(
+        "--host",
+        type=str,
+        dest="host",
+        default="0.0.0.0",
+        help="host to listen on",
+    )
+    router_parser.add_argument(
+        "--port",
+        type=int,
+        dest="port",
+        default=10080,
+        help="port to listen on",
+    )
+    router_parser.add_argument(
+        "--unix-socket-path",
+        type=str,
+        dest="unix_socket_path",
+        default=None,
+        help="unix socket path to listen on in addition to host:port",
+    )
+    router_parser.add_argument(
+        "--log-level",
+        type=str,
+        dest="log_level",
+        choices=["debug", "info"],
+        default=constants.DEFAULT_LOG_LEVEL,
+        help="log level",
+    )
+    router_parser.add_argument(
+        "--log-file-path",
+        type=str,
+        dest="log_file_path",
+        default="",
+        help="log file path",
+    )
+    router_parser.add_argument(
+        "--log-file-size",
+        type=int,
+        dest="log_file_size",
+        default=constants.DEFAULT_MAX_LOG_FILE_SIZE,
+        help="max log file size",
+    )
+    router_parser.add_argument(
+        "--log-file-backup-count",
+        type=int,
+        dest="log_file_backup_count",
+        default=constants.DEFAULT_MAX_LOG_FILE_BACKUP_COUNT,
+        help="log file backup count",
+    )
+
+    # run embedded command
+    embedded_parser.add_argument(
+        "project_path",
+        type=str,
+        help="project directory path",
+    )
+    embedded_parser.add_argument(
+        "stub_ids",
+        type=parse_stub_ids,
+        nargs="?",
+        default=None,
+        help="comma-separated stub-ids; ranges like 'edge-{0001..2000}' are expanded; all stubs in the project if omitted",
+    )
+    embedded_parser.add_argument(
+        "--manager-host",
+        type=str,
+        dest="manager_host",
+        default="0.0.0.0",
+        help="host for manager REST-API to listen on",
+    )
+    embedded_parser.add_argument(
+        "--manager-port",
+        type=int,
+        dest="manager_port",
+        default=10080,
+        help="port for manager REST-API to listen on",
+    )
+    embedded_parser.add_argument(
+        "--hot-reload",
+        type=str,
+        dest="hot_reload",
+        choices=["auto", "inotify", "poll", "off"],
+        default=constants.DEFAULT_HOT_RELOAD,
+        help="how to detect changes in module and yangs directories; auto uses inotify if available, otherwise poll",
+    )
+    embedded_parser.add_argument(
+        "--hot-reload-interval",
+        type=float,
+        dest="hot_reload_interval",
+        default=constants.DEFAULT_HOT_RELOAD_INTERVAL,
+        help="polling interval in seconds for poll",
+    )
+    embedded_parser.add_argument(
+        "--executor-threads",
+        type=int,
+        dest="executor_threads",
+        default=constants.DEFAULT_EXECUTOR_THREADS,
+        help="number of threads for datastore operations such as edit-config; 0 runs them on the event loop",
+    )
+    embedded_parser.add_argument(
+        "--max-inflight",
+        type=int,
+        dest="max_inflight",
+        default=constants.DEFAULT_MAX_INFLIGHT,
+        help="maximum number of requests handled at once; 0 is unlimited",
+    )
+    embedded_parser.add_argument(
+        "--max-inflight-per-stub",
+        type=int,
+        dest="max_inflight_per_stub",
+        default=constants.DEFAULT_MAX_INFLIGHT_PER_STUB,
+        help="maximum number of requests handled at once for each stub; 0 is unlimited",
+    )
+    embedded_parser.add_argument(
+        "--max-queue",
+        type=int,
+        dest="max_queue",
+        default=constants.DEFAULT_MAX_QUEUE,
+        help="maximum number of requests waiting for the limits above; requests beyond it fail with 503; 0 is unlimited",
+    )
+    embedded_parser.add_argument(
+        "--queue-timeout",
+        type=float,
+        dest="queue_timeout",
+        default=constants.DEFAULT_QUEUE_TIMEOUT,
+        help="seconds a request may wait for the limits above before failing with 503; 0 fails at once instead of waiting",
+    )
+    embedded_parser.add_argument(
+        "--snapshot-path",
+        type=str,
+        dest="snapshot_path",
+        default=None,
+        help="file to save the state of the stubs to periodically and to restore it from at startup",
+    )
+    embedded_parser.add_argument(
+        "--snapshot-interval",
+        type=float,
+        dest="snapshot_interval",
+        default=constants.DEFAULT_SNAPSHOT_INTERVAL,
+        help="interval in seconds between snapshots; 0 saves only on shutdown",
+    )
+    embedded_parser.add_argument(
+        "--config-idle-timeout",
+        type=float,
+        dest="config_idle_timeout",
+        default=constants.DEFAULT_CONFIG_IDLE_TIMEOUT,
+        help="seconds after which configs not accessed are kept compressed until the next access; 0 keeps them parsed",
+    )
+    embedded_parser.add_argument(
+        "--memory-budget",
+        type=int,
+        dest="memory_budget",
+        default=constants.DEFAULT_MEMORY_BUDGET,
+        help="bytes of stub state (configs, SNMP objects, metadata) kept in memory; the least recently used beyond it are spilled to disk; 0 is unlimited",
+    )
+    embedded_parser.add_argument(
+        "--spill-path",
+        type=str,
+        dest="spill_path",
+        default=None,
+        help="directory for spilled stub state; a temporary directory if omitted",
+    )
+    embedded_parser.add_argument(
+        "--allocation",
+        type=str,
+        dest="allocation",
+        choices=["ip-alias", "port"],
+        default="ip-alias",
+        help="ip-alias: stubs share listeners and are told apart by local address, port: each stub listens on its own ports",
+    )
+    embedded_parser.add_argument(
+        "--first-address",
+        type=str,
+        dest="first_address",
+        default="127.0.0.1",
+        help="address of the first stub in ip-alias allocation; the n-th stub gets first-address + n",
+    )
+    embedded_parser.add_argument(
+        "--host",
+        type=str,
+        dest="host",
+        default="0.0.0.0",
+        help="host to listen on",
+    )
+    embedded_parser.add_argument(
+        "--http-port",
+        type=int,
+        dest="http_port",
+        default=20080,
+        help="port to listen on; in port allocation, the first of consecutive ports",
+    )
+    embedded_parser.add_argument(
+        "--https-port",
+        type=int,
+        dest="https_port",
+        default=20443,
+        help="port to listen on; in port allocation, the first of consecutive ports",
+    )
+    embedded_parser.add_argument(
+        "--ssh-port",
+        type=int,
+        dest="ssh_port",
+        default=20022,
+        help="port to listen on; in port allocation, the first of consecutive ports",
+    )
+    embedded_parser.add_argument(
+        "--telnet-port",
+        type=int,
+        dest="telnet_port",
+        default=20023,
+        help="port to listen on; in port allocation, the first of consecutive ports",
+    )
+    embedded_parser.add_argument(
+        "--snmp-port",
+        type=int,
+        dest="snmp_port",
+        default=20161,
+        help="port to listen on; in port allocation, the first of consecutive ports",
+    )
+    embedded_parser.add_argument(
+        "--protocol",
+        type=str,
+        dest="protocols",
+        nargs="+",
+        default=["ssh", "http", "https", "telnet", "snmp"],
+        choices=["ssh", "http", "https", "telnet", "snmp"],
+        help="protocol",
+    )
+    embedded_parser.add_argument(
+        "--log-level",
+        type=str,
+        dest="log_level",
+        choices=["debug", "info"],
+        default=constants.DEFAULT_LOG_LEVEL,
+        help="log level",
+    )
+    embedded_parser.add_argument(
+        "--log-file-path",
+        type=str,
+        dest="log_file_path",
+        default="",
+        help="log file path",
+    )
+    embedded_parser.add_argument(
+        "--log-file-size",
+        type=int,
+        dest="log_file_size",
+        default=constants.DEFAULT_MAX_LOG_FILE_SIZE,
+        help="max log file size",
+    )
+    embedded_parser.add_argument(
+        "--log-file-backup-count",
+        type=int,
+        dest="log_file_backup_count",
+        default=constants.DEFAULT_MAX_LOG_FILE_BACKUP_COUNT,
+        help="log file backup count",
+    )
+
     parsed_args = parser.parse_args(args)
     return parsed_args
 
@@ -513,6 +1088,22 @@ def main() -> None:
             host = args.host
             port = args.port
             project_path = args.project_path
+            unix_socket_path = args.unix_socket_path
+            workers = args.workers
+            shard_index = args.shard_index
+            shard_count = args.shard_count
+            hot_reload = args.hot_reload
+            hot_reload_interval = args.hot_reload_interval
+            executor_threads = args.executor_threads
+            max_inflight = args.max_inflight
+            max_inflight_per_stub = args.max_inflight_per_stub
+            max_queue = args.max_queue
+            queue_timeout = args.queue_timeout
+            snapshot_path = args.snapshot_path
+            snapshot_interval = args.snapshot_interval
+            config_idle_timeout = args.config_idle_timeout
+            memory_budget = args.memory_budget
+            spill_path = args.spill_path
 
             try:
                 asyncio.run(
@@ -520,6 +1111,26 @@ def main() -> None:
                         host=host,
                         port=port,
                         project_path=project_path,
+                        unix_socket_path=unix_socket_path,
+                        shard_index=shard_index,
+                        shard_count=shard_count,
+                        hot_reload=hot_reload,
+                        hot_reload_interval=hot_reload_interval,
+                        executor_threads=executor_threads,
+                        max_inflight=max_inflight,
+                        max_inflight_per_stub=max_inflight_per_stub,
+                        max_queue=max_queue,
+                        queue_timeout=queue_timeout,
+                        snapshot_path=snapshot_path,
+                        snapshot_interval=snapshot_interval,
+                        config_idle_timeout=config_idle_timeout,
+                        memory_budget=memory_budget,
+                        spill_path=spill_path,
+                        workers=workers,
+                        log_level=log_level,
+                        log_file_path=log_file_path,
+                        log_file_size=log_file_size,
+                        log_file_backup_count=log_file_backup_count,
                     )
                 )
             except (KeyboardInterrupt, SystemExit) as e:
@@ -534,6 +1145,10 @@ def main() -> None:
             telnet_port = args.telnet_port
             snmp_port = args.snmp_port
             protocols = args.protocols
+            manager_pool_size = args.manager_pool_size
+            manager_keepalive_timeout = args.manager_keepalive_timeout
+            manager_timeout = args.manager_timeout
+            manager_transport = args.manager_transport
 
             try:
                 asyncio.run(
@@ -547,6 +1162,125 @@ def main() -> None:
                         telnet_port=telnet_port,
                         snmp_port=snmp_port,
                         protocols=protocols,
+                        manager_pool_size=manager_pool_size,
+                        manager_keepalive_timeout=manager_keepalive_timeout,
+                        manager_timeout=manager_timeout,
+                        manager_transport=manager_transport,
+                    )
+                )
+            except (KeyboardInterrupt, SystemExit) as e:
+                logger.info(f"Stopped: {e.__class__.__name__}")
+        elif args.run_sub_parser == "stubs":
+            stub_ids = args.stub_ids
+            manager_endpoint = args.manager_endpoint
+            allocation = args.allocation
+            first_address = args.first_address
+            host = args.host
+            http_port = args.http_port
+            https_port = args.https_port
+            ssh_port = args.ssh_port
+            telnet_port = args.telnet_port
+            snmp_port = args.snmp_port
+            protocols = args.protocols
+            manager_pool_size = args.manager_pool_size
+            manager_keepalive_timeout = args.manager_keepalive_timeout
+            manager_timeout = args.manager_timeout
+            manager_transport = args.manager_transport
+
+            try:
+                asyncio.run(
+                    action.run_stubs(
+                        stub_ids=stub_ids,
+                        manager_endpoint=manager_endpoint,
+                        host=host,
+                        http_port=http_port,
+                        https_port=https_port,
+                        ssh_port=ssh_port,
+                        telnet_port=telnet_port,
+                        snmp_port=snmp_port,
+                        protocols=protocols,
+                        allocation=allocation,
+                        first_address=first_address,
+                        manager_pool_size=manager_pool_size,
+                        manager_keepalive_timeout=manager_keepalive_timeout,
+                        manager_timeout=manager_timeout,
+                        manager_transport=manager_transport,
+                    )
+                )
+            except (KeyboardInterrupt, SystemExit) as e:
+                logger.info(f"Stopped: {e.__class__.__name__}")
+        elif args.run_sub_parser == "router":
+            manager_endpoints = args.manager_endpoints
+            host = args.host
+            port = args.port
+            unix_socket_path = args.unix_socket_path
+
+            try:
+                asyncio.run(
+                    action.run_router(
+                        host=host,
+                        port=port,
+                        manager_endpoints=manager_endpoints,
+                        unix_socket_path=unix_socket_path,
+                    )
+                )
+            except (KeyboardInterrupt, SystemExit) as e:
+                logger.info(f"Stopped: {e.__class__.__name__}")
+        elif args.run_sub_parser == "embedded":
+            project_path = args.project_path
+            stub_ids = args.stub_ids
+            manager_host = args.manager_host
+            manager_port = args.manager_port
+            hot_reload = args.hot_reload
+            hot_reload_interval = args.hot_reload_interval
+            executor_threads = args.executor_threads
+            max_inflight = args.max_inflight
+            max_inflight_per_stub = args.max_inflight_per_stub
+            max_queue = args.max_queue
+            queue_timeout = args.queue_timeout
+            snapshot_path = args.snapshot_path
+            snapshot_interval = args.snapshot_interval
+            config_idle_timeout = args.config_idle_timeout
+            memory_budget = args.memory_budget
+            spill_path = args.spill_path
+            allocation = args.allocation
+            first_address = args.first_address
+            host = args.host
+            http_port = args.http_port
+            https_port = args.https_port
+            ssh_port = args.ssh_port
+            telnet_port = args.telnet_port
+            snmp_port = args.snmp_port
+            protocols = args.protocols
+
+            try:
+                asyncio.run(
+                    action.run_embedded(
+                        project_path=project_path,
+                        stub_ids=stub_ids,
+                        manager_host=manager_host,
+                        manager_port=manager_port,
+                        host=host,
+                        http_port=http_port,
+                        https_port=https_port,
+                        ssh_port=ssh_port,
+                        telnet_port=telnet_port,
+                        snmp_port=snmp_port,
+                        protocols=protocols,
+                        allocation=allocation,
+                        first_address=first_address,
+                        hot_reload=hot_reload,
+                        hot_reload_interval=hot_reload_interval,
+                        executor_threads=executor_threads,
+                        max_inflight=max_inflight,
+                        max_inflight_per_stub=max_inflight_per_stub,
+                        max_queue=max_queue,
+                        queue_timeout=queue_timeout,
+                        snapshot_path=snapshot_path,
+                        snapshot_interval=snapshot_interval,
+                        config_idle_timeout=config_idle_timeout,
+                        memory_budget=memory_budget,
+                        spill_path=spill_path,
                     )
                 )
             except (KeyboardInterrupt, SystemExit) as e:
@@ -3,7 +3,11 @@ import typing
 import pathlib
 import signal
 import asyncio
+import sys
+import shutil
+import tempfile
 
+from . import constants
 from . import exceptions
 from . import server
 from .interface import (
@@ -13,6 +17,7 @@ from .interface import (
     ssh_stub_interface,
     telnet_stub_interface,
     snmp_stub_interface,
+    manager_client,
 )
 from .application import manager_application, cli_application
 from .infrastructure import (
@@ -66,6 +71,28 @@ async def run_manager(
     host: str,
     port: int,
     project_path: str,
+    unix_socket_path: typing.Optional[str] = None,
+    shard_index: int = 0,
+    shard_count: int = 1,
+    hot_reload: typing.Literal[
+        "auto", "inotify", "poll", "off"
+    ] = constants.DEFAULT_HOT_RELOAD,
+    hot_reload_interval: float = constants.DEFAULT_HOT_RELOAD_INTERVAL,
+    executor_threads: int = constants.DEFAULT_EXECUTOR_THREADS,
+    max_inflight: int = constants.DEFAULT_MAX_INFLIGHT,
+    max_inflight_per_stub: int = constants.DEFAULT_MAX_INFLIGHT_PER_STUB,
+    max_queue: int = constants.DEFAULT_MAX_QUEUE,
+    queue_timeout: float = constants.DEFAULT_QUEUE_TIMEOUT,
+    snapshot_path: typing.Optional[str] = None,
+    snapshot_interval: float = constants.DEFAULT_SNAPSHOT_INTERVAL,
+    config_idle_timeout: float = constants.DEFAULT_CONFIG_IDLE_TIMEOUT,
+    memory_budget: int = constants.DEFAULT_MEMORY_BUDGET,
+    spill_path: typing.Optional[str] = None,
+    workers: int = 1,
+    log_level: str = constants.DEFAULT_LOG_LEVEL,
+    log_file_path: typing.Optional[str] = None,
+    log_file_size: int = constants.DEFAULT_MAX_LOG_FILE_SIZE,
+    log_file_backup_count: int = constants.DEFAULT_MAX_LOG_FILE_BACKUP_COUNT,
 ) -> None:
     loop = asyncio.get_running_loop()
     try:
@@ -74,8 +101,70 @@ async def run_manager(
     except NotImplementedError:
         logger.info(f"Signal not implemented.")
 
+    if workers < 1:
+        raise ValueError(f"Invalid workers: '{workers}'")
+    if workers > 1:
+        if shard_count > 1:
+            raise ValueError("workers and shard-count cannot be combined")
+        await _run_manager_workers(
+            host=host,
+            port=port,
+            project_path=project_path,
+            unix_socket_path=unix_socket_path,
+            workers=workers,
+            log_file_path=log_file_path,
+            worker_args=[
+                "--hot-reload",
+                hot_reload,
+                "--hot-reload-interval",
+                str(hot_reload_interval),
+                "--executor-threads",
+                str(executor_threads),
+                "--max-inflight",
+                str(max_inflight),
+                "--max-inflight-per-stub",
+                str(max_inflight_per_stub),
+                "--max-queue",
+                str(max_queue),
+                "--queue-timeout",
+                str(queue_timeout),
+                *([] if snapshot_path is None else ["--snapshot-path", snapshot_path]),
+                "--snapshot-interval",
+                str(snapshot_interval),
+                "--config-idle-timeout",
+                str(config_idle_timeout),
+                "--memory-budget",
+                str(memory_budget),
+                *([] if spill_path is None else ["--spill-path", spill_path]),
+                "--log-level",
+                log_level,
+                "--log-file-size",
+                str(log_file_size),
+                "--log-file-backup-count",
+                str(log_file_backup_count),
+            ],
+        )
+        return
+
     manager = await server.create_manager(
-        host=host, port=port, project_path=project_path
+        host=host,
+        port=port,
+        project_path=project_path,
+        unix_socket_path=unix_socket_path,
+        shard_index=shard_index,
+        shard_count=shard_count,
+        hot_reload=hot_reload,
+        hot_reload_interval=hot_reload_interval,
+        executor_threads=executor_threads,
+        max_inflight=max_inflight,
+        max_inflight_per_stub=max_inflight_per_stub,
+        max_queue=max_queue,
+        queue_timeout=queue_timeout,
+        snapshot_path=snapshot_path,
+        snapshot_interval=snapshot_interval,
+        config_idle_timeout=config_idle_timeout,
+        memory_budget=memory_budget,
+        spill_path=spill_path,
     )
     try:
         await manager.start()
@@ -85,6 +174,123 @@ async def run_manager(
         await manager.stop()
 
 
+async def _run_manager_workers(
+    host: str,
+    port: int,
+    project_path: str,
+    unix_socket_path: typing.Optional[str],
+    workers: int,
+    log_file_path: typing.Optional[str],
+    worker_args: list[str],
+) -> None:
+    # Each worker is a manager shard listening on a private unix socket and on
+    # host:port+1+shard-index. A router in this process serves host:port, forwards
+    # by stub-id, and tells clients the workers' endpoints so that they can skip it
+    runtime_dir = pathlib.Path(tempfile.mkdtemp(prefix="netfaker-manager-"))
+    socket_paths = [runtime_dir.joinpath(f"worker-{i}.sock") for i in range(workers)]
+    worker_ports = [port + 1 + i if port else 0 for i in range(workers)]
+    processes: list[asyncio.subprocess.Process] = []
+    try:
+        for i, socket_path in enumerate(socket_paths):
+            log_args = []
+            if log_file_path:
+                # 'manager.log' -> 'manager.worker-0.log'
+                _log_file_path = pathlib.Path(log_file_path)
+                log_args = [
+                    "--log-file-path",
+                    str(
+                        _log_file_path.with_name(
+                            f"{_log_file_path.stem}.worker-{i}{_log_file_path.suffix}"
+                        )
+                    ),
+                ]
+            process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                "qmonus_net_faker",
+                "run",
+                "manager",
+                project_path,
+                "--host",
+                host,
+                "--port",
+                str(worker_ports[i]),
+                "--unix-socket-path",
+                str(socket_path),
+                "--shard-index",
+                str(i),
+                "--shard-count",
+                str(workers),
+                *worker_args,
+                *log_args,
+            )
+            processes.append(process)
+
+        # Wait for workers to listen
+        while not all(socket_path.exists() for socket_path in socket_paths):
+            if any(process.returncode is not None for process in processes):
+                raise exceptions.Error("Manager worker exited during startup.")
+            await asyncio.sleep(0.1)
+
+        manager_endpoints = [f"unix://{socket_path}" for socket_path in socket_paths]
+        logger.info(f"Manager workers: {','.join(manager_endpoints)}")
+
+        _host = f"[{host}]" if ":" in host else host
+        router = server.create_router(
+            host=host,
+            port=port,
+            manager_endpoints=manager_endpoints,
+            unix_socket_path=unix_socket_path,
+            shard_endpoints=[
+                [endpoint, *([f"http://{_host}:{p}"] if p else [])]
+                for endpoint, p in zip(manager_endpoints, worker_ports)
+            ],
+        )
+        try:
+            await router.start()
+            await asyncio.wait(
+                [asyncio.create_task(process.wait()) for process in processes],
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            raise exceptions.Error("Manager worker exited.")
+        finally:
+            await router.stop()
+    finally:
+        for process in processes:
+            if process.returncode is None:
+                process.terminate()
+        for process in processes:
+            await process.wait()
+        shutil.rmtree(runtime_dir, ignore_errors=True)
+
+
+async def run_router(
+    host: str,
+    port: int,
+    manager_endpoints: list[str],
+    unix_socket_path: typing.Optional[str] = None,
+) -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(sig=signal.SIGTERM, callback=handle_signal)
+        loop.add_signal_handler(sig=signal.SIGINT, callback=handle_signal)
+    except NotImplementedError:
+        logger.info(f"Signal not implemented.")
+
+    router = server.create_router(
+        host=host,
+        port=port,
+        manager_endpoints=manager_endpoints,
+        unix_socket_path=unix_socket_path,
+    )
+    try:
+        await router.start()
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await router.stop()
+
+
 async def run_stub(
     stub_id: str,
     manager_endpoint: str,
@@ -95,6 +301,12 @@ async def run_stub(
     telnet_port: int,
     snmp_port: int,
     protocols: list[typing.Literal["ssh", "http", "https", "telnet", "snmp"]],
+    manager_pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+    manager_keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+    manager_timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+    manager_transport: typing.Literal[
+        "http", "websocket"
+    ] = constants.DEFAULT_MANAGER_TRANSPORT,
 ) -> None:
     loop = asyncio.get_running_loop()
     try:
@@ -117,6 +329,10 @@ async def run_stub(
             port=ssh_port,
             stub_id=stub_id,
             manager_endpoint=manager_endpoint,
+            manager_pool_size=manager_pool_size,
+            manager_keepalive_timeout=manager_keepalive_timeout,
+            manager_timeout=manager_timeout,
+            manager_transport=manager_transport,
         )
         stubs.append(ssh_stub)
     if "http" in protocols:
@@ -125,6 +341,10 @@ async def run_stub(
             port=http_port,
             stub_id=stub_id,
             manager_endpoint=manager_endpoint,
+            manager_pool_size=manager_pool_size,
+            manager_keepalive_timeout=manager_keepalive_timeout,
+            manager_timeout=manager_timeout,
+            manager_transport=manager_transport,
         )
         stubs.append(http_stub)
     if "https" in protocols:
@@ -133,6 +353,10 @@ async def run_stub(
             port=https_port,
             stub_id=stub_id,
             manager_endpoint=manager_endpoint,
+            manager_pool_size=manager_pool_size,
+            manager_keepalive_timeout=manager_keepalive_timeout,
+            manager_timeout=manager_timeout,
+            manager_transport=manager_transport,
         )
         stubs.append(https_stub)
     if "telnet" in protocols:
@@ -141,6 +365,10 @@ async def run_stub(
             port=telnet_port,
             stub_id=stub_id,
             manager_endpoint=manager_endpoint,
+            manager_pool_size=manager_pool_size,
+            manager_keepalive_timeout=manager_keepalive_timeout,
+            manager_timeout=manager_timeout,
+            manager_transport=manager_transport,
         )
         stubs.append(telnet_stub)
     if "snmp" in protocols:
@@ -149,6 +377,10 @@ async def run_stub(
             port=snmp_port,
             stub_id=stub_id,
             manager_endpoint=manager_endpoint,
+            manager_pool_size=manager_pool_size,
+            manager_keepalive_timeout=manager_keepalive_timeout,
+            manager_timeout=manager_timeout,
+            manager_transport=manager_transport,
         )
         stubs.append(snmp_stub)
 
@@ -158,3 +390,160 @@ async def run_stub(
             await asyncio.sleep(3600)
     finally:
         await asyncio.gather(*[stub.stop() for stub in stubs])
+
+
+async def run_stubs(
+    stub_ids: list[str],
+    manager_endpoint: str,
+    host: str,
+    http_port: int,
+    https_port: int,
+    ssh_port: int,
+    telnet_port: int,
+    snmp_port: int,
+    protocols: list[typing.Literal["ssh", "http", "https", "telnet", "snmp"]],
+    allocation: typing.Literal["ip-alias", "port"] = "ip-alias",
+    first_address: str = "127.0.0.1",
+    manager_pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+    manager_keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+    manager_timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+    manager_transport: typing.Literal[
+        "http", "websocket"
+    ] = constants.DEFAULT_MANAGER_TRANSPORT,
+) -> None:
+    if not stub_ids:
+        raise ValueError("stub_ids must be set")
+    if len(set(stub_ids)) != len(stub_ids):
+        raise ValueError("stub_ids must be unique")
+
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(sig=signal.SIGTERM, callback=handle_signal)
+        loop.add_signal_handler(sig=signal.SIGINT, callback=handle_signal)
+    except NotImplementedError:
+        logger.info(f"Signal not implemented.")
+
+    # Setup manager client shared by all stubs
+    client = manager_client.create_client(
+        manager_endpoint=manager_endpoint,
+        transport=manager_transport,
+        pool_size=manager_pool_size,
+        keepalive_timeout=manager_keepalive_timeout,
+        timeout=manager_timeout,
+    )
+
+    stubs = await server.create_stubs(
+        stub_ids=stub_ids,
+        manager_endpoint=manager_endpoint,
+        host=host,
+        http_port=http_port,
+        https_port=https_port,
+        ssh_port=ssh_port,
+        telnet_port=telnet_port,
+        snmp_port=snmp_port,
+        protocols=protocols,
+        allocation=allocation,
+        first_address=first_address,
+        client=client,
+    )
+    logger.info(f"Hosting {len(stub_ids)} stubs ({allocation}).")
+
+    try:
+        await client.start()
+        await asyncio.gather(*[stub.start() for stub in stubs])
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await asyncio.gather(*[stub.stop() for stub in stubs])
+        await client.stop()
+
+
+async def run_embedded(
+    project_path: str,
+    stub_ids: typing.Optional[list[str]],
+    manager_host: str,
+    manager_port: int,
+    host: str,
+    http_port: int,
+    https_port: int,
+    ssh_port: int,
+    telnet_port: int,
+    snmp_port: int,
+    protocols: list[typing.Literal["ssh", "http", "https", "telnet", "snmp"]],
+    allocation: typing.Literal["ip-alias", "port"] = "ip-alias",
+    first_address: str = "127.0.0.1",
+    hot_reload: typing.Literal[
+        "auto", "inotify", "poll", "off"
+    ] = constants.DEFAULT_HOT_RELOAD,
+    hot_reload_interval: float = constants.DEFAULT_HOT_RELOAD_INTERVAL,
+    executor_threads: int = constants.DEFAULT_EXECUTOR_THREADS,
+    max_inflight: int = constants.DEFAULT_MAX_INFLIGHT,
+    max_inflight_per_stub: int = constants.DEFAULT_MAX_INFLIGHT_PER_STUB,
+    max_queue: int = constants.DEFAULT_MAX_QUEUE,
+    queue_timeout: float = constants.DEFAULT_QUEUE_TIMEOUT,
+    snapshot_path: typing.Optional[str] = None,
+    snapshot_interval: float = constants.DEFAULT_SNAPSHOT_INTERVAL,
+    config_idle_timeout: float = constants.DEFAULT_CONFIG_IDLE_TIMEOUT,
+    memory_budget: int = constants.DEFAULT_MEMORY_BUDGET,
+    spill_path: typing.Optional[str] = None,
+) -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(sig=signal.SIGTERM, callback=handle_signal)
+        loop.add_signal_handler(sig=signal.SIGINT, callback=handle_signal)
+    except NotImplementedError:
+        logger.info(f"Signal not implemented.")
+
+    manager = await server.create_manager(
+        host=manager_host,
+        port=manager_port,
+        project_path=project_path,
+        hot_reload=hot_reload,
+        hot_reload_interval=hot_reload_interval,
+        executor_threads=executor_threads,
+        max_inflight=max_inflight,
+        max_inflight_per_stub=max_inflight_per_stub,
+        max_queue=max_queue,
+        queue_timeout=queue_timeout,
+        snapshot_path=snapshot_path,
+        snapshot_interval=snapshot_interval,
+        config_idle_timeout=config_idle_timeout,
+        memory_budget=memory_budget,
+        spill_path=spill_path,
+    )
+
+    # Stubs call the manager application directly in this event loop
+    if not stub_ids:
+        stub_ids = await manager.manager_app.list_stub_ids()
+    if not stub_ids:
+        raise ValueError("No stubs to run")
+    if len(set(stub_ids)) != len(stub_ids):
+        raise ValueError("stub_ids must be unique")
+
+    client = manager_client.DirectClient(manager_app=manager.manager_app)
+    stubs = await server.create_stubs(
+        stub_ids=stub_ids,
+        manager_endpoint=f"http://{manager_host}:{manager_port}",
+        host=host,
+        http_port=http_port,
+        https_port=https_port,
+        ssh_port=ssh_port,
+        telnet_port=telnet_port,
+        snmp_port=snmp_port,
+        protocols=protocols,
+        allocation=allocation,
+        first_address=first_address,
+        client=client,
+    )
+    logger.info(f"Hosting {len(stub_ids)} stubs ({allocation}, embedded).")
+
+    try:
+        await manager.start()
+        await client.start()
+        await asyncio.gather(*[stub.start() for stub in stubs])
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await asyncio.gather(*[stub.stop() for stub in stubs])
+        await client.stop()
+        await manager.stop()
@@ -20,3 +20,9 @@ class RelatedResourceNotFoundError(Error):
 
 class FatalError(Error):
     pass
+
+
+class OverloadedError(Error):
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
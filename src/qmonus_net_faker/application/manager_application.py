@@ -1,18 +1,25 @@
 from __future__ import annotations
 import logging
 import typing
-import json
 import re
 import pathlib
+import asyncio
+import concurrent.futures
 
 import yaml
 
 from . import plugin, exceptions
+from .. import constants
 from ..libs import (
     module_utils,
-    file_lib,
+    dir_watcher,
+    keyed_lock,
+    admission,
     xml_utils,
     yang,
+    hash_ring,
+    snapshot,
+    str_utils,
 )
 from ..domain import (
     file_domain,
@@ -32,21 +39,347 @@ class App(object):
         stub_repo: stub_domain.Repository,
         yang_tree_repo: yang_tree_domain.Repository,
         project_path: pathlib.Path,
+        shard_index: int = 0,
+        shard_count: int = 1,
+        hot_reload: typing.Literal[
+            "auto", "inotify", "poll", "off"
+        ] = constants.DEFAULT_HOT_RELOAD,
+        hot_reload_interval: float = constants.DEFAULT_HOT_RELOAD_INTERVAL,
+        executor_threads: int = constants.DEFAULT_EXECUTOR_THREADS,
+        max_inflight: int = constants.DEFAULT_MAX_INFLIGHT,
+        max_inflight_per_stub: int = constants.DEFAULT_MAX_INFLIGHT_PER_STUB,
+        max_queue: int = constants.DEFAULT_MAX_QUEUE,
+        queue_timeout: float = constants.DEFAULT_QUEUE_TIMEOUT,
+        retry_after: int = constants.DEFAULT_RETRY_AFTER,
+        snapshot_path: typing.Optional[pathlib.Path] = None,
+        snapshot_interval: float = constants.DEFAULT_SNAPSHOT_INTERVAL,
+        journal: typing.Optional[snapshot.Journal] = None,
+        config_idle_timeout: float = constants.DEFAULT_CONFIG_IDLE_TIMEOUT,
     ) -> None:
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f"Invalid shard: {shard_index}/{shard_count}")
+        if hot_reload not in ["auto", "inotify", "poll", "off"]:
+            raise ValueError(f"Invalid hot_reload: '{hot_reload}'")
+        if executor_threads < 0:
+            raise ValueError(f"Invalid executor_threads: '{executor_threads}'")
+        if snapshot_interval < 0:
+            raise ValueError(f"Invalid snapshot_interval: '{snapshot_interval}'")
+        if config_idle_timeout < 0:
+            raise ValueError(f"Invalid config_idle_timeout: '{config_idle_timeout}'")
+
         self._file_repo = file_repo
         self._stub_repo = stub_repo
         self._yang_tree_repo = yang_tree_repo
         self._project_path = project_path
+        self._shard_index = shard_index
+        self._shard_ring = hash_ring.create_shard_ring(shard_count=shard_count)
+
+        self._hot_reload = hot_reload
+        self._hot_reload_interval = hot_reload_interval
+        self._watchers: list[dir_watcher.Watcher] = []
+
+        # Set by the watchers, checked on each request
+        self._module_dirty = False
+        self._yangs_dirty = False
+
+        # 0: datastore operations run on the event loop
+        self._executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+        if executor_threads > 0:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=executor_threads, thread_name_prefix="netfaker-datastore"
+            )
+        self._stub_locks = keyed_lock.KeyedLock()
+
+        # Requests over the limits wait in a bounded queue, beyond which they fail fast
+        self._admission = admission.AdmissionController(
+            max_inflight=max_inflight,
+            max_inflight_per_key=max_inflight_per_stub,
+            max_queue=max_queue,
+            queue_timeout=queue_timeout,
+        )
+        self._retry_after = retry_after
+
+        # The journal (appended by stub_repo) holds the operations since the snapshot
+        self._snapshot_path = snapshot_path
+        self._journal = journal
+        self._snapshot_interval = snapshot_interval
+        self._snapshot_task: typing.Optional[asyncio.Task[None]] = None
+        self._snapshot_lock = asyncio.Lock()
+
+        # 0: configs are kept as trees; otherwise idle ones are kept compressed
+        self._config_idle_timeout = config_idle_timeout
+        self._config_release_task: typing.Optional[asyncio.Task[None]] = None
+
+        # Range templates of stubs.yaml (e.g. 'edge-{0000..9999}'); their stubs are
+        # created on first access, except ones deleted since the last reload
+        self._stub_templates: list[dict[str, typing.Any]] = []
+        # Stubs of stubs.yaml, listed or from a template, deleted since the last
+        # reload; kept in the snapshot so that they stay deleted after a restart
+        self._stub_yaml_ids: set[str] = set()
+        self._deleted_stub_ids: set[str] = set()
+
+        # Dispatch counters; lazily decoded requests skip the parses they never need
+        self._stats = {
+            "requests": 0,
+            "bodyDecodes": 0,
+            "bodyEncodes": 0,
+            "xmlParses": 0,
+            "xmlCopies": 0,
+        }
+
+        # (stub-id, handler) -> handler instance returned by setup()
+        self._handlers: dict[tuple[str, str], asyncio.Future[plugin.Handler]] = {}
+        self._snmp_service = snmp_service_domain.SNMPService()
+        self._netconf_service = netconf_service_domain.NetconfService(
+            session_id=None,
+            yang_tree_repo=self._yang_tree_repo,
+            executor=self._executor,
+        )
 
-        _module_path = self._project_path.joinpath("module")
-        self._module_dir_checker = file_lib.DirChecker(path=_module_path)
+    async def start(self) -> None:
+        if (
+            self._snapshot_path is not None
+            and self._snapshot_interval > 0
+            and self._snapshot_task is None
+        ):
+            self._snapshot_task = asyncio.create_task(self._run_snapshots())
+        if self._config_idle_timeout > 0 and self._config_release_task is None:
+            self._config_release_task = asyncio.create_task(self._run_config_releases())
+
+        if self._hot_reload == "off" or self._watchers:
+            return
+
+        self._watchers = [
+            dir_watcher.create_watcher(
+                path=self._project_path.joinpath("module"),
+                on_change=self._mark_module_dirty,
+                mode=self._hot_reload,
+                interval=self._hot_reload_interval,
+            ),
+            dir_watcher.create_watcher(
+                path=self._project_path.joinpath("yangs"),
+                on_change=self._mark_yangs_dirty,
+                pattern="*/yang_tree/yang_tree_0.part",
+                mode=self._hot_reload,
+                interval=self._hot_reload_interval,
+            ),
+        ]
+        for watcher in self._watchers:
+            await watcher.start()
+
+    async def stop(self) -> None:
+        for watcher in self._watchers:
+            await watcher.stop()
+        self._watchers = []
+        await self._unload_handlers()
+
+        for task in [self._snapshot_task, self._config_release_task]:
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._snapshot_task = None
+        self._config_release_task = None
+        if self._snapshot_path is not None:
+            await self.save_snapshot()
+        if self._journal is not None:
+            self._journal.close()
+
+    async def _run_snapshots(self) -> None:
+        while True:
+            await asyncio.sleep(self._snapshot_interval)
+            if self._journal is not None and self._journal.size == 0:
+                # Nothing has changed since the last checkpoint
+                continue
+            try:
+                await self.save_snapshot()
+            except Exception as e:
+                logger.error(f"Failed to save snapshot: {e}")
+
+    async def _run_config_releases(self) -> None:
+        while True:
+            await asyncio.sleep(self._config_idle_timeout)
+            # Only the configs of this manager's stubs; serializing the released trees
+            # runs in a thread, each config guards its data with a lock
+            config_entities = self._stub_repo.list_config_entities()
+
+            def _release() -> int:
+                return sum(
+                    c.release(self._config_idle_timeout) for c in config_entities
+                )
+
+            released = await asyncio.get_running_loop().run_in_executor(None, _release)
+            if released:
+                logger.debug(f"Released {released} idle configs")
+
+    async def save_snapshot(self) -> int:
+        if self._snapshot_path is None:
+            raise exceptions.FatalError("snapshot_path is not set.")
+        snapshot_path = self._snapshot_path
+
+        async with self._snapshot_lock:
+            # Taking the states is cheap (copy-on-write, spilled ones are read later)
+            # and does not yield to the event loop, so they contain exactly the journal
+            # generations before the new one. Serializing and writing them runs in a
+            # thread, one by one, so requests are handled meanwhile
+            with self._stub_repo.hold_states() as states:
+                generation = 0 if self._journal is None else self._journal.rotate()
+                extra = {"deletedStubIds": sorted(self._deleted_stub_ids)}
+
+                def _save() -> None:
+                    records = ({"id": id, **dump()} for id, dump in states)
+                    snapshot.dump(
+                        path=snapshot_path,
+                        records=records,
+                        generation=generation,
+                        extra=extra,
+                    )
+
+                await asyncio.get_running_loop().run_in_executor(None, _save)
+            if self._journal is not None:
+                self._journal.remove_before(generation)
+        logger.debug(f"Saved {len(states)} stubs to '{snapshot_path}'")
+        return len(states)
+
+    async def restore_snapshot(self) -> int:
+        # Restores the stubs, i.e. call after reload_stubs(), from the snapshot and
+        # the journal generations after it, then starts journaling
+        if self._snapshot_path is None:
+            return 0
+        snapshot_path = self._snapshot_path
+        loop = asyncio.get_running_loop()
+
+        records: list[dict[str, typing.Any]] = []
+        extra: dict[str, typing.Any] = {}
+        operations: list[tuple[str, tuple[typing.Any, ...]]] = []
+        generations = [] if self._journal is None else self._journal.list_generations()
+        try:
+            generation = 0
+            if snapshot_path.exists():
+                records, generation, extra = await loop.run_in_executor(
+                    None, snapshot.load, snapshot_path
+                )
+            for g in generations:
+                if self._journal is not None and g >= generation:
+                    operations += await loop.run_in_executor(
+                        None, self._journal.read, g
+                    )
+        except Exception as e:
+            logger.error(f"Failed to load snapshot '{snapshot_path}': {e}")
+            records, extra, operations = [], {}, []
+        # Stubs of stubs.yaml deleted before the snapshot are removed again, and the
+        # ones of range templates not created again
+        deleted_ids = set(extra.get("deletedStubIds", []))
+        self._deleted_stub_ids.update(deleted_ids)
+        await self._stub_repo.remove(
+            await self._stub_repo.list(
+                id=[stub_domain.Id(value=i) for i in deleted_ids], include_state=False
+            )
+        )
 
-        _yang_path = self._project_path.joinpath("yangs")
-        self._yangs_dir_checker = file_lib.DirChecker(
-            path=_yang_path,
-            glob_pattern="*/yang_tree/yang_tree_0.part",
+        # Stubs of stubs.yaml and range templates are created first; the ones created
+        # over the API are recreated from their records and operations
+        ids = {record["id"] for record in records} | {id for id, _ in operations}
+        for i in ids:
+            await self._get_stub(id=i)
+        stubs = await self._stub_repo.list(id=[stub_domain.Id(value=i) for i in ids])
+        yang_trees = {y.id.value: y for y in await self._yang_tree_repo.list()}
+
+        def _restore() -> dict[str, stub_domain.Entity]:
+            _stubs = {stub.id.value: stub for stub in stubs}
+            for record in records:
+                id = record["id"]
+                if id not in _stubs:
+                    if "attributes" not in record or not self.owns_stub(id=id):
+                        continue
+                    _stubs[id] = stub_domain.Entity.from_attributes(
+                        id=id, attributes=record["attributes"]
+                    )
+                _stubs[id].load_state(record)
+            for id, operation in operations:
+                if operation[0] == "delete":
+                    _stubs.pop(id, None)
+                    continue
+                if id not in _stubs:
+                    # The operations of a stub created since the snapshot start with
+                    # all of its attributes
+                    if operation[0] != "set-attributes" or not self.owns_stub(id=id):
+                        continue
+                    _stubs[id] = stub_domain.Entity.from_attributes(
+                        id=id, attributes=operation[1]
+                    )
+                stub = _stubs[id]
+                try:
+                    stub.apply_operation(
+                        operation, yang_tree=yang_trees.get(stub.yang.value)
+                    )
+                except Exception as e:
+                    logger.warning(f"Failed to replay '{operation[0]}' on '{id}': {e}")
+            return _stubs
+
+        restored = await loop.run_in_executor(None, _restore)
+        removed = [stub for stub in stubs if stub.id.value not in restored]
+        await self._stub_repo.remove(removed)
+        for stub in removed:
+            if self._is_stub_yaml_id(id=stub.id.value):
+                self._deleted_stub_ids.add(stub.id.value)
+        self._deleted_stub_ids.difference_update(restored)
+        await self._stub_repo.save(list(restored.values()))
+        logger.info(
+            f"Restored {len(restored)} stubs from '{snapshot_path}' "
+            f"and {len(operations)} journaled operations"
         )
 
+        # Checkpoint the restored state into a new snapshot and journal generation
+        if self._journal is not None:
+            self._journal.open(max([0, *generations]) + 1)
+        await self.save_snapshot()
+        return len(restored)
+
+    def _mark_module_dirty(self) -> None:
+        self._module_dirty = True
+
+    def _mark_yangs_dirty(self) -> None:
+        self._yangs_dirty = True
+
+    async def _load_handler(self, ctx: plugin.Context) -> plugin.Handler:
+        module_path = f"module.handlers.{ctx.stub.handler.value}"
+        handler_module = module_utils.import_module(
+            module_path=module_path, reload=False
+        )
+        handler: plugin.Handler = await handler_module.setup(ctx)
+        await handler.on_load(ctx)
+        return handler
+
+    async def _get_handler(self, ctx: plugin.Context) -> plugin.Handler:
+        key = (ctx.stub.id.value, ctx.stub.handler.value)
+        future = self._handlers.get(key)
+        if future is None:
+            # Concurrent first requests share one setup()
+            future = asyncio.ensure_future(self._load_handler(ctx))
+            self._handlers[key] = future
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            if self._handlers.get(key) is future:
+                del self._handlers[key]
+            raise
+
+    async def _unload_handlers(self, stub_id: typing.Optional[str] = None) -> None:
+        keys = [k for k in self._handlers if stub_id is None or k[0] == stub_id]
+        for key in keys:
+            future = self._handlers.pop(key)
+            # A handler still in setup() is unloaded once it is set up
+            await asyncio.wait([future])
+            if future.cancelled() or future.exception():
+                continue
+            try:
+                await future.result().on_unload()
+            except Exception:
+                logger.exception(f"Failed to unload handler '{key[1]}': ")
+
     async def create_stub(
         self,
         id: str,
@@ -56,7 +389,7 @@ class App(object):
         enabled: bool,
         metadata: dict[typing.Any, typing.Any],
     ) -> stub_domain.Entity:
-        result = await self._stub_repo.get(id=stub_domain.Id(value=id))
+        result = await self._get_stub(id=id)
         if result:
             raise exceptions.ConflictError(f"stub '{id}' already exists.")
 
@@ -71,11 +404,15 @@ class App(object):
         stub.set_metadata(value=metadata)
 
         await self._stub_repo.add(stub)
+        self._deleted_stub_ids.discard(id)
         return stub
 
     async def list_stubs(
         self,
         id: typing.Union[str, typing.List[str], None] = None,
+        handler: typing.Union[str, typing.List[str], None] = None,
+        yang: typing.Union[str, typing.List[str], None] = None,
+        enabled: typing.Optional[bool] = None,
     ) -> list[stub_domain.Entity]:
         if id is None:
             ids = None
@@ -83,14 +420,36 @@ class App(object):
             ids = [
                 stub_domain.Id(value=i) for i in (id if isinstance(id, list) else [id])
             ]
+            for i in ids:
+                await self._get_stub(id=i.value)
 
         # List
-        stubs = await self._stub_repo.list(id=ids)
+        stubs = await self._stub_repo.list(
+            id=ids,
+            handler=(
+                None
+                if handler is None
+                else [
+                    stub_domain.Handler(value=h)
+                    for h in (handler if isinstance(handler, list) else [handler])
+                ]
+            ),
+            yang=(
+                None
+                if yang is None
+                else [
+                    yang_tree_domain.Id(value=y)
+                    for y in (yang if isinstance(yang, list) else [yang])
+                ]
+            ),
+            enabled=None if enabled is None else stub_domain.Enabled(value=enabled),
+            include_state=False,
+        )
         return stubs
 
     async def get_stub(self, id: str) -> stub_domain.Entity:
         # Get
-        stub = await self._stub_repo.get(id=stub_domain.Id(value=id))
+        stub = await self._get_stub(id=id)
         if not stub:
             raise exceptions.NotFoundError(f"stub '{id}' does not exist.")
         return stub
@@ -104,7 +463,7 @@ class App(object):
         enabled: typing.Optional[bool] = None,
         metadata: typing.Optional[dict[typing.Any, typing.Any]] = None,
     ) -> stub_domain.Entity:
-        stub = await self._stub_repo.get(id=stub_domain.Id(value=id))
+        stub = await self._get_stub(id=id)
         if not stub:
             raise exceptions.NotFoundError(f"stub '{id}' does not exist.")
 
@@ -121,18 +480,26 @@ class App(object):
             stub.set_metadata(value=metadata)
 
         await self._stub_repo.update(entity=stub)
+        await self._unload_handlers(stub_id=id)
         return stub
 
     async def delete_stub(self, id: str) -> None:
-        stub = await self._stub_repo.get(id=stub_domain.Id(value=id))
+        stub = await self._get_stub(id=id)
         if not stub:
             raise exceptions.NotFoundError(f"stub '{id}' does not exist.")
 
         # Delete
         await self._stub_repo.remove(entity=stub)
+        if self._is_stub_yaml_id(id=id):
+            self._deleted_stub_ids.add(id)
+        await self._unload_handlers(stub_id=id)
 
     async def reload_stubs(self) -> list[stub_domain.Entity]:
         await self._stub_repo.remove_all()
+        await self._unload_handlers()
+        self._stub_templates = []
+        self._stub_yaml_ids = set()
+        self._deleted_stub_ids = set()
 
         yaml_file = await self._file_repo.get(
             id=file_domain.Id(value="/stubs/stubs.yaml")
@@ -143,24 +510,73 @@ class App(object):
 
             # Create Entities
             for stub_yaml in _yaml["stubs"]:
-                # Setup variables
-                entity = stub_domain.Entity(
-                    id=stub_domain.Id(value=stub_yaml["id"]),
-                    description=stub_domain.Description(
-                        value=stub_yaml.get("description", "")
-                    ),
-                    handler=stub_domain.Handler(value=stub_yaml["handler"]),
-                    yang=yang_tree_domain.Id(value=stub_yaml.get("yang", "")),
-                    enabled=stub_domain.Enabled(value=stub_yaml.get("enabled", True)),
+                if str_utils.has_range(stub_yaml["id"]):
+                    # Validate the range now, expand it on access
+                    str_utils.validate_range(stub_yaml["id"])
+                    self._stub_templates.append(stub_yaml)
+                    continue
+                if not self.owns_stub(id=stub_yaml["id"]):
+                    continue
+                self._stub_yaml_ids.add(stub_yaml["id"])
+                entities.append(
+                    self._create_stub_entity(id=stub_yaml["id"], stub_yaml=stub_yaml)
                 )
-                entity.set_metadata(value=stub_yaml.get("metadata", {}))
-                entities.append(entity)
 
             await self._stub_repo.save(entity=entities)
 
-        stubs = await self._stub_repo.list()
+        stubs = await self._stub_repo.list(include_state=False)
         return stubs
 
+    def _create_stub_entity(
+        self, id: str, stub_yaml: dict[str, typing.Any]
+    ) -> stub_domain.Entity:
+        entity = stub_domain.Entity(
+            id=stub_domain.Id(value=id),
+            description=stub_domain.Description(value=stub_yaml.get("description", "")),
+            handler=stub_domain.Handler(value=stub_yaml["handler"]),
+            yang=yang_tree_domain.Id(value=stub_yaml.get("yang", "")),
+            enabled=stub_domain.Enabled(value=stub_yaml.get("enabled", True)),
+        )
+        entity.set_metadata(value=stub_yaml.get("metadata", {}))
+        return entity
+
+    def _is_stub_yaml_id(self, id: str) -> bool:
+        return id in self._stub_yaml_ids or self._find_stub_template(id=id) is not None
+
+    def _find_stub_template(self, id: str) -> typing.Optional[dict[str, typing.Any]]:
+        if id in self._deleted_stub_ids or not self.owns_stub(id=id):
+            return None
+        for stub_yaml in self._stub_templates:
+            if str_utils.match_range(stub_yaml["id"], id):
+                return stub_yaml
+        return None
+
+    async def _get_stub(self, id: str) -> typing.Optional[stub_domain.Entity]:
+        # Creates the stub from its range template when accessed for the first time
+        stub = await self._stub_repo.get(id=stub_domain.Id(value=id))
+        if stub is None:
+            stub_yaml = self._find_stub_template(id=id)
+            if stub_yaml is not None:
+                stub = self._create_stub_entity(id=id, stub_yaml=stub_yaml)
+                await self._stub_repo.add(stub)
+        return stub
+
+    async def list_stub_ids(self) -> list[str]:
+        # The stubs that exist and the ones that range templates would create
+        ids = [
+            stub.id.value for stub in await self._stub_repo.list(include_state=False)
+        ]
+        known = set(ids)
+        for stub_yaml in self._stub_templates:
+            for i in str_utils.iter_range(stub_yaml["id"]):
+                if i not in known and self._find_stub_template(id=i) is stub_yaml:
+                    ids.append(i)
+                    known.add(i)
+        return ids
+
+    def owns_stub(self, id: str) -> bool:
+        return self._shard_ring.get_node(id) == str(self._shard_index)
+
     async def list_yangs(
         self,
         id: typing.Union[str, typing.List[str], None] = None,
@@ -219,42 +635,73 @@ class App(object):
                 )
                 await self._yang_tree_repo.add(entity=yang_tree)
 
+    def get_stats(self) -> dict[str, int]:
+        config_entities = self._stub_repo.list_config_entities()
+        return {
+            **self._stats,
+            **self._admission.get_stats(),
+            **self._stub_repo.get_stats(),
+            "distinctConfigs": stub_domain.ConfigEntity.count(config_entities),
+            "materializedConfigs": stub_domain.ConfigEntity.count_materialized(
+                config_entities
+            ),
+        }
+
     async def handle_network_operation(
         self, request: plugin.Request
+    ) -> plugin.Response:
+        self._stats["requests"] += 1
+        try:
+            async with self._admission.admit(request.stub_id):
+                if self._executor is None:
+                    return await self._handle_network_operation(request)
+
+                # Offloaded datastore operations yield to the event loop, so requests for
+                # the same stub are serialized to keep their read-modify-write ordered
+                async with self._stub_locks.acquire(request.stub_id):
+                    return await self._handle_network_operation(request)
+        except admission.OverloadedError as e:
+            raise exceptions.OverloadedError(
+                f"Manager is overloaded: {e}", retry_after=self._retry_after
+            ) from None
+        finally:
+            for k, v in request.parse_counts.items():
+                self._stats[k] += v
+
+    async def _handle_network_operation(
+        self, request: plugin.Request
     ) -> plugin.Response:
         stub_id = request.stub_id
-        req_body = json.loads(request.body)
-        protocol = req_body["protocol"]
+        protocol = request.protocol
 
-        stub = await self._stub_repo.get(id=stub_domain.Id(stub_id))
+        stub = await self._get_stub(id=stub_id)
         if stub is None:
             raise exceptions.NotFoundError(f"stub '{stub_id}' does not exist.")
         if stub.enabled == stub_domain.Enabled(value=False):
             raise exceptions.NotFoundError(f"stub '{stub_id}' is not enabled.")
 
-        netconf_service = netconf_service_domain.NetconfService(
-            session_id=(
-                request.netconf.session_id if hasattr(request, "netconf") else None
-            ),
-            yang_tree_repo=self._yang_tree_repo,
-        )
-        snmp_service = snmp_service_domain.SNMPService()
+        if protocol == "netconf":
+            netconf_service = netconf_service_domain.NetconfService(
+                session_id=request.netconf.session_id,
+                yang_tree_repo=self._yang_tree_repo,
+                executor=self._executor,
+                parse_counts=request.parse_counts,
+            )
+        else:
+            netconf_service = self._netconf_service
 
-        # Import module
-        if self._module_dir_checker.is_changed():
+        # Reload module
+        if self._module_dirty:
+            self._module_dirty = False
             logger.info(f"Reloading module.")
+            await self._unload_handlers()
             module_utils.delete_module(name="module", recursive=True)
-            self._module_dir_checker.refresh()
-        module_path = f"module.handlers.{stub.handler.value}"
-        handler_module = module_utils.import_module(
-            module_path=module_path, reload=False
-        )
 
         # Reset YANG tree
-        if self._yangs_dir_checker.is_changed():
+        if self._yangs_dirty:
+            self._yangs_dirty = False
             logger.info(f"Reloading YANG tree.")
             await self.reload_yangs()
-            self._yangs_dir_checker.refresh()
 
         # Create context
         ctx = plugin.Context(
@@ -263,15 +710,17 @@ class App(object):
             file_repo=self._file_repo,
             stub_repo=self._stub_repo,
             netconf_service=netconf_service,
-            snmp_service=snmp_service,
+            snmp_service=self._snmp_service,
         )
 
         # Setup
-        handler: plugin.Handler = await handler_module.setup(ctx)
+        handler = await self._get_handler(ctx)
 
         # Handle
         if protocol in ["http", "https"]:
             response = await handler.handle_http(ctx)
+            if not isinstance(response, plugin.HttpResponse):
+                response = plugin.HttpResponse.from_response(response)
         elif protocol == "netconf":
             if request.netconf.connection_status == "login":
                 response = await handler.netconf_hello_message(ctx)
@@ -2,11 +2,12 @@ from __future__ import annotations
 import typing
 import re
 import json
+import functools
 
 import multidict
 
 from . import exceptions
-from ..libs import str_utils, xml_utils, netconf
+from ..libs import str_utils, xml_utils, netconf, frame
 from ..domain import (
     file_domain,
     stub_domain,
@@ -15,7 +16,315 @@ from ..domain import (
 )
 
 
+_Endpoint = typing.TypeVar("_Endpoint", bound=typing.Callable[..., typing.Any])
+
+
+def route(method: str, path: str) -> typing.Callable[[_Endpoint], _Endpoint]:
+    # Registers a Handler method for an HTTP method and path template such as
+    # "/restconf/data/interfaces/interface={name}"; "*" matches any method
+    def decorator(func: _Endpoint) -> _Endpoint:
+        routes: list[tuple[str, str]] = func.__dict__.setdefault("_http_routes", [])
+        routes.append((method.upper(), path))
+        return func
+
+    return decorator
+
+
+class _RouteNode(object):
+    def __init__(self) -> None:
+        self.static: dict[str, _RouteNode] = {}
+        self.dynamic: list[tuple[str, re.Pattern[str], _RouteNode]] = []
+        self.endpoints: dict[str, str] = {}
+
+
+class RouteMatch(object):
+    def __init__(
+        self,
+        endpoint: typing.Optional[str],
+        params: dict[str, str],
+        allowed_methods: list[str],
+    ) -> None:
+        self.endpoint = endpoint
+        self.params = params
+        self.allowed_methods = allowed_methods
+
+
+class Router(object):
+    # Path templates are split into segments and compiled into a prefix trie once.
+    # Static segments are looked up by dict, so resolving costs one step per segment
+    # and templated segments are only tried where the static ones do not match.
+    def __init__(self) -> None:
+        self._root = _RouteNode()
+
+    def add(self, method: str, path: str, endpoint: str) -> None:
+        node = self._root
+        for segment in path.split("/"):
+            if "{" not in segment:
+                node = node.static.setdefault(segment, _RouteNode())
+                continue
+            for template, _, child in node.dynamic:
+                if template == segment:
+                    break
+            else:
+                child = _RouteNode()
+                node.dynamic.append((segment, _compile_template(segment), child))
+            node = child
+
+        method = method.upper()
+        if method in node.endpoints:
+            raise exceptions.FatalError(f"Duplicate route: '{method} {path}'")
+        node.endpoints[method] = endpoint
+
+    def resolve(self, method: str, path: str) -> RouteMatch:
+        params: dict[str, str] = {}
+        node = self._find(self._root, path.split("/"), 0, params)
+        if node is None:
+            return RouteMatch(endpoint=None, params={}, allowed_methods=[])
+        endpoint = node.endpoints.get(method.upper(), node.endpoints.get("*"))
+        return RouteMatch(
+            endpoint=endpoint,
+            params=params if endpoint is not None else {},
+            allowed_methods=list(node.endpoints),
+        )
+
+    def _find(
+        self,
+        node: _RouteNode,
+        segments: list[str],
+        index: int,
+        params: dict[str, str],
+    ) -> typing.Optional[_RouteNode]:
+        if index == len(segments):
+            return node if node.endpoints else None
+
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            found = self._find(child, segments, index + 1, params)
+            if found is not None:
+                return found
+
+        for _, pattern, child in node.dynamic:
+            m = pattern.match(segment)
+            if m is None:
+                continue
+            found = self._find(child, segments, index + 1, params)
+            if found is not None:
+                params.update(m.groupdict())
+                return found
+        return None
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_template(template: str) -> re.Pattern[str]:
+    return re.compile(
+        r"\A" + re.sub(r"{([a-zA-Z0-9_]+?)}", r"(?P<\1>[^/]+)", template) + r"\Z"
+    )
+
+
+def command(
+    command: str, mode: typing.Optional[str] = None
+) -> typing.Callable[[_Endpoint], _Endpoint]:
+    # Registers a Handler method for an SSH/TELNET command such as
+    # "show interfaces {name}" in 'mode' (all modes if None).
+    # Keywords may be abbreviated; "{name*}" as the last word captures the rest of the line
+    def decorator(func: _Endpoint) -> _Endpoint:
+        commands: list[tuple[str, typing.Optional[str]]] = func.__dict__.setdefault(
+            "_cli_commands", []
+        )
+        commands.append((command, mode))
+        return func
+
+    return decorator
+
+
+class _CommandNode(object):
+    def __init__(self) -> None:
+        self.keywords: dict[str, _CommandNode] = {}
+        # Every prefix of the keywords; None if it is shared by several of them
+        self.abbreviations: dict[str, typing.Optional[str]] = {}
+        self.parameter: typing.Optional[tuple[str, bool, _CommandNode]] = None
+        self.endpoint: typing.Optional[str] = None
+
+    def add_keyword(self, keyword: str) -> _CommandNode:
+        child = self.keywords.get(keyword)
+        if child is None:
+            child = _CommandNode()
+            self.keywords[keyword] = child
+            for i in range(1, len(keyword) + 1):
+                prefix = keyword[:i]
+                if self.abbreviations.get(prefix, keyword) != keyword:
+                    self.abbreviations[prefix] = None
+                else:
+                    self.abbreviations[prefix] = keyword
+        return child
+
+
+class CommandMatch(object):
+    def __init__(
+        self,
+        endpoint: typing.Optional[str],
+        params: dict[str, str],
+        error: typing.Optional[
+            typing.Literal["empty", "unknown", "ambiguous", "incomplete"]
+        ],
+    ) -> None:
+        self.endpoint = endpoint
+        self.params = params
+        self.error = error
+
+
+class CommandTree(object):
+    # One word trie per mode. Abbreviations are indexed when a command is added,
+    # so dispatch costs one dict lookup per input word whatever the number of commands
+    def __init__(self, modes: list[str]) -> None:
+        self._roots = {mode: _CommandNode() for mode in modes}
+
+    def add(self, command: str, mode: typing.Optional[str], endpoint: str) -> None:
+        if mode is not None and mode not in self._roots:
+            raise exceptions.FatalError(f"Undefined mode: '{mode}'")
+        for root in self._roots.values() if mode is None else [self._roots[mode]]:
+            self._add(root, command, endpoint)
+
+    def _add(self, node: _CommandNode, command: str, endpoint: str) -> None:
+        words = command.split()
+        for i, word in enumerate(words):
+            m = re.fullmatch(r"{([a-zA-Z0-9_]+)(\*?)}", word)
+            if m is None:
+                node = node.add_keyword(word)
+                continue
+
+            name, rest = m.group(1), m.group(2) == "*"
+            if rest and i != len(words) - 1:
+                raise exceptions.FatalError(
+                    f"'{word}' must be the last word: '{command}'"
+                )
+            if node.parameter is None:
+                node.parameter = (name, rest, _CommandNode())
+            elif node.parameter[:2] != (name, rest):
+                raise exceptions.FatalError(
+                    f"Conflicting parameter '{word}': '{command}'"
+                )
+            node = node.parameter[2]
+
+        if node.endpoint is not None:
+            raise exceptions.FatalError(f"Duplicate command: '{command}'")
+        node.endpoint = endpoint
+
+    def resolve(self, mode: str, input: str) -> CommandMatch:
+        root = self._roots.get(mode)
+        if root is None:
+            raise exceptions.FatalError(f"Undefined mode: '{mode}'")
+
+        words = list(re.finditer(r"\S+", input))
+        if not words:
+            return CommandMatch(endpoint=None, params={}, error="empty")
+        params: dict[str, str] = {}
+        node, error = self._find(root, input, words, 0, params)
+        if node is None:
+            return CommandMatch(endpoint=None, params={}, error=error)
+        return CommandMatch(endpoint=node.endpoint, params=params, error=None)
+
+    def _find(
+        self,
+        node: _CommandNode,
+        input: str,
+        words: list[re.Match[str]],
+        index: int,
+        params: dict[str, str],
+    ) -> tuple[
+        typing.Optional[_CommandNode],
+        typing.Literal["unknown", "ambiguous", "incomplete"],
+    ]:
+        if index == len(words):
+            if node.endpoint is not None:
+                return node, "unknown"
+            if node.parameter is not None and node.parameter[1]:
+                params[node.parameter[0]] = ""
+                return node.parameter[2], "unknown"
+            return None, "incomplete"
+
+        word = words[index].group()
+        error: typing.Literal["unknown", "ambiguous", "incomplete"] = "unknown"
+        keyword = word if word in node.keywords else node.abbreviations.get(word)
+        if keyword is not None:
+            found, error = self._find(
+                node.keywords[keyword], input, words, index + 1, params
+            )
+            if found is not None:
+                return found, error
+        elif word in node.abbreviations:
+            error = "ambiguous"
+
+        # Keywords take precedence over a parameter at the same position
+        if node.parameter is not None:
+            name, rest, child = node.parameter
+            if rest:
+                params[name] = input[words[index].start() :].rstrip()
+                return child, error
+            found, _ = self._find(child, input, words, index + 1, params)
+            if found is not None:
+                params[name] = word
+                return found, error
+        return None, error
+
+
+class CliSession(object):
+    def __init__(
+        self,
+        username: str,
+        mode: str,
+        input: str,
+        state: dict[typing.Any, typing.Any],
+    ) -> None:
+        # Command endpoints may switch 'mode' and keep their own values in 'state'
+        self.username = username
+        self.mode = mode
+        self.input = input
+        self.state = state
+
+
 class Handler(object):
+    # CLI modes and their prompt templates ({username}, {description}: stub description);
+    # sessions start in the first mode
+    cli_modes: typing.ClassVar[dict[str, str]] = {
+        "default": "{username}@{description}> "
+    }
+
+    # Routes registered with @plugin.route and commands registered with
+    # @plugin.command, compiled once per class
+    _router: typing.ClassVar[typing.Optional[Router]] = None
+    _commands: typing.ClassVar[typing.Optional[CommandTree]] = None
+
+    def __init_subclass__(cls, **kwargs: typing.Any) -> None:
+        super().__init_subclass__(**kwargs)
+        routes: dict[str, list[tuple[str, str]]] = {}
+        commands: dict[str, list[tuple[str, typing.Optional[str]]]] = {}
+        for klass in reversed(cls.__mro__):
+            for name, attr in vars(klass).items():
+                if callable(attr):
+                    routes[name] = getattr(attr, "_http_routes", [])
+                    commands[name] = getattr(attr, "_cli_commands", [])
+
+        router = Router()
+        for name, endpoint_routes in routes.items():
+            for method, path in endpoint_routes:
+                router.add(method=method, path=path, endpoint=name)
+        cls._router = router if any(routes.values()) else None
+
+        command_tree = CommandTree(modes=list(cls.cli_modes))
+        for name, endpoint_commands in commands.items():
+            for _command, mode in endpoint_commands:
+                command_tree.add(command=_command, mode=mode, endpoint=name)
+        cls._commands = command_tree if any(commands.values()) else None
+
+    # Instances are cached per stub; hooks run once per instance
+    async def on_load(self, ctx: Context) -> None:
+        pass
+
+    async def on_unload(self) -> None:
+        pass
+
     async def netconf_hello_message(self, ctx: Context) -> Response:
         raise NotImplementedError("'get_netconf_hello_message' is not implemented.")
 
@@ -23,23 +332,94 @@ class Handler(object):
         raise NotImplementedError("'handle_netconf' is not implemented.")
 
     async def handle_http(self, ctx: Context) -> Response:
-        raise NotImplementedError("'handle_http' is not implemented.")
+        if self._router is None:
+            raise NotImplementedError("'handle_http' is not implemented.")
+
+        http = ctx.request.http
+        match = self._router.resolve(method=http.method, path=http.path)
+        if match.endpoint is None:
+            if match.allowed_methods:
+                return http.create_response(
+                    code=405, headers={"allow": ", ".join(match.allowed_methods)}
+                )
+            return http.create_response(code=404)
+        endpoint: typing.Callable[..., typing.Awaitable[Response]] = getattr(
+            self, match.endpoint
+        )
+        return await endpoint(ctx, **match.params)
 
     async def ssh_login_message(self, ctx: Context) -> Response:
         raise NotImplementedError("'get_ssh_login_message' is not implemented.")
 
     async def handle_ssh(self, ctx: Context) -> Response:
-        raise NotImplementedError("'handle_ssh' is not implemented.")
+        if self._commands is None:
+            raise NotImplementedError("'handle_ssh' is not implemented.")
+        return await self.handle_command(ctx, ctx.request.ssh)
 
     async def telnet_login_message(self, ctx: Context) -> Response:
         raise NotImplementedError("'get_telnet_login_message' is not implemented.")
 
     async def handle_telnet(self, ctx: Context) -> Response:
-        raise NotImplementedError("'handle_telnet' is not implemented.")
+        if self._commands is None:
+            raise NotImplementedError("'handle_telnet' is not implemented.")
+        return await self.handle_command(ctx, ctx.request.telnet)
 
     async def handle_snmp(self, ctx: Context) -> Response:
         raise NotImplementedError("'handle_snmp' is not implemented.")
 
+    async def handle_command(
+        self, ctx: Context, request: typing.Union[SSHRequest, TelnetRequest]
+    ) -> Response:
+        if self._commands is None:
+            raise exceptions.FatalError("No command is registered.")
+
+        state = request.state
+        if isinstance(request, SSHRequest):
+            username = request.username
+        else:
+            username = state.get("username", "")
+        session = CliSession(
+            username=username,
+            mode=state.get("mode", next(iter(self.cli_modes))),
+            input=request.input,
+            state=state,
+        )
+
+        match = self._commands.resolve(mode=session.mode, input=request.input)
+        if match.endpoint is None:
+            output = await self.command_error(
+                ctx, session, typing.cast(str, match.error)
+            )
+        else:
+            endpoint: typing.Callable[..., typing.Awaitable[str]] = getattr(
+                self, match.endpoint
+            )
+            output = await endpoint(ctx, session, **match.params)
+
+        state["mode"] = session.mode
+        return request.create_response(
+            output=output,
+            prompt=self.create_prompt(ctx, username=username, mode=session.mode),
+            state=state,
+        )
+
+    async def command_error(self, ctx: Context, session: CliSession, error: str) -> str:
+        # error: 'empty', 'unknown', 'ambiguous' or 'incomplete'
+        if error == "empty":
+            return "\n"
+        return f"\n{error} command.\n\n"
+
+    def create_prompt(
+        self, ctx: Context, username: str, mode: typing.Optional[str] = None
+    ) -> str:
+        if mode is None:
+            mode = next(iter(self.cli_modes))
+        elif mode not in self.cli_modes:
+            raise exceptions.FatalError(f"Undefined mode: '{mode}'")
+        return self.cli_modes[mode].format(
+            username=username, description=ctx.stub.description
+        )
+
 
 class Request(object):
     def __init__(
@@ -50,8 +430,9 @@ class Request(object):
         path: str,
         query: dict[str, list[str]],
         headers: multidict.MultiMapping[str],
-        body: str,
+        body: typing.Optional[str],
         stub_id: str,
+        json_body: typing.Optional[dict[str, typing.Any]] = None,
     ) -> None:
         self.scheme = scheme
         self.method = method
@@ -59,18 +440,49 @@ class Request(object):
         self.path = path
         self.query = query
         self.headers = headers
-        self.body = body
         self.stub_id = stub_id
-        self.http: HttpRequest
-        self.netconf: NetconfRequest
-        self.ssh: SSHRequest
-        self.telnet: TelnetRequest
-        self.snmp: SNMPRequest
-
-        json_body = json.loads(body)
-        protocol = json_body["protocol"]
-        if protocol in ["http", "https"]:
-            self.http = HttpRequest(
+
+        # Each layer is decoded on first access only: the JSON envelope (framed requests
+        # arrive already decoded), the protocol sub-request, and the NETCONF rpc tree
+        if json_body is None and body is None:
+            raise exceptions.FatalError(f"Invalid request")
+        self._body = body
+        self._json_body = json_body
+        self._http: typing.Optional[HttpRequest] = None
+        self._netconf: typing.Optional[NetconfRequest] = None
+        self._ssh: typing.Optional[SSHRequest] = None
+        self._telnet: typing.Optional[TelnetRequest] = None
+        self._snmp: typing.Optional[SNMPRequest] = None
+        self.parse_counts = {
+            "bodyDecodes": 0,
+            "bodyEncodes": 0,
+            "xmlParses": 0,
+            "xmlCopies": 0,
+        }
+
+    @property
+    def json_body(self) -> dict[str, typing.Any]:
+        if self._json_body is None:
+            self._json_body = json.loads(typing.cast(str, self._body))
+            self.parse_counts["bodyDecodes"] += 1
+        return self._json_body
+
+    @property
+    def protocol(self) -> str:
+        protocol: str = self.json_body["protocol"]
+        return protocol
+
+    def _check_protocol(self, name: str, protocols: list[str]) -> None:
+        # AttributeError keeps hasattr(request, "netconf") meaningful for other protocols
+        if self.protocol not in protocols:
+            raise AttributeError(f"'{name}' is not available for '{self.protocol}'")
+
+    @property
+    def http(self) -> HttpRequest:
+        if self._http is None:
+            self._check_protocol("http", ["http", "https"])
+            json_body = self.json_body
+            self._http = HttpRequest(
                 scheme=json_body["protocol"],
                 method=json_body["method"],
                 path=json_body["path"],
@@ -78,7 +490,13 @@ class Request(object):
                 headers=multidict.CIMultiDict(json_body["headers"]),
                 body=json_body["body"],
             )
-        elif protocol == "netconf":
+        return self._http
+
+    @property
+    def netconf(self) -> NetconfRequest:
+        if self._netconf is None:
+            self._check_protocol("netconf", ["netconf"])
+            json_body = self.json_body
             if json_body["connectionStatus"] == "login":
                 rpc_xml = xml_utils.from_string("<rpc/>", ignore_namespace=False)
                 protocol_operation = ""
@@ -87,10 +505,11 @@ class Request(object):
                 rpc_xml = xml_utils.from_string(
                     json_body["rpc"], ignore_namespace=False
                 )
+                self.parse_counts["xmlParses"] += 1
                 protocol_operation = netconf.Netconf.get_protocol_operation(rpc_xml)
                 message_id = netconf.Netconf.get_message_id(rpc=rpc_xml)
 
-            self.netconf = NetconfRequest(
+            self._netconf = NetconfRequest(
                 connection_status=json_body["connectionStatus"],
                 username=json_body["username"],
                 session_id=json_body["sessionId"],
@@ -98,8 +517,14 @@ class Request(object):
                 protocol_operation=protocol_operation,
                 message_id=message_id,
             )
-        elif protocol == "ssh":
-            self.ssh = SSHRequest(
+        return self._netconf
+
+    @property
+    def ssh(self) -> SSHRequest:
+        if self._ssh is None:
+            self._check_protocol("ssh", ["ssh"])
+            json_body = self.json_body
+            self._ssh = SSHRequest(
                 connection_status=json_body["connectionStatus"],
                 username=json_body["username"],
                 session_id=json_body["sessionId"],
@@ -107,16 +532,28 @@ class Request(object):
                 prompt=json_body["prompt"],
                 state=json_body["state"],
             )
-        elif protocol == "telnet":
-            self.telnet = TelnetRequest(
+        return self._ssh
+
+    @property
+    def telnet(self) -> TelnetRequest:
+        if self._telnet is None:
+            self._check_protocol("telnet", ["telnet"])
+            json_body = self.json_body
+            self._telnet = TelnetRequest(
                 connection_status=json_body["connectionStatus"],
                 session_id=json_body["sessionId"],
                 input=json_body["input"],
                 prompt=json_body["prompt"],
                 state=json_body["state"],
             )
-        elif protocol == "snmp":
-            self.snmp = SNMPRequest(
+        return self._telnet
+
+    @property
+    def snmp(self) -> SNMPRequest:
+        if self._snmp is None:
+            self._check_protocol("snmp", ["snmp"])
+            json_body = self.json_body
+            self._snmp = SNMPRequest(
                 pdu_type=json_body["pduType"],
                 version=json_body["version"],
                 request_id=json_body["requestId"],
@@ -125,8 +562,14 @@ class Request(object):
                 non_repeaters=json_body["non_repeaters"],
                 max_repetitions=json_body["max_repetitions"],
             )
-        else:
-            raise exceptions.FatalError(f"Invalid request")
+        return self._snmp
+
+    @property
+    def body(self) -> str:
+        if self._body is None:
+            self._body = json.dumps(self._json_body)
+            self.parse_counts["bodyEncodes"] += 1
+        return self._body
 
     def to_dict(self) -> dict[str, typing.Any]:
         return {
@@ -140,9 +583,7 @@ class Request(object):
         }
 
     def match_path(self, path: str) -> typing.Optional[re.Match[str]]:
-        regex = r"\A" + re.sub(r"{([a-zA-Z0-9_]+?)}", r"(?P<\1>[^/]+)", path) + r"\Z"
-        m = re.match(regex, self.path)
-        return m
+        return _compile_template(path).match(self.path)
 
 
 class HttpRequest(object):
@@ -177,18 +618,10 @@ class HttpRequest(object):
             _headers = multidict.CIMultiDict(headers)
         _headers["content-type"] = "application/json"
 
-        res_body = json.dumps(
-            {
-                "code": code,
-                "headers": dict(_headers),
-                "body": None if body is None else json.dumps(body),
-            }
-        )
-
-        response = Response(
-            code=200,
-            headers=multidict.CIMultiDict({"content-type": "application/json"}),
-            body=res_body,
+        response = HttpResponse(
+            code=code,
+            headers=_headers,
+            body=None if body is None else json.dumps(body),
         )
         return response
 
@@ -205,22 +638,14 @@ class HttpRequest(object):
             _headers = multidict.CIMultiDict(headers)
         _headers["content-type"] = "application/xml"
 
-        res_body = json.dumps(
-            {
-                "code": code,
-                "headers": dict(_headers),
-                "body": (
-                    body
-                    if (body is None or isinstance(body, str))
-                    else xml_utils.to_string(body)
-                ),
-            }
-        )
-
-        response = Response(
-            code=200,
-            headers=multidict.CIMultiDict({"content-type": "application/json"}),
-            body=res_body,
+        response = HttpResponse(
+            code=code,
+            headers=_headers,
+            body=(
+                body
+                if (body is None or isinstance(body, str))
+                else xml_utils.to_string(body)
+            ),
         )
         return response
 
@@ -230,18 +655,10 @@ class HttpRequest(object):
         headers: typing.Union[dict[str, str], multidict.CIMultiDict[str], None] = None,
         body: typing.Optional[str] = None,
     ) -> Response:
-        res_body = json.dumps(
-            {
-                "code": code,
-                "headers": {} if headers is None else dict(headers),
-                "body": body,
-            }
-        )
-
-        response = Response(
-            code=200,
-            headers=multidict.CIMultiDict({"content-type": "application/json"}),
-            body=res_body,
+        response = HttpResponse(
+            code=code,
+            headers=multidict.CIMultiDict() if headers is None else headers,
+            body=body,
         )
         return response
 
@@ -294,21 +711,9 @@ class NetconfRequest(object):
                 "urn:ietf:params:netconf:capability:interleave:1.0",
             ]
 
-        variables = {
-            "session_id": self.session_id,
-            "capabilities": capabilities,
-        }
-        template = """
-            <hello xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-                <capabilities>
-                    {% for capability in capabilities %}
-                    <capability>{{ capability }}</capability>
-                    {% endfor %}
-                </capabilities>
-                <session-id>{{ session_id }}</session-id>
-            </hello>
-        """
-        hello = str_utils.render(template=template, variables=variables)
+        hello = netconf.render_hello_message(
+            session_id=self.session_id, capabilities=capabilities
+        )
 
         headers: multidict.CIMultiDict[str] = multidict.CIMultiDict()
         headers["content-type"] = "application/xml"
@@ -431,6 +836,66 @@ class Response(object):
             "body": self.body,
         }
 
+    def to_envelope(self) -> tuple[dict[str, typing.Any], bytes]:
+        header = {"code": self.code, "headers": dict(self.headers)}
+        payload = b"" if self.body is None else self.body.encode("utf-8")
+        return header, payload
+
+    def to_frame(self, header: typing.Optional[dict[str, typing.Any]] = None) -> bytes:
+        _header, payload = self.to_envelope()
+        if header is not None:
+            _header = {**header, **_header}
+        return frame.encode(header=_header, payload=payload)
+
+
+class HttpResponse(Response):
+    # Keeps the device response as-is; the legacy JSON envelope is built only when read,
+    # and is not cached so that it always matches http_code/http_headers/http_body
+    def __init__(
+        self,
+        code: int,
+        headers: typing.Union[dict[str, str], multidict.CIMultiDict[str]],
+        body: typing.Optional[str],
+    ) -> None:
+        self.code = 200
+        self.headers = multidict.CIMultiDict({"content-type": "application/json"})
+        self.http_code = code
+        self.http_headers = multidict.CIMultiDict(headers)
+        self.http_body = body
+
+    @property  # type: ignore[override]
+    def body(self) -> typing.Optional[str]:
+        return json.dumps(
+            {
+                "code": self.http_code,
+                "headers": dict(self.http_headers),
+                "body": self.http_body,
+            }
+        )
+
+    @body.setter
+    def body(self, value: typing.Optional[str]) -> None:
+        # A handler rewriting the envelope changes what to_envelope() sends
+        envelope = json.loads(value or "null")
+        self.http_code = envelope["code"]
+        self.http_headers = multidict.CIMultiDict(envelope["headers"])
+        self.http_body = envelope["body"]
+
+    def to_envelope(self) -> tuple[dict[str, typing.Any], bytes]:
+        header = {"code": self.http_code, "headers": dict(self.http_headers)}
+        payload = b"" if self.http_body is None else self.http_body.encode("utf-8")
+        return header, payload
+
+    @classmethod
+    def from_response(cls, response: Response) -> HttpResponse:
+        # For handlers that build the JSON envelope of an http response by themselves
+        envelope = json.loads(response.body or "null")
+        return cls(
+            code=envelope["code"],
+            headers=envelope["headers"],
+            body=envelope["body"],
+        )
+
 
 class Context(object):
     def __init__(
@@ -448,3 +913,5 @@ class Context(object):
         self.stub_repo = stub_repo
         self.netconf_service = netconf_service
         self.snmp_service = snmp_service
+        # Shared jinja2 environment that caches compiled templates by source
+        self.template_env = str_utils.get_environment()
@@ -1,4 +1,23 @@
+import typing
+
 DEFAULT_LOG_LEVEL = "info"
 DEFAULT_MAX_LOG_FILE_SIZE = 3 * 1024 * 1024
 DEFAULT_MAX_LOG_FILE_BACKUP_COUNT = 2
 LOG_FORMAT = "[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s"
+DEFAULT_MANAGER_POOL_SIZE = 100
+DEFAULT_MANAGER_KEEPALIVE_TIMEOUT = 60.0
+DEFAULT_MANAGER_TIMEOUT = 300
+DEFAULT_MANAGER_TRANSPORT: typing.Final = "http"
+DEFAULT_HOT_RELOAD: typing.Final = "auto"
+DEFAULT_HOT_RELOAD_INTERVAL = 1.0
+DEFAULT_EXECUTOR_THREADS = 0
+DEFAULT_MAX_INFLIGHT = 0
+DEFAULT_MAX_INFLIGHT_PER_STUB = 0
+DEFAULT_MAX_QUEUE = 0
+DEFAULT_QUEUE_TIMEOUT = 10.0
+DEFAULT_RETRY_AFTER = 1
+DEFAULT_SNAPSHOT_INTERVAL = 60.0
+DEFAULT_CONFIG_IDLE_TIMEOUT = 0.0
+DEFAULT_MEMORY_BUDGET = 0
+# Shown by the CLI stubs when the manager refuses a request under load
+DEVICE_BUSY_MESSAGE = "error: the device is busy, try again later"
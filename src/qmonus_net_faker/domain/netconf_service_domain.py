@@ -1,11 +1,16 @@
 import logging
 import typing
+import asyncio
+import functools
+import concurrent.futures
 
-from ..libs import netconf, xml_utils, str_utils
+from ..libs import netconf, xml_utils
 from . import yang_tree_domain, stub_domain
 
 logger = logging.getLogger(__name__)
 
+T = typing.TypeVar("T")
+
 YANG_NAMESPACE = "urn:ietf:params:xml:ns:netconf:base:1.0"
 
 
@@ -14,30 +19,70 @@ class NetconfService(object):
         self,
         session_id: typing.Optional[int],
         yang_tree_repo: yang_tree_domain.Repository,
+        executor: typing.Optional[concurrent.futures.Executor] = None,
+        parse_counts: typing.Optional[dict[str, int]] = None,
     ):
         self._session_id = session_id
         self._yang_tree_repo = yang_tree_repo
+        self._executor = executor
+        self._parse_counts = parse_counts
+
+    async def _run(
+        self,
+        func: typing.Callable[..., T],
+        *args: typing.Any,
+        **kwargs: typing.Any,
+    ) -> T:
+        # Datastore operations are lxml CPU work; with an executor they leave the event loop.
+        # Callers serialize requests per stub (see manager_application.App)
+        if self._executor is None:
+            return func(*args, **kwargs)
+
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Do not let the next request for this stub start while the call is running
+            await asyncio.wait([future])
+            raise
+
+    @staticmethod
+    def _find(rpc: typing.Any, path: str) -> list[typing.Any]:
+        # Match on local names so the request-owned rpc tree is left untouched
+        steps = path.split("/")[1:]
+        return typing.cast(
+            list[typing.Any],
+            rpc.xpath("./" + "/".join(f"*[local-name()='{s}']" for s in steps)),
+        )
+
+    def _strip_namespace(self, xml: typing.Any) -> typing.Any:
+        # Only the subtree handed to the datastore is copied, not the whole rpc
+        xml = xml_utils.copy_xml(xml)
+        xml_utils.delete_namespace(xml)
+        if self._parse_counts is not None:
+            self._parse_counts["xmlCopies"] += 1
+        return xml
 
     async def execute(self, stub: stub_domain.Entity, rpc: typing.Any) -> typing.Any:
         message_id = netconf.Netconf.get_message_id(rpc)
         protocol_operation = netconf.Netconf.get_protocol_operation(rpc=rpc)
-        rpc = xml_utils.copy_xml(rpc)
-        xml_utils.delete_namespace(rpc)
 
         datastore: typing.Any
         if protocol_operation in ["get-config"]:
-            if rpc.xpath("./get-config/source/candidate"):
+            if self._find(rpc, "./get-config/source/candidate"):
                 datastore = "candidate"
-            elif rpc.xpath("./get-config/source/running"):
+            elif self._find(rpc, "./get-config/source/running"):
                 datastore = "running"
-            elif rpc.xpath("./get-config/source/startup"):
+            elif self._find(rpc, "./get-config/source/startup"):
                 datastore = "startup"
             else:
                 raise ValueError("Invalid request: {}".format(xml_utils.to_string(rpc)))
 
-            results = rpc.xpath("./get-config/filter")
+            results = self._find(rpc, "./get-config/filter")
             if len(results) != 0:
-                filter = results[0]
+                filter = self._strip_namespace(results[0])
             else:
                 filter = None
 
@@ -48,9 +93,9 @@ class NetconfService(object):
                 filter=filter,
             )
         elif protocol_operation in ["get"]:
-            results = rpc.xpath("./get/filter")
+            results = self._find(rpc, "./get/filter")
             if len(results) != 0:
-                filter = results[0]
+                filter = self._strip_namespace(results[0])
             else:
                 filter = None
 
@@ -60,18 +105,20 @@ class NetconfService(object):
                 filter=filter,
             )
         elif protocol_operation in ["validate"]:
-            if rpc.xpath("./validate/source/candidate"):
+            if self._find(rpc, "./validate/source/candidate"):
                 datastore = "candidate"
                 config = None
-            elif rpc.xpath("./validate/source/running"):
+            elif self._find(rpc, "./validate/source/running"):
                 datastore = "running"
                 config = None
-            elif rpc.xpath("./validate/source/startup"):
+            elif self._find(rpc, "./validate/source/startup"):
                 datastore = "startup"
                 config = None
-            elif rpc.xpath("./validate/source/config"):
+            elif self._find(rpc, "./validate/source/config"):
                 datastore = None
-                config = rpc.xpath("./validate/source/config")[0]
+                config = self._strip_namespace(
+                    self._find(rpc, "./validate/source/config")[0]
+                )
             else:
                 raise ValueError("Invalid request: {}".format(xml_utils.to_string(rpc)))
 
@@ -92,16 +139,16 @@ class NetconfService(object):
                 stub=stub,
             )
         elif protocol_operation in ["edit-config"]:
-            if rpc.xpath("./edit-config/target/candidate"):
+            if self._find(rpc, "./edit-config/target/candidate"):
                 datastore = "candidate"
-            elif rpc.xpath("./edit-config/target/running"):
+            elif self._find(rpc, "./edit-config/target/running"):
                 datastore = "running"
             else:
                 raise ValueError("Invalid request: {}".format(xml_utils.to_string(rpc)))
 
-            config = rpc.xpath("./edit-config/config")[0]
+            config = self._strip_namespace(self._find(rpc, "./edit-config/config")[0])
 
-            results = rpc.xpath("./edit-config/default-operation")
+            results = self._find(rpc, "./edit-config/default-operation")
             default_operation: typing.Any
             if len(results) == 0:
                 default_operation = "merge"
@@ -142,7 +189,8 @@ class NetconfService(object):
             raise ValueError(f"YANG '{stub.yang.value}' does not exist.")
 
         try:
-            config = stub.get_config(
+            config = await self._run(
+                stub.get_config,
                 datastore=datastore,
                 yang_tree=yang_tree,
                 filter=filter,
@@ -176,7 +224,8 @@ class NetconfService(object):
             raise ValueError(f"YANG '{stub.yang}' does not exist.")
 
         try:
-            config = stub.get_config(
+            config = await self._run(
+                stub.get_config,
                 datastore="running",
                 yang_tree=yang_tree,
                 filter=filter,
@@ -237,7 +286,8 @@ class NetconfService(object):
             raise ValueError("YANG '{}' not exists".format(stub.yang))
 
         try:
-            stub.validate_config(
+            await self._run(
+                stub.validate_config,
                 datastore=datastore,
                 config=config,
                 yang_tree=yang_tree,
@@ -265,7 +315,8 @@ class NetconfService(object):
             raise ValueError("YANG '{}' not exists".format(stub.yang))
 
         try:
-            stub.edit_config(
+            await self._run(
+                stub.edit_config,
                 datastore=datastore,
                 config=config,
                 yang_tree=yang_tree,
@@ -291,7 +342,7 @@ class NetconfService(object):
             raise ValueError("YANG '{}' not exists".format(stub.yang))
 
         try:
-            stub.discard_config_changes()
+            await self._run(stub.discard_config_changes)
             rpc_reply = self.create_rpc_ok_reply(message_id=message_id)
         except Exception as e:
             logger.exception(e)
@@ -311,7 +362,7 @@ class NetconfService(object):
             raise ValueError("YANG '{}' not exists".format(stub.yang))
 
         try:
-            stub.commit_config()
+            await self._run(stub.commit_config)
             rpc_reply = self.create_rpc_ok_reply(message_id=message_id)
         except Exception as e:
             logger.exception(e)
@@ -375,17 +426,6 @@ class NetconfService(object):
         return xml
 
     def create_hello_message(self, capabilities: list[str]) -> typing.Any:
-        variables = {"session_id": self._session_id, "capabilities": capabilities}
-        template = """
-        <hello xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-            <capabilities>
-                {% for capability in capabilities %}
-                <capability>{{ capability }}</capability>
-                {% endfor %}
-            </capabilities>
-            <session-id>{{ session_id }}</session-id>
-        </hello>
-        """
-        hello_str = str_utils.render(template=template, variables=variables)
-        hello = xml_utils.from_string(hello_str)
-        return hello
+        return netconf.Netconf.create_hello_message(
+            session_id=self._session_id, capabilities=capabilities
+        )
@@ -4,14 +4,33 @@ import typing
 import json
 import copy
 import abc
-
-from ..libs import xml_utils, yang
+import hashlib
+import threading
+import weakref
+import time
+import zlib
+
+from ..libs import xml_utils
+from ..libs import yang as yang_lib
 from ..domain import yang_tree_domain
 
 logger = logging.getLogger(__name__)
 
 
 class Entity(object):
+    # Parts of the state tracked for partial saves (see get_changes)
+    PARTS = (
+        "description",
+        "handler",
+        "yang",
+        "enabled",
+        "candidate",
+        "running",
+        "startup",
+        "metadata",
+        "snmp",
+    )
+
     def __init__(
         self,
         id: Id,
@@ -20,45 +39,298 @@ class Entity(object):
         yang: yang_tree_domain.Id,
         enabled: Enabled,
     ) -> None:
+        # A new entity has no stored counterpart, so all of its parts are changed
+        self._changes: typing.Set[str] = set(self.PARTS)
+        # Operations on the state since this snapshot was taken (see take_operations)
+        self._operations: typing.List[typing.Tuple[typing.Any, ...]] = []
+
         self.id = id
-        self.description = description
-        self.enabled = enabled
-        self.handler = handler
-        self.yang = yang
+        self._description = description
+        self._enabled = enabled
+        self._handler = handler
+        self._yang = yang
+        self._reset_state()
+        # Replaying the operations of a new entity creates it (see from_attributes)
+        self._operations.insert(0, ("set-attributes", self._dump_attributes()))
+
+    @classmethod
+    def from_attributes(cls, id: str, attributes: dict[str, typing.Any]) -> Entity:
+        # An entity with the attributes of dump_state() or of a 'set-attributes'
+        # operation; attributes it does not contain are left empty
+        return cls(
+            id=Id(value=id),
+            description=Description(value=attributes.get("description", "")),
+            handler=Handler(value=attributes.get("handler", "")),
+            yang=yang_tree_domain.Id(value=attributes.get("yang", "")),
+            enabled=Enabled(value=attributes.get("enabled", True)),
+        )
 
+    def _reset_state(self) -> None:
         self._snmp_objects: typing.Dict[str, SnmpObject] = {}
+        # True while the dict is shared with a snapshot; copied before the next write
+        self._snmp_objects_shared = False
 
-        self._candidate_config = ConfigEntity(
-            value=xml_utils.from_string(string="<root/>")
-        )
-        self._running_config = ConfigEntity(
-            value=xml_utils.from_string(string="<root/>")
-        )
-        self._startup_config = ConfigEntity(
-            value=xml_utils.from_string(string="<root/>")
-        )
+        self._candidate_config = ConfigEntity.from_string(string="<root/>")
+        self._running_config = self._candidate_config
+        self._startup_config = self._candidate_config
         self._metadata = MetadataEntity(value={})
+        self._changes.update(("candidate", "running", "startup", "metadata", "snmp"))
+        self._operations = [("reset",)]
+
+    def snapshot(self) -> Entity:
+        # Config trees, metadata and SNMP objects are never modified in place (getters
+        # return copies, setters replace them), so snapshots share them; only the SNMP
+        # object dict is copied, on the first write after the snapshot
+        entity = copy.copy(self)
+        self._snmp_objects_shared = True
+        entity._snmp_objects_shared = True
+        entity._changes = set()
+        entity._operations = []
+        return entity
+
+    def get_changes(self) -> typing.Set[str]:
+        # Parts modified since this snapshot was taken
+        return set(self._changes)
+
+    def clear_changes(self) -> None:
+        self._changes.clear()
+        self._operations.clear()
+
+    def take_operations(self) -> typing.List[typing.Tuple[typing.Any, ...]]:
+        # Operations on the state since the last call, as plain values; replaying them
+        # with apply_operation() on the previous state reproduces the current one
+        operations = [
+            tuple(a.to_string() if isinstance(a, ConfigEntity) else a for a in o)
+            for o in self._operations
+        ]
+        self._operations = []
+        return operations
+
+    def apply_operation(
+        self,
+        operation: typing.Tuple[typing.Any, ...],
+        yang_tree: typing.Optional[yang_tree_domain.Entity],
+    ) -> None:
+        name, *args = operation
+        if name == "reset":
+            self._reset_state()
+        elif name == "set-attributes":
+            self._load_attributes(args[0])
+            self._operations.append(operation)
+        elif name == "set-config":
+            datastore, string = args
+            self._set_config(datastore, ConfigEntity.from_string(string))
+        elif name == "edit-config":
+            datastore, string, default_operation = args
+            if yang_tree is None:
+                raise ValueError(f"YANG '{self.yang}' not exists")
+            self.edit_config(
+                datastore=datastore,
+                config=xml_utils.from_string(string=string),
+                yang_tree=yang_tree,
+                default_operation=default_operation,
+            )
+        elif name == "discard-changes":
+            self.discard_config_changes()
+        elif name == "commit":
+            self.commit_config()
+        elif name == "set-metadata":
+            self.set_metadata(value=args[0])
+        elif name == "set-snmp-object":
+            oid, type, value = args
+            self.set_snmp_object(oid=oid, type=type, value=value)
+        elif name == "delete-snmp-object":
+            self.delete_snmp_object(oid=args[0])
+        elif name == "delete-all-snmp-objects":
+            self.delete_all_snmp_objects()
+        else:
+            raise ValueError(f"Invalid operation: '{name}'")
+
+    def apply_changes(self, entity: Entity) -> None:
+        # Takes over the changed parts of 'entity' (a snapshot of the same stub)
+        for part in entity._changes:
+            if part in ("candidate", "running", "startup"):
+                self._set_config_entity(part, entity._get_config_entity(part))
+            elif part == "metadata":
+                self._metadata = entity._metadata
+            elif part == "snmp":
+                self._snmp_objects = entity._snmp_objects
+                self._snmp_objects_shared = True
+                entity._snmp_objects_shared = True
+            else:
+                setattr(self, f"_{part}", getattr(entity, f"_{part}"))
+        self._changes.clear()
+
+    def _dump_attributes(self) -> dict[str, typing.Any]:
+        return {
+            "description": self._description.value,
+            "handler": self._handler.value,
+            "yang": self._yang.value,
+            "enabled": self._enabled.value,
+        }
+
+    def _load_attributes(self, attributes: dict[str, typing.Any]) -> None:
+        if "description" in attributes:
+            self._description = Description(value=attributes["description"])
+        if "handler" in attributes:
+            self._handler = Handler(value=attributes["handler"])
+        if "yang" in attributes:
+            self._yang = yang_tree_domain.Id(value=attributes["yang"])
+        if "enabled" in attributes:
+            self._enabled = Enabled(value=attributes["enabled"])
+        self._changes.update(attributes)
+
+    def dump_state(self) -> dict[str, typing.Any]:
+        # Plain values of the attributes, datastores, metadata and SNMP objects; a
+        # datastore sharing its tree with another one (e.g. after a commit) refers to
+        # it instead
+        configs: dict[str, str] = {}
+        shared_configs: dict[str, str] = {}
+        datastores: dict[int, str] = {}
+        for datastore in ("running", "candidate", "startup"):
+            config_entity = self._get_config_entity(datastore)
+            if id(config_entity) in datastores:
+                shared_configs[datastore] = datastores[id(config_entity)]
+            else:
+                datastores[id(config_entity)] = datastore
+                configs[datastore] = config_entity.to_string()
+        return {
+            "attributes": self._dump_attributes(),
+            "configs": configs,
+            "sharedConfigs": shared_configs,
+            "metadata": self._metadata.value,
+            "snmpObjects": [
+                (o.oid, o.type, o.value) for o in self._snmp_objects.values()
+            ],
+        }
+
+    def list_config_entities(self) -> typing.List[ConfigEntity]:
+        # The distinct configs of the datastores
+        config_entities: typing.List[ConfigEntity] = []
+        for datastore in ("running", "candidate", "startup"):
+            config_entity = self._get_config_entity(datastore)
+            if all(c is not config_entity for c in config_entities):
+                config_entities.append(config_entity)
+        return config_entities
+
+    def estimate_size(self) -> int:
+        # Approximate memory held by the state; a config shared between datastores
+        # counts once, one shared with other stubs only in part
+        config_entities = {id(c._data): c for c in self.list_config_entities()}
+        size = int(sum(c.estimate_memory_size() for c in config_entities.values()))
+        size += len(json.dumps(self._metadata.value, default=str))
+        size += sum(
+            len(o.oid) + len(o.type) + len(str(o.value))
+            for o in self._snmp_objects.values()
+        )
+        return size
+
+    def load_state(self, state: dict[str, typing.Any]) -> None:
+        # Inverse of dump_state; restoring is not recorded as an operation
+        self._load_attributes(state.get("attributes", {}))
+        config_entities = {
+            datastore: ConfigEntity.from_string(string)
+            for datastore, string in state["configs"].items()
+        }
+        for datastore, shared_datastore in state["sharedConfigs"].items():
+            config_entities[datastore] = config_entities[shared_datastore]
+        for datastore, config_entity in config_entities.items():
+            self._set_config_entity(datastore, config_entity)
+
+        self._metadata = MetadataEntity(value=state["metadata"])
+        self._changes.add("metadata")
+        self._snmp_objects = {
+            oid: SnmpObject(oid=oid, type=type, value=value)
+            for oid, type, value in state["snmpObjects"]
+        }
+        self._snmp_objects_shared = False
+        self._changes.add("snmp")
+
+    @property
+    def description(self) -> Description:
+        return self._description
+
+    @description.setter
+    def description(self, value: Description) -> None:
+        self._description = value
+        self._changes.add("description")
+        self._operations.append(("set-attributes", {"description": value.value}))
+
+    @property
+    def handler(self) -> Handler:
+        return self._handler
+
+    @handler.setter
+    def handler(self, value: Handler) -> None:
+        self._handler = value
+        self._changes.add("handler")
+        self._operations.append(("set-attributes", {"handler": value.value}))
+
+    @property
+    def yang(self) -> yang_tree_domain.Id:
+        return self._yang
+
+    @yang.setter
+    def yang(self, value: yang_tree_domain.Id) -> None:
+        self._yang = value
+        self._changes.add("yang")
+        self._operations.append(("set-attributes", {"yang": value.value}))
+
+    @property
+    def enabled(self) -> Enabled:
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value: Enabled) -> None:
+        self._enabled = value
+        self._changes.add("enabled")
+        self._operations.append(("set-attributes", {"enabled": value.value}))
+
+    def _get_config_entity(self, datastore: str) -> ConfigEntity:
+        if datastore == "candidate":
+            return self._candidate_config
+        elif datastore == "running":
+            return self._running_config
+        elif datastore == "startup":
+            return self._startup_config
+        else:
+            raise ValueError(f"Invalid datastore: '{datastore}'")
+
+    def _set_config_entity(self, datastore: str, config_entity: ConfigEntity) -> None:
+        if datastore == "candidate":
+            self._candidate_config = config_entity
+        elif datastore == "running":
+            self._running_config = config_entity
+        elif datastore == "startup":
+            self._startup_config = config_entity
+        else:
+            raise ValueError(f"Invalid datastore: '{datastore}'")
+        self._changes.add(datastore)
+
+    def _set_config(self, datastore: str, config_entity: ConfigEntity) -> None:
+        self._set_config_entity(datastore, config_entity)
+        self._operations.append(("set-config", datastore, config_entity))
 
     # candidate config
     def get_candidate_config(self) -> typing.Any:
         return xml_utils.copy_xml(self._candidate_config.value)
 
     def set_candidate_config(self, config: typing.Any) -> None:
-        self._candidate_config = ConfigEntity(value=xml_utils.copy_xml(config))
+        self._set_config("candidate", ConfigEntity.create(value=config))
 
     # running config
     def get_running_config(self) -> typing.Any:
         return xml_utils.copy_xml(self._running_config.value)
 
     def set_running_config(self, config: typing.Any) -> None:
-        self._running_config = ConfigEntity(value=xml_utils.copy_xml(config))
+        self._set_config("running", ConfigEntity.create(value=config))
 
     # startup_config
     def get_startup_config(self) -> typing.Any:
         return xml_utils.copy_xml(self._startup_config.value)
 
     def set_startup_config(self, config: typing.Any) -> None:
-        self._startup_config = ConfigEntity(value=xml_utils.copy_xml(config))
+        self._set_config("startup", ConfigEntity.create(value=config))
 
     # metadata
     def get_metadata(self) -> dict[typing.Any, typing.Any]:
@@ -66,13 +338,20 @@ class Entity(object):
 
     def set_metadata(self, value: dict[typing.Any, typing.Any]) -> None:
         self._metadata = MetadataEntity(copy.deepcopy(value))
+        self._changes.add("metadata")
+        self._operations.append(("set-metadata", self._metadata.value))
 
     # SNMP
     def get_snmp_object(self, oid: str) -> typing.Optional[SnmpObject]:
-        return copy.deepcopy(self._snmp_objects.get(oid))
+        return copy.copy(self._snmp_objects.get(oid))
 
     def list_snmp_objects(self) -> dict[str, SnmpObject]:
-        return copy.deepcopy(self._snmp_objects)
+        return {oid: copy.copy(o) for oid, o in self._snmp_objects.items()}
+
+    def _own_snmp_objects(self) -> None:
+        if self._snmp_objects_shared:
+            self._snmp_objects = dict(self._snmp_objects)
+            self._snmp_objects_shared = False
 
     def set_snmp_object(
         self,
@@ -93,13 +372,22 @@ class Entity(object):
         ],
         value: typing.Any,
     ) -> None:
+        self._own_snmp_objects()
+        self._changes.add("snmp")
         self._snmp_objects[oid] = SnmpObject(oid=oid, type=type, value=value)
+        self._operations.append(("set-snmp-object", oid, type, value))
 
     def delete_snmp_object(self, oid: str) -> None:
+        self._own_snmp_objects()
+        self._changes.add("snmp")
         del self._snmp_objects[oid]
+        self._operations.append(("delete-snmp-object", oid))
 
     def delete_all_snmp_objects(self) -> None:
         self._snmp_objects = {}
+        self._snmp_objects_shared = False
+        self._changes.add("snmp")
+        self._operations.append(("delete-all-snmp-objects",))
 
     def edit_config(
         self,
@@ -108,17 +396,12 @@ class Entity(object):
         yang_tree: yang_tree_domain.Entity,
         default_operation: typing.Literal["merge", "replace", "none"] = "merge",
     ) -> None:
+        # The edit itself, not the result, is recorded (see take_operations)
+        string = xml_utils.to_string(config, pretty_print=False)
         _config = xml_utils.copy_xml(config)
         xml_utils.delete_namespace(_config, backup_attr="namespace")
 
-        if datastore == "candidate":
-            target_config = self.get_candidate_config()
-        elif datastore == "running":
-            target_config = self.get_running_config()
-        elif datastore == "startup":
-            target_config = self.get_startup_config()
-        else:
-            raise ValueError(f"Invalid datastore: {datastore}")
+        target_config = xml_utils.copy_xml(self._get_config_entity(datastore).value)
 
         if default_operation not in ["merge", "replace", "none"]:
             raise ValueError(f"Invalid default_operation: '{default_operation}'")
@@ -134,18 +417,15 @@ class Entity(object):
         )
         self._delete_empty_containers(root_config=target_config)
 
-        if datastore == "candidate":
-            self.set_candidate_config(target_config)
-        elif datastore == "running":
-            self.set_running_config(target_config)
-        elif datastore == "startup":
-            self.set_startup_config(target_config)
-        else:
-            raise ValueError(f"Invalid datastore: {datastore}")
+        # target_config is already a private copy
+        self._set_config_entity(
+            datastore, ConfigEntity.create(value=target_config, owned=True)
+        )
+        self._operations.append(("edit-config", datastore, string, default_operation))
 
     def _edit_config_rec(
         self,
-        node: yang.YangNode,
+        node: yang_lib.YangNode,
         target_config: typing.Any,
         request_config: typing.Any,
         default_operation: typing.Literal["merge", "replace", "none"],
@@ -427,7 +707,7 @@ class Entity(object):
         return target_config
 
     def _filter_config(
-        self, node: yang.YangNode, target_config: typing.Any, filter: typing.Any
+        self, node: yang_lib.YangNode, target_config: typing.Any, filter: typing.Any
     ) -> None:
         self._set_visible_flag(
             node=node,
@@ -443,7 +723,7 @@ class Entity(object):
             xml_utils.delete(element)
 
     def _set_visible_flag(
-        self, node: yang.YangNode, target_config: typing.Any, filter: typing.Any
+        self, node: yang_lib.YangNode, target_config: typing.Any, filter: typing.Any
     ) -> None:
         def _set_visible_flag(
             parent_node: typing.Any,
@@ -700,10 +980,12 @@ class Entity(object):
             raise Exception(f"ValidationError: {e}")
 
     def discard_config_changes(self) -> None:
-        self._candidate_config = ConfigEntity(value=self.get_running_config())
+        self._set_config_entity("candidate", self._running_config)
+        self._operations.append(("discard-changes",))
 
     def commit_config(self) -> None:
-        self._running_config = ConfigEntity(value=self.get_candidate_config())
+        self._set_config_entity("running", self._candidate_config)
+        self._operations.append(("commit",))
 
 
 class MetadataEntity(object):
@@ -712,10 +994,143 @@ class MetadataEntity(object):
         self.value = value
 
 
+class _ConfigData(object):
+    # The tree and/or the compressed serialized form of a config; the lock guards
+    # them against releasing in another thread
+    def __init__(self, value: typing.Any) -> None:
+        # The tree, or None while the config is at rest as compressed bytes
+        self.value: typing.Any = value
+        self.compressed: typing.Optional[bytes] = None
+        self.size: typing.Optional[int] = None
+        self.last_access = time.monotonic()
+        # Reentrant: an owner may be finalized while its thread holds the lock
+        self.lock = threading.RLock()
+        # Entities holding the data, i.e. sharing it once it is interned
+        self.owners = 1
+
+    def disown(self) -> None:
+        with self.lock:
+            self.owners -= 1
+
+
 class ConfigEntity(object):
+    # Trees are never modified in place, so entities holding the same config share
+    # its data. A config is interned by content only once it is serialized anyway
+    # (for the journal, a snapshot or while idle), not on every change. The pool is
+    # shared by all managers of the process
+    _pool: typing.ClassVar[weakref.WeakValueDictionary[bytes, _ConfigData]] = (
+        weakref.WeakValueDictionary()
+    )
+    _pool_lock: typing.ClassVar[threading.Lock] = threading.Lock()
+
     def __init__(self, value: typing.Any) -> None:
         self.id = "0"
-        self.value = value
+        self._data = _ConfigData(value=value)
+
+    @property
+    def value(self) -> typing.Any:
+        data = self._data
+        with data.lock:
+            data.last_access = time.monotonic()
+            if data.value is None:
+                assert data.compressed is not None
+                data.value = xml_utils.from_string(
+                    string=zlib.decompress(data.compressed).decode("utf-8")
+                )
+            return data.value
+
+    @classmethod
+    def create(cls, value: typing.Any, owned: bool = False) -> ConfigEntity:
+        # 'owned': the caller hands over a private tree, which need not be copied
+        return cls(value=value if owned else xml_utils.copy_xml(value))
+
+    @classmethod
+    def from_string(cls, string: str) -> ConfigEntity:
+        # Parsed on first access
+        config_entity = cls(value=None)
+        config_entity._set_string(string)
+        return config_entity
+
+    def _set_string(self, string: str) -> None:
+        # Keeps the serialized config compressed and shares the data of an equal one;
+        # called with the lock of the (not yet shared) data held
+        key = hashlib.blake2b(string.encode("utf-8"), digest_size=16).digest()
+        data = self._data
+        with self._pool_lock:
+            interned = self._pool.get(key)
+        if interned is None:
+            data.compressed = zlib.compress(string.encode("utf-8"), 1)
+            data.size = len(string)
+            with self._pool_lock:
+                interned = self._pool.setdefault(key, data)
+        if interned is not data:
+            with interned.lock:
+                if interned.value is None:
+                    interned.value = data.value
+                interned.owners += 1
+            self._data = interned
+        # Only interned data is shared; its owners drop out as their entities are freed
+        weakref.finalize(self, interned.disown)
+
+    def _serialize(self, data: _ConfigData) -> str:
+        # Called with the lock of 'data' held
+        string = xml_utils.to_string(data.value, pretty_print=False)
+        self._set_string(string)
+        return string
+
+    def to_string(self) -> str:
+        # Serialized only once; unchanged configs keep the compressed form
+        data = self._data
+        with data.lock:
+            if data.compressed is None:
+                return self._serialize(data)
+            compressed = data.compressed
+        return zlib.decompress(compressed).decode("utf-8")
+
+    @property
+    def size(self) -> int:
+        # Length of the serialized config; measured without interning a new config
+        data = self._data
+        with data.lock:
+            if data.size is None:
+                data.size = len(xml_utils.to_string(data.value, pretty_print=False))
+            return data.size
+
+    def estimate_memory_size(self) -> float:
+        # The tree is counted by its serialized length, the compressed bytes of a
+        # config at rest by their length; either is split among the entities
+        # sharing the data
+        data = self._data
+        if data.value is None and data.compressed is not None:
+            size = len(data.compressed)
+        else:
+            size = self.size
+        return size / max(data.owners, 1)
+
+    def release(self, idle_timeout: float) -> bool:
+        # Drops the tree if it has not been accessed for 'idle_timeout' seconds
+        data = self._data
+        with data.lock:
+            if data.value is None or time.monotonic() - data.last_access < idle_timeout:
+                return False
+            if data.compressed is None:
+                self._serialize(data)
+            if self._data is data:
+                data.value = None
+                return True
+        # The data of an equal config was taken over, which may be in use
+        return self.release(idle_timeout)
+
+    @staticmethod
+    def count(config_entities: typing.Iterable[ConfigEntity]) -> int:
+        # Distinct configs among 'config_entities'
+        return len({id(c._data) for c in config_entities})
+
+    @staticmethod
+    def count_materialized(config_entities: typing.Iterable[ConfigEntity]) -> int:
+        # Distinct configs among 'config_entities' currently held as trees
+        datas = {id(c._data): c._data for c in config_entities}
+        return sum(d.value is not None for d in datas.values())
 
 
 class Id(object):
@@ -811,8 +1226,26 @@ class Repository(abc.ABC):
 
     @abc.abstractmethod
     async def list(
-        self, id: typing.Union[Id, typing.List[Id], None] = None
+        self,
+        id: typing.Union[Id, typing.List[Id], None] = None,
+        handler: typing.Optional[typing.List[Handler]] = None,
+        yang: typing.Optional[typing.List[yang_tree_domain.Id]] = None,
+        enabled: typing.Optional[Enabled] = None,
+        include_state: bool = True,
     ) -> typing.List[Entity]:
+        # Without 'include_state', stubs whose state is not in memory may have their
+        # attributes and metadata only, e.g. for listing
+        pass
+
+    @abc.abstractmethod
+    def hold_states(
+        self,
+    ) -> typing.ContextManager[
+        typing.List[typing.Tuple[str, typing.Callable[[], dict[str, typing.Any]]]]
+    ]:
+        # (id, function returning dump_state()) of the stubs as of now, e.g. for a
+        # snapshot; the functions may be called in another thread until the end of
+        # the context
         pass
 
     @abc.abstractmethod
@@ -834,3 +1267,10 @@ class Repository(abc.ABC):
     @abc.abstractmethod
     async def remove_all(self) -> None:
         pass
+
+    def get_stats(self) -> dict[str, int]:
+        return {}
+
+    def list_config_entities(self) -> typing.List[ConfigEntity]:
+        # The configs held in memory, e.g. to release idle ones
+        return []
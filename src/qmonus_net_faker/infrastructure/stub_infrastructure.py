@@ -1,44 +1,296 @@
 import logging
 import typing
-import copy
+import asyncio
+import pathlib
+import hashlib
+import tempfile
+import functools
+import contextlib
+import collections
 
-from ..domain import stub_domain
+from ..libs import snapshot
+from ..domain import stub_domain, yang_tree_domain
 
 logger = logging.getLogger(__name__)
 
 
 class Repository(stub_domain.Repository):
-    def __init__(self) -> None:
+    # Stores and hands out copy-on-write snapshots (see stub_domain.Entity.snapshot);
+    # with a journal, the operations of each saved entity are appended to it
+    def __init__(
+        self,
+        journal: typing.Optional[snapshot.Journal] = None,
+        memory_budget: int = 0,
+        spill_path: typing.Optional[pathlib.Path] = None,
+    ) -> None:
+        if memory_budget < 0:
+            raise ValueError(f"Invalid memory_budget: '{memory_budget}'")
+
+        self._journal = journal
         self._entity_map: typing.Dict[str, stub_domain.Entity] = {}
+        # Insertion order of each id, so filtered lists keep the order of the full list
+        self._positions: typing.Dict[str, int] = {}
+        self._next_position = 0
+        # Secondary indexes: field -> value -> ids
+        self._indexes: typing.Dict[str, typing.Dict[typing.Any, typing.Set[str]]] = {
+            "handler": {},
+            "yang": {},
+            "enabled": {},
+        }
+
+        # With a budget (0: unlimited) for the estimated size of the stub states, the
+        # least recently used states beyond it are spilled to files in 'spill_path'
+        # (a temporary directory if omitted); the stored entity keeps the attributes
+        self._memory_budget = memory_budget
+        self._spill_path = spill_path
+        self._spill_dir: typing.Optional[tempfile.TemporaryDirectory[str]] = None
+        # Resident ids -> estimated size, least recently used first
+        self._resident: collections.OrderedDict[str, int] = collections.OrderedDict()
+        self._resident_size = 0
+        # Ids -> count of their last access or save, to tell whether a stub was used
+        # while its state was being spilled
+        self._accesses: typing.Dict[str, int] = {}
+        self._access_count = 0
+        # Spilled ids -> file with the state; each spill writes a new file
+        self._spill_files: typing.Dict[str, pathlib.Path] = {}
+        self._spill_count = 0
+        # While states are held (see hold_states), dropped files are deleted later
+        self._holds = 0
+        self._held_spill_files: typing.List[pathlib.Path] = []
+        self._stats = {"stubEvictions": 0, "stubReloads": 0}
+
+    def get_stats(self) -> typing.Dict[str, int]:
+        return {
+            **self._stats,
+            "residentStubs": len(self._entity_map) - len(self._spill_files),
+            "residentBytes": self._resident_size,
+            "spilledStubs": len(self._spill_files),
+        }
+
+    def list_config_entities(self) -> typing.List[stub_domain.ConfigEntity]:
+        # Spilled stubs hold no configs in memory
+        config_entities: typing.Dict[int, stub_domain.ConfigEntity] = {}
+        for stub_id, entity in self._entity_map.items():
+            if stub_id not in self._spill_files:
+                for c in entity.list_config_entities():
+                    config_entities[id(c)] = c
+        return list(config_entities.values())
+
+    def _new_spill_file(self, id: str) -> pathlib.Path:
+        if self._spill_path is None:
+            self._spill_dir = tempfile.TemporaryDirectory(prefix="netfaker-spill-")
+            self._spill_path = pathlib.Path(self._spill_dir.name)
+        elif not self._spill_path.is_dir():
+            self._spill_path.mkdir(parents=True)
+        self._spill_count += 1
+        name = hashlib.sha1(id.encode("utf-8")).hexdigest()
+        return self._spill_path.joinpath(f"{name}.{self._spill_count}")
+
+    def _drop_spill_file(self, id: str) -> None:
+        path = self._spill_files.pop(id)
+        if self._holds:
+            self._held_spill_files.append(path)
+        else:
+            path.unlink(missing_ok=True)
+
+    async def _touch(self, id: str) -> typing.Optional[stub_domain.Entity]:
+        # Makes the stub the most recently used one, resident, and returns it; None if
+        # it was removed while its state was read back
+        self._mark_access(id)
+        path = self._spill_files.get(id)
+        if path is not None:
+            state = await asyncio.get_running_loop().run_in_executor(
+                None, _read_spill_file, path
+            )
+            # Unless another task has read it back or removed it meanwhile
+            if self._spill_files.get(id) is path:
+                entity = self._entity_map[id].snapshot()
+                entity.load_state(state)
+                entity.clear_changes()
+                self._entity_map[id] = entity
+                self._drop_spill_file(id)
+                self._set_resident(id, entity)
+                self._stats["stubReloads"] += 1
+        elif id in self._resident:
+            self._resident.move_to_end(id)
+        return self._entity_map.get(id)
+
+    def _mark_access(self, id: str) -> None:
+        self._access_count += 1
+        self._accesses[id] = self._access_count
+
+    def _set_resident(self, id: str, entity: stub_domain.Entity) -> None:
+        if not self._memory_budget:
+            return
+        size = entity.estimate_size()
+        self._resident_size += size - self._resident.pop(id, 0)
+        self._resident[id] = size
+
+    def _unset_resident(self, id: str) -> None:
+        self._resident_size -= self._resident.pop(id, 0)
+
+    async def _evict(self) -> None:
+        # Spills the least recently used states until the rest fits in the budget;
+        # the most recently used stub always stays. The states are written in a
+        # thread, the stored entity keeps the attributes and metadata
+        spills = []
+        while self._resident_size > self._memory_budget and len(self._resident) > 1:
+            id = next(iter(self._resident))
+            self._unset_resident(id)
+            spills.append(
+                (
+                    id,
+                    self._accesses.get(id),
+                    self._entity_map[id],
+                    self._new_spill_file(id),
+                )
+            )
+        if not spills:
+            return
+
+        def _write() -> None:
+            for _, _, entity, path in spills:
+                path.write_bytes(snapshot.dumps(entity.dump_state()))
+
+        await asyncio.get_running_loop().run_in_executor(None, _write)
+        for id, access, entity, path in spills:
+            if self._accesses.get(id) != access:
+                # Used, saved or removed while being written; a stub only read
+                # stays resident as the most recently used one
+                path.unlink(missing_ok=True)
+                if id in self._entity_map and id not in self._resident:
+                    self._set_resident(id, self._entity_map[id])
+                continue
+            placeholder = stub_domain.Entity(
+                id=entity.id,
+                description=entity.description,
+                handler=entity.handler,
+                yang=entity.yang,
+                enabled=entity.enabled,
+            )
+            placeholder.set_metadata(value=entity.get_metadata())
+            placeholder.clear_changes()
+            self._entity_map[id] = placeholder
+            self._spill_files[id] = path
+            self._stats["stubEvictions"] += 1
+
+    def _index_keys(self, entity: stub_domain.Entity) -> typing.Dict[str, typing.Any]:
+        return {
+            "handler": entity.handler.value,
+            "yang": entity.yang.value,
+            "enabled": entity.enabled.value,
+        }
+
+    def _index(self, entity: stub_domain.Entity) -> None:
+        for field, key in self._index_keys(entity).items():
+            self._indexes[field].setdefault(key, set()).add(entity.id.value)
+
+    def _unindex(self, entity: stub_domain.Entity) -> None:
+        for field, key in self._index_keys(entity).items():
+            ids = self._indexes[field][key]
+            ids.discard(entity.id.value)
+            if not ids:
+                del self._indexes[field][key]
 
     async def get(
         self,
         id: stub_domain.Id,
     ) -> typing.Optional[stub_domain.Entity]:
-        stubs = await self.list(id=id)
-        if stubs:
-            return stubs[0]
-        else:
+        if id.value not in self._entity_map:
             return None
+        entity = await self._touch(id.value)
+        await self._evict()
+        return None if entity is None else entity.snapshot()
 
     async def list(
         self,
         id: typing.Union[stub_domain.Id, typing.List[stub_domain.Id], None] = None,
+        handler: typing.Optional[typing.List[stub_domain.Handler]] = None,
+        yang: typing.Optional[typing.List[yang_tree_domain.Id]] = None,
+        enabled: typing.Optional[stub_domain.Enabled] = None,
+        include_state: bool = True,
     ) -> typing.List[stub_domain.Entity]:
-        if id is None:
-            ids = None
+        # Each given condition narrows the candidates by a lookup; values of one
+        # condition are alternatives (OR), conditions are combined with AND
+        candidates: typing.List[typing.Set[str]] = []
+        if id is not None:
+            ids = {i.value for i in (id if isinstance(id, list) else [id])}
+            candidates.append(ids.intersection(self._entity_map))
+        if handler is not None:
+            candidates.append(self._lookup("handler", [h.value for h in handler]))
+        if yang is not None:
+            candidates.append(self._lookup("yang", [y.value for y in yang]))
+        if enabled is not None:
+            candidates.append(self._lookup("enabled", [enabled.value]))
+
+        if candidates:
+            candidates.sort(key=len)
+            matched = candidates[0].intersection(*candidates[1:])
+            listed = sorted(matched, key=self._positions.__getitem__)
         else:
-            ids = [i.value for i in (id if isinstance(id, list) else [id])]
+            listed = list(self._entity_map)
+        entities = [self._entity_map[i].snapshot() for i in listed]
+        if not include_state:
+            return entities
 
-        entities = []
-        for entity_id, entity in self._entity_map.items():
-            if ids is not None:
-                if entity_id not in ids:
-                    continue
-            entities.append(copy.deepcopy(entity))
+        # Spilled states are read back for the result only, not made resident
+        spills = [
+            (entity, self._spill_files[i])
+            for i, entity in zip(listed, entities)
+            if i in self._spill_files
+        ]
+        if spills:
 
+            def _read() -> None:
+                for entity, path in spills:
+                    entity.load_state(_read_spill_file(path))
+                    entity.clear_changes()
+
+            with self._hold():
+                await asyncio.get_running_loop().run_in_executor(None, _read)
+            self._stats["stubReloads"] += len(spills)
         return entities
 
+    @contextlib.contextmanager
+    def _hold(self) -> typing.Iterator[None]:
+        # Spill files dropped meanwhile are kept until the end, for reading
+        self._holds += 1
+        try:
+            yield
+        finally:
+            self._holds -= 1
+            if not self._holds:
+                for path in self._held_spill_files:
+                    path.unlink(missing_ok=True)
+                self._held_spill_files = []
+
+    @contextlib.contextmanager
+    def hold_states(
+        self,
+    ) -> typing.Iterator[
+        typing.List[
+            typing.Tuple[str, typing.Callable[[], typing.Dict[str, typing.Any]]]
+        ]
+    ]:
+        # Spilled states are read from their files when called, not made resident
+        states: typing.List[
+            typing.Tuple[str, typing.Callable[[], typing.Dict[str, typing.Any]]]
+        ] = []
+        for id, entity in self._entity_map.items():
+            path = self._spill_files.get(id)
+            if path is None:
+                states.append((id, entity.dump_state))
+            else:
+                states.append((id, functools.partial(_read_spill_file, path)))
+        with self._hold():
+            yield states
+
+    def _lookup(self, field: str, keys: typing.List[typing.Any]) -> typing.Set[str]:
+        ids: typing.Set[str] = set()
+        for key in keys:
+            ids.update(self._indexes[field].get(key, ()))
+        return ids
+
     async def save(
         self,
         entity: typing.Union[stub_domain.Entity, typing.List[stub_domain.Entity]],
@@ -49,7 +301,38 @@ class Repository(stub_domain.Repository):
             _entities = [entity]
 
         for _entity in _entities:
-            self._entity_map[_entity.id.value] = copy.deepcopy(_entity)
+            id = _entity.id.value
+            old_entity = self._entity_map.get(id)
+            if old_entity is None:
+                self._positions[id] = self._next_position
+                self._next_position += 1
+                new_entity = _entity.snapshot()
+            else:
+                # Only the parts changed since the entity was handed out are written;
+                # saving an unchanged entity is a no-op
+                if not _entity.get_changes():
+                    continue
+                old_entity = await self._touch(id)
+                if old_entity is None:
+                    # Removed while its state was read back
+                    self._positions[id] = self._next_position
+                    self._next_position += 1
+                    new_entity = _entity.snapshot()
+                else:
+                    new_entity = old_entity.snapshot()
+                    new_entity.apply_changes(_entity)
+                    self._unindex(old_entity)
+            self._entity_map[id] = new_entity
+            self._index(new_entity)
+            self._mark_access(id)
+            self._set_resident(id, new_entity)
+            if self._journal is not None:
+                self._journal.append([(id, o) for o in _entity.take_operations()])
+            _entity.clear_changes()
+        # Acknowledged once the operations are on disk
+        if self._journal is not None:
+            await self._journal.sync()
+        await self._evict()
 
     async def add(
         self,
@@ -71,9 +354,9 @@ class Repository(stub_domain.Repository):
         entity: typing.Union[stub_domain.Entity, typing.List[stub_domain.Entity]],
     ) -> None:
         if isinstance(entity, list):
-            _entities = copy.deepcopy(entity)
+            _entities = entity
         else:
-            _entities = [copy.deepcopy(entity)]
+            _entities = [entity]
 
         for _entity in _entities:
             if _entity.id.value not in self._entity_map:
@@ -86,17 +369,32 @@ class Repository(stub_domain.Repository):
         entity: typing.Union[stub_domain.Entity, typing.List[stub_domain.Entity]],
     ) -> None:
         if isinstance(entity, list):
-            _entities = copy.deepcopy(entity)
+            _entities = entity
         else:
-            _entities = [copy.deepcopy(entity)]
+            _entities = [entity]
 
         for _entity in _entities:
             if _entity.id.value not in self._entity_map:
                 raise ValueError(f"'{_entity.id.value}' does not exist.")
 
         for _entity in _entities:
-            del self._entity_map[_entity.id.value]
+            id = _entity.id.value
+            old_entity = self._entity_map.pop(id)
+            del self._positions[id]
+            del self._accesses[id]
+            self._unindex(old_entity)
+            self._unset_resident(id)
+            if id in self._spill_files:
+                self._drop_spill_file(id)
+        if self._journal is not None:
+            self._journal.append([(e.id.value, ("delete",)) for e in _entities])
+            await self._journal.sync()
 
     async def remove_all(self) -> None:
-        entities = await self.list()
-        await self.remove(entity=entities)
+        # Only the ids are needed, so spilled states are not read back
+        await self.remove(entity=list(self._entity_map.values()))
+
+
+def _read_spill_file(path: pathlib.Path) -> typing.Dict[str, typing.Any]:
+    state: typing.Dict[str, typing.Any] = snapshot.loads(path.read_bytes())
+    return state
@@ -4,38 +4,78 @@ import pathlib
 import asyncio
 import ssl
 import logging
+import functools
 
 from aiohttp import web
 
-from . import exceptions
+from . import exceptions, manager_client, stub_resolver
+from .. import constants
 from ..libs import http_client
 
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=None)
+def create_ssl_context() -> ssl.SSLContext:
+    # Shared by every https stub in the process
+    current_dir = pathlib.Path(__file__).parent.resolve()
+    ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ssl_context.load_cert_chain(
+        str(current_dir.joinpath("server.crt")),
+        str(current_dir.joinpath("server.key")),
+    )
+    return ssl_context
+
+
 class Server(object):
     def __init__(
         self,
         host: str,
         port: int,
-        stub_id: str,
+        stub_id: typing.Union[str, dict[str, str]],
         manager_endpoint: str,
         ssl: bool,
+        manager_pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+        manager_keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+        manager_timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+        manager_transport: typing.Literal[
+            "http", "websocket"
+        ] = constants.DEFAULT_MANAGER_TRANSPORT,
+        client: typing.Optional[manager_client.BaseClient] = None,
     ) -> None:
         if None in [host, port, stub_id, manager_endpoint]:
             raise ValueError("host, port, stub_id, and manager_endpoint must be set")
 
         self._host = host
         self._port = port
-        self._stub_id = stub_id
-        self._manager_endpoint = manager_endpoint.rstrip("/")
+        self._resolver = stub_resolver.Resolver(stub_id=stub_id)
+        # A client passed in is shared with other stubs and is started/stopped by its owner
+        self._owns_manager_client = client is None
+        self._manager_client = (
+            manager_client.create_client(
+                manager_endpoint=manager_endpoint,
+                transport=manager_transport,
+                pool_size=manager_pool_size,
+                keepalive_timeout=manager_keepalive_timeout,
+                timeout=manager_timeout,
+            )
+            if client is None
+            else client
+        )
         self._ssl = ssl
         self._runner: typing.Optional[web.AppRunner] = None
 
+    def get_stats(self) -> dict[str, int]:
+        return self._manager_client.get_stats()
+
     async def _aiohttp_handler(self, aiohttp_request: web.Request) -> web.Response:
-        url = f"{self._manager_endpoint}/stubs/{self._stub_id}:handle"
+        stub_id = self._resolver.resolve(
+            None
+            if aiohttp_request.transport is None
+            else aiohttp_request.transport.get_extra_info("sockname")
+        )
         body = {
-            "id": self._stub_id,
+            "id": stub_id,
             "protocol": "https" if self._ssl else "http",
             "method": aiohttp_request.method,
             "path": aiohttp_request.path,
@@ -44,21 +84,22 @@ class Server(object):
             "body": await aiohttp_request.text(),
         }
 
-        async with http_client.Session() as sess:
-            response = await sess.request(
-                method="POST",
-                url=url,
-                body=json.dumps(body),
+        response = await self._manager_client.handle(
+            stub_id=stub_id, body=body, payload_field="body"
+        )
+        if response.overloaded:
+            return web.Response(
+                status=503,
+                headers={"Retry-After": response.retry_after},
+                text="Service Unavailable",
             )
-        if response.code != 200:
+        if not response.framed:
             raise exceptions.Error(f"Failed: {response.code} {response.body}")
 
-        res_body = json.loads(response.body)
-
         aiohttp_response = web.Response(
-            status=res_body["code"],
-            headers=res_body["headers"],
-            body=res_body["body"],
+            status=response.code,
+            headers=response.headers,
+            body=response.payload,
         )
         return aiohttp_response
 
@@ -101,6 +142,9 @@ class Server(object):
         pass
 
     async def start(self) -> None:
+        if self._owns_manager_client:
+            await self._manager_client.start()
+
         aiohttp_app = web.Application(
             client_max_size=10 * 1024 * 1024,
             middlewares=[self._middleware],
@@ -118,12 +162,7 @@ class Server(object):
 
         # Start http server
         if self._ssl:
-            current_dir = pathlib.Path(__file__).parent.resolve()
-            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-            ssl_context.load_cert_chain(
-                str(current_dir.joinpath("server.crt")),
-                str(current_dir.joinpath("server.key")),
-            )
+            ssl_context = create_ssl_context()
         else:
             ssl_context = None
 
@@ -144,4 +183,6 @@ class Server(object):
         if self._runner is not None:
             await self._runner.cleanup()
             self._runner = None
+            if self._owns_manager_client:
+                await self._manager_client.stop()
             logger.info(f"Stopped.")
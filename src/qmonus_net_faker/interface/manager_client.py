@@ -0,0 +1,592 @@
+import typing
+import logging
+import abc
+import json
+import time
+import asyncio
+import pathlib
+import urllib.parse
+
+import aiohttp
+import multidict
+
+from . import exceptions, manager_interface
+from .. import constants
+from ..libs import http_client, frame, hash_ring
+from ..application import manager_application, plugin
+
+logger = logging.getLogger(__name__)
+
+TRANSPORT_HTTP: typing.Final = "http"
+TRANSPORT_WEBSOCKET: typing.Final = "websocket"
+
+
+class Reply(object):
+    def __init__(
+        self,
+        code: int,
+        headers: dict[str, str],
+        payload: bytes,
+        framed: bool,
+        rtt: float,
+    ) -> None:
+        # framed: the manager answered with the handler's response (code/headers/payload);
+        # otherwise code/headers/payload are those of the manager's own (error) response
+        self.code = code
+        self.headers = headers
+        self.payload = payload
+        self.framed = framed
+        self.rtt = rtt
+
+    @property
+    def body(self) -> str:
+        return self.payload.decode("utf-8")
+
+    @property
+    def overloaded(self) -> bool:
+        # The manager refused the request under load; it may be retried after 'retry_after'
+        return not self.framed and self.code == 503
+
+    @property
+    def retry_after(self) -> str:
+        for k, v in self.headers.items():
+            if k.lower() == "retry-after":
+                return v
+        return str(constants.DEFAULT_RETRY_AFTER)
+
+
+class BaseClient(abc.ABC):
+    # Sends :handle requests of stubs to a manager
+    @abc.abstractmethod
+    async def start(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def stop(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def get_stats(self) -> dict[str, int]:
+        pass
+
+    @abc.abstractmethod
+    async def handle(
+        self,
+        stub_id: str,
+        body: dict[str, typing.Any],
+        payload_field: typing.Optional[str] = None,
+        timeout: typing.Optional[int] = None,
+    ) -> Reply:
+        pass
+
+
+class Client(BaseClient):
+    def __init__(
+        self,
+        manager_endpoint: str,
+        pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+        keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+        timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+    ) -> None:
+        if pool_size <= 0:
+            raise ValueError(f"Invalid pool_size: '{pool_size}'")
+
+        self._manager_endpoint, self._unix_socket_path = (
+            http_client.split_unix_endpoint(manager_endpoint.rstrip("/"))
+        )
+        self._pool_size = pool_size
+        self._keepalive_timeout = keepalive_timeout
+        self._timeout = timeout
+        self._session: typing.Optional[http_client.Session] = None
+
+    async def start(self) -> None:
+        if self._session is not None:
+            return
+
+        self._session = http_client.Session(
+            default_timeout=self._timeout,
+            limit=self._pool_size,
+            keepalive_timeout=self._keepalive_timeout,
+            unix_socket_path=self._unix_socket_path,
+        )
+
+    async def stop(self) -> None:
+        if self._session is not None:
+            logger.info(f"Manager connection stats: {self.get_stats()}")
+            await self._session.close()
+            self._session = None
+
+    def get_stats(self) -> dict[str, int]:
+        if self._session is None:
+            return {}
+        return self._session.get_stats()
+
+    async def handle(
+        self,
+        stub_id: str,
+        body: dict[str, typing.Any],
+        payload_field: typing.Optional[str] = None,
+        timeout: typing.Optional[int] = None,
+    ) -> Reply:
+        if self._session is None:
+            raise exceptions.FatalError("Manager client is not started.")
+
+        url = f"{self._manager_endpoint}/stubs/{stub_id}:handle"
+        header, payload = frame.split(body=body, payload_field=payload_field)
+        response = await self._session.request(
+            method="POST",
+            url=url,
+            headers={"Content-Type": frame.MEDIA_TYPE, "Accept": frame.MEDIA_TYPE},
+            body=frame.encode(header=header, payload=payload),
+            timeout=timeout,
+        )
+
+        if frame.is_frame(response.headers.get("Content-Type")):
+            res_header, res_payload = frame.decode(response.content)
+            return Reply(
+                code=res_header["code"],
+                headers=res_header["headers"],
+                payload=res_payload,
+                framed=True,
+                rtt=response.rtt,
+            )
+        return Reply(
+            code=response.code,
+            headers=response.headers,
+            payload=response.content,
+            framed=False,
+            rtt=response.rtt,
+        )
+
+
+class WebSocketClient(Client):
+    def __init__(
+        self,
+        manager_endpoint: str,
+        pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+        keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+        timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+        heartbeat: float = 30.0,
+    ) -> None:
+        super().__init__(
+            manager_endpoint=manager_endpoint,
+            pool_size=pool_size,
+            keepalive_timeout=keepalive_timeout,
+            timeout=timeout,
+        )
+        self._heartbeat = heartbeat
+        self._ws: typing.Optional[typing.Any] = None  # aiohttp.ClientWebSocketResponse
+        self._reader: typing.Optional[asyncio.Task[None]] = None
+        self._connect_lock = asyncio.Lock()
+        self._send_lock = asyncio.Lock()
+        self._request_count = 0
+        # Requests in flight, by the connection they were sent on
+        self._pending: dict[
+            typing.Any, dict[int, asyncio.Future[tuple[dict[str, typing.Any], bytes]]]
+        ] = {}
+
+    async def stop(self) -> None:
+        if self._ws is not None:
+            await self._ws.close()
+            self._ws = None
+        if self._reader is not None:
+            try:
+                await self._reader
+            except Exception as e:
+                logger.info(f"Channel to manager aborted: {e}")
+            self._reader = None
+        await super().stop()
+
+    async def _connect(self) -> typing.Any:
+        async with self._connect_lock:
+            if self._ws is not None and not self._ws.closed:
+                return self._ws
+
+            if self._session is None:
+                raise exceptions.FatalError("Manager client is not started.")
+
+            url = f"{self._manager_endpoint}/stubs:connect"
+            ws = await self._session.ws_connect(url=url, heartbeat=self._heartbeat)
+            self._ws = ws
+            self._pending[ws] = {}
+            self._reader = asyncio.create_task(self._read(ws=ws))
+            logger.info(f"Channel to manager '{url}' established.")
+            return ws
+
+    async def _read(self, ws: typing.Any) -> None:
+        pending = self._pending[ws]
+        try:
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.BINARY:
+                    header, payload = frame.decode(msg.data)
+                    if header["type"] == "response":
+                        future = pending.pop(header["requestId"], None)
+                        if future is not None and not future.done():
+                            future.set_result((header, payload))
+                elif msg.type == aiohttp.WSMsgType.TEXT:
+                    message = json.loads(msg.data)
+                    if message["type"] == "push":
+                        logger.info(f"Received from manager: {message}")
+        finally:
+            # Only the requests sent on this connection; a reconnected one has its own
+            del self._pending[ws]
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(
+                        exceptions.NetworkError("Channel to manager closed.")
+                    )
+            logger.info(f"Channel to manager closed.")
+
+    async def handle(
+        self,
+        stub_id: str,
+        body: dict[str, typing.Any],
+        payload_field: typing.Optional[str] = None,
+        timeout: typing.Optional[int] = None,
+    ) -> Reply:
+        ws = await self._connect()
+        pending = self._pending.get(ws)
+        if pending is None:
+            raise exceptions.NetworkError("Channel to manager closed.")
+
+        self._request_count += 1
+        request_id = self._request_count
+        future: asyncio.Future[tuple[dict[str, typing.Any], bytes]] = (
+            asyncio.get_running_loop().create_future()
+        )
+        pending[request_id] = future
+
+        header, payload = frame.split(body=body, payload_field=payload_field)
+        data = frame.encode(
+            header={
+                "type": "request",
+                "requestId": request_id,
+                "stubId": stub_id,
+                "request": header,
+            },
+            payload=payload,
+        )
+        sent_at = time.time()
+        try:
+            async with self._send_lock:
+                await ws.send_bytes(data)
+            res_header, res_payload = await asyncio.wait_for(
+                future, timeout=self._timeout if timeout is None else timeout
+            )
+        finally:
+            pending.pop(request_id, None)
+        received_at = time.time()
+
+        return Reply(
+            code=res_header["code"],
+            headers=res_header["headers"],
+            payload=res_payload,
+            framed=res_header["framed"],
+            rtt=received_at - sent_at,
+        )
+
+
+class DirectClient(BaseClient):
+    # Embedded mode: calls the manager application in the same event loop, no HTTP hop
+    def __init__(
+        self,
+        manager_app: manager_application.App,
+        timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+    ) -> None:
+        self._manager_app = manager_app
+        self._timeout = timeout
+        self._stats = {"requests": 0}
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        logger.info(f"Manager call stats: {self.get_stats()}")
+
+    def get_stats(self) -> dict[str, int]:
+        return dict(self._stats)
+
+    async def handle(
+        self,
+        stub_id: str,
+        body: dict[str, typing.Any],
+        payload_field: typing.Optional[str] = None,
+        timeout: typing.Optional[int] = None,
+    ) -> Reply:
+        self._stats["requests"] += 1
+        path = f"/stubs/{stub_id}:handle"
+        headers: multidict.CIMultiDict[str] = multidict.CIMultiDict()
+
+        sent_at = time.time()
+        try:
+            request = plugin.Request(
+                scheme="direct",
+                method="POST",
+                url=path,
+                path=path,
+                query={},
+                headers=headers,
+                body=None,
+                stub_id=stub_id,
+                json_body=body,
+            )
+            response = await asyncio.wait_for(
+                self._manager_app.handle_network_operation(request),
+                timeout=self._timeout if timeout is None else timeout,
+            )
+        except Exception as e:
+            code = manager_interface.get_error_code(e=e)
+            if code == 500:
+                logger.exception("ScriptError: ")
+            return Reply(
+                code=code,
+                headers=manager_interface.get_error_headers(e=e),
+                payload=manager_interface.create_error_message(code=code, e=e).encode(
+                    "utf-8"
+                ),
+                framed=False,
+                rtt=time.time() - sent_at,
+            )
+
+        header, payload = response.to_envelope()
+        return Reply(
+            code=header["code"],
+            headers=header["headers"],
+            payload=payload,
+            framed=True,
+            rtt=time.time() - sent_at,
+        )
+
+
+class ShardedClient(BaseClient):
+    # Routes each stub-id to one of several manager shards by consistent hashing
+    def __init__(self, clients: list[BaseClient]) -> None:
+        self._clients = clients
+        self._ring = hash_ring.create_shard_ring(shard_count=len(clients))
+
+    def get_client(self, stub_id: str) -> BaseClient:
+        return self._clients[int(self._ring.get_node(stub_id))]
+
+    async def start(self) -> None:
+        await asyncio.gather(*[client.start() for client in self._clients])
+
+    async def stop(self) -> None:
+        await asyncio.gather(*[client.stop() for client in self._clients])
+
+    def get_stats(self) -> dict[str, int]:
+        stats: dict[str, int] = {}
+        for client in self._clients:
+            for k, v in client.get_stats().items():
+                stats[k] = stats.get(k, 0) + v
+        return stats
+
+    async def handle(
+        self,
+        stub_id: str,
+        body: dict[str, typing.Any],
+        payload_field: typing.Optional[str] = None,
+        timeout: typing.Optional[int] = None,
+    ) -> Reply:
+        return await self.get_client(stub_id=stub_id).handle(
+            stub_id=stub_id, body=body, payload_field=payload_field, timeout=timeout
+        )
+
+
+def split_endpoints(manager_endpoint: str) -> list[str]:
+    # 'http://m0:10080,http://m1:10080' -> one endpoint per shard, in shard-index order
+    return [e.strip() for e in manager_endpoint.split(",") if e.strip()]
+
+
+class RoutedClient(BaseClient):
+    # For an endpoint that may be a router: asks it for the endpoints of its shards
+    # (GET /shards) and sends each request straight to the owning shard, so requests
+    # do not all pass through the router process. The endpoint itself is the fallback
+    # when it is a plain manager, or when a shard cannot be connected to
+    def __init__(
+        self,
+        manager_endpoint: str,
+        transport: typing.Literal["http", "websocket"] = TRANSPORT_HTTP,
+        pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+        keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+        timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+    ) -> None:
+        self._manager_endpoint = manager_endpoint.rstrip("/")
+        self._transport = transport
+        self._pool_size = pool_size
+        self._keepalive_timeout = keepalive_timeout
+        self._timeout = timeout
+        self._client = _create_single_client(
+            manager_endpoint=manager_endpoint,
+            transport=transport,
+            pool_size=pool_size,
+            keepalive_timeout=keepalive_timeout,
+            timeout=timeout,
+        )
+        self._sharded_client: typing.Optional[ShardedClient] = None
+        # Retried on the next request while the endpoint is not reachable
+        self._discovered = False
+        self._discover_lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        await self._client.start()
+        await self._discover()
+
+    async def stop(self) -> None:
+        if self._sharded_client is not None:
+            await self._sharded_client.stop()
+            self._sharded_client = None
+        await self._client.stop()
+
+    def get_stats(self) -> dict[str, int]:
+        stats = self._client.get_stats()
+        if self._sharded_client is not None:
+            for k, v in self._sharded_client.get_stats().items():
+                stats[k] = stats.get(k, 0) + v
+        return stats
+
+    def _resolve(self, endpoint: str) -> typing.Optional[str]:
+        # The first usable endpoint of a shard: a unix socket on this host, or
+        # http(s) with a wildcard address replaced by the router's host
+        base_url, unix_socket_path = http_client.split_unix_endpoint(endpoint)
+        if unix_socket_path is not None:
+            return endpoint if pathlib.Path(unix_socket_path).exists() else None
+
+        parsed = urllib.parse.urlparse(base_url)
+        if parsed.hostname not in ["0.0.0.0", "::"]:
+            return endpoint
+        router_host = urllib.parse.urlparse(self._manager_endpoint).hostname
+        if router_host is None:
+            return None
+        if ":" in router_host:
+            router_host = f"[{router_host}]"
+        return parsed._replace(netloc=f"{router_host}:{parsed.port}").geturl()
+
+    async def _discover(self) -> None:
+        async with self._discover_lock:
+            if self._discovered:
+                return
+
+            base_url, unix_socket_path = http_client.split_unix_endpoint(
+                self._manager_endpoint
+            )
+            try:
+                async with http_client.Session(
+                    default_timeout=self._timeout, unix_socket_path=unix_socket_path
+                ) as session:
+                    response = await session.request(
+                        method="GET", url=f"{base_url}/shards"
+                    )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.info(f"Failed to get shards of '{self._manager_endpoint}': {e}")
+                return
+            self._discovered = True
+            if response.code != 200:
+                return
+
+            endpoints = []
+            for shard_endpoints in json.loads(response.content)["shards"]:
+                endpoint = next(
+                    (e for e in map(self._resolve, shard_endpoints) if e is not None),
+                    None,
+                )
+                if endpoint is None:
+                    logger.info(f"Shards of '{self._manager_endpoint}' not reachable.")
+                    return
+                endpoints.append(endpoint)
+
+            sharded_client = ShardedClient(
+                clients=[
+                    _create_single_client(
+                        manager_endpoint=endpoint,
+                        transport=self._transport,
+                        pool_size=self._pool_size,
+                        keepalive_timeout=self._keepalive_timeout,
+                        timeout=self._timeout,
+                    )
+                    for endpoint in endpoints
+                ]
+            )
+            await sharded_client.start()
+            self._sharded_client = sharded_client
+            logger.info(f"Connecting to shards directly: {','.join(endpoints)}")
+
+    async def handle(
+        self,
+        stub_id: str,
+        body: dict[str, typing.Any],
+        payload_field: typing.Optional[str] = None,
+        timeout: typing.Optional[int] = None,
+    ) -> Reply:
+        if not self._discovered:
+            await self._discover()
+
+        if self._sharded_client is not None:
+            try:
+                return await self._sharded_client.handle(
+                    stub_id=stub_id,
+                    body=body,
+                    payload_field=payload_field,
+                    timeout=timeout,
+                )
+            except aiohttp.ClientConnectorError as e:
+                # Not sent yet, so it is safe to send through the router instead
+                logger.warning(f"Shard not reachable, using the router: {e}")
+        return await self._client.handle(
+            stub_id=stub_id, body=body, payload_field=payload_field, timeout=timeout
+        )
+
+
+def _create_single_client(
+    manager_endpoint: str,
+    transport: typing.Literal["http", "websocket"] = TRANSPORT_HTTP,
+    pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+    keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+    timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+) -> Client:
+    if transport == TRANSPORT_HTTP:
+        return Client(
+            manager_endpoint=manager_endpoint,
+            pool_size=pool_size,
+            keepalive_timeout=keepalive_timeout,
+            timeout=timeout,
+        )
+    elif transport == TRANSPORT_WEBSOCKET:
+        return WebSocketClient(
+            manager_endpoint=manager_endpoint,
+            pool_size=pool_size,
+            keepalive_timeout=keepalive_timeout,
+            timeout=timeout,
+        )
+    else:
+        raise ValueError(f"Invalid transport: '{transport}'")
+
+
+def create_client(
+    manager_endpoint: str,
+    transport: typing.Literal["http", "websocket"] = TRANSPORT_HTTP,
+    pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+    keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+    timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+) -> BaseClient:
+    endpoints = split_endpoints(manager_endpoint)
+    if len(endpoints) > 1:
+        return ShardedClient(
+            clients=[
+                _create_single_client(
+                    manager_endpoint=endpoint,
+                    transport=transport,
+                    pool_size=pool_size,
+                    keepalive_timeout=keepalive_timeout,
+                    timeout=timeout,
+                )
+                for endpoint in endpoints
+            ]
+        )
+
+    return RoutedClient(
+        manager_endpoint=manager_endpoint,
+        transport=transport,
+        pool_size=pool_size,
+        keepalive_timeout=keepalive_timeout,
+        timeout=timeout,
+    )
@@ -2,11 +2,14 @@ import logging
 import typing
 import json
 import re
+import pathlib
+import asyncio
 
+import aiohttp
 from aiohttp import web
 
 from . import exceptions
-from ..libs import http_client, validator, xml_utils
+from ..libs import http_client, validator, xml_utils, frame
 from ..application import (
     exceptions as app_exceptions,
     manager_application,
@@ -21,6 +24,119 @@ STATUS_RUNNING = "RUNNING"
 STATUS_STOPPING = "STOPPING"
 STATUS_STOPPED = "STOPPED"
 
+# Longest line of 'POST /stubs:bulk' (the body limit of 'POST /stubs'), and the size
+# read from the body at once
+BULK_MAX_LINE_SIZE: typing.Final = 10 * 1024 * 1024
+BULK_READ_SIZE: typing.Final = 64 * 1024
+
+CREATE_STUB_SCHEMA: typing.Final = {
+    "type": "object",
+    "required": ["stub"],
+    "properties": {
+        "stub": {
+            "type": "object",
+            "required": [
+                "id",
+                "handler",
+            ],
+            "properties": {
+                "id": {"type": "string"},
+                "description": {"type": "string"},
+                "handler": {"type": "string"},
+                "yang": {"type": "string"},
+                "enabled": {"type": "boolean"},
+                "metadata": {"type": "object"},
+            },
+        }
+    },
+}
+
+
+def get_error_code(e: Exception) -> int:
+    if isinstance(
+        e,
+        (
+            exceptions.ValidationError,
+            validator.ValidationError,
+            app_exceptions.RelatedResourceNotFoundError,
+        ),
+    ):
+        return 400
+    elif isinstance(e, app_exceptions.ForbiddenError):
+        return 403
+    elif isinstance(e, (exceptions.NotFoundError, app_exceptions.NotFoundError)):
+        return 404
+    elif isinstance(e, app_exceptions.ConflictError):
+        return 409
+    elif isinstance(e, app_exceptions.OverloadedError):
+        return 503
+    elif isinstance(e, web.HTTPException):
+        return e.status_code
+    else:
+        return 500
+
+
+async def read_lines(
+    content: aiohttp.StreamReader,
+) -> typing.AsyncIterator[tuple[int, typing.Optional[bytes]]]:
+    # Yields (line number, line) of an NDJSON body. StreamReader's own line reading
+    # fails the whole body on a long line, so lines are split here; a line longer
+    # than BULK_MAX_LINE_SIZE is discarded up to its newline and yielded as None
+    buffer = bytearray()
+    line_number = 0
+    oversized = False
+    while True:
+        data = await content.read(BULK_READ_SIZE)
+        start = len(buffer)
+        buffer += data
+        end = buffer.find(b"\n", start)
+        while end >= 0:
+            line_number += 1
+            if oversized or end > BULK_MAX_LINE_SIZE:
+                yield line_number, None
+            else:
+                yield line_number, bytes(buffer[:end]).rstrip(b"\r")
+            oversized = False
+            del buffer[: end + 1]
+            end = buffer.find(b"\n")
+        if len(buffer) > BULK_MAX_LINE_SIZE:
+            oversized = True
+            buffer.clear()
+        if not data:
+            break
+
+    if buffer or oversized:
+        line_number += 1
+        yield line_number, (None if oversized else bytes(buffer).rstrip(b"\r"))
+
+
+def oversized_line_result(line_number: int) -> dict[str, typing.Any]:
+    e = exceptions.ValidationError(f"Line exceeds {BULK_MAX_LINE_SIZE} bytes")
+    return {
+        "line": line_number,
+        "stubId": None,
+        "code": 400,
+        "errorMessage": f"{e.__class__.__name__}: {str(e)}",
+    }
+
+
+def get_error_headers(e: Exception) -> dict[str, str]:
+    headers = {"content-type": "application/json"}
+    if isinstance(e, app_exceptions.OverloadedError):
+        headers["retry-after"] = str(e.retry_after)
+    return headers
+
+
+def create_error_message(code: int, e: Exception) -> str:
+    message = json.dumps(
+        {
+            "errorCode": code,
+            "errorMessage": f"{e.__class__.__name__}: {str(e)}",
+            "moreInfo": None,
+        }
+    )
+    return message
+
 
 class Server(object):
     def __init__(
@@ -28,12 +144,15 @@ class Server(object):
         host: str,
         port: int,
         manager_app: manager_application.App,
+        unix_socket_path: typing.Optional[str] = None,
     ) -> None:
         self._host = host
         self._port = port
+        self._unix_socket_path = unix_socket_path
         self._manager_app = manager_app
         self._runner: typing.Optional[web.AppRunner] = None
         self._status = STATUS_WAITING
+        self._channels: set[web.WebSocketResponse] = set()
 
         def _filename(v: typing.Any) -> bool:
             m = re.match(r"\A(?![.]+\Z)[a-zA-Z0-9\-_@.]+\Z", v)
@@ -54,6 +173,10 @@ class Server(object):
         _validator.add_format(name="filepath", func=_filepath)
         self._validator = _validator
 
+    @property
+    def manager_app(self) -> manager_application.App:
+        return self._manager_app
+
     async def _handle_echo(self, request: web.Request) -> web.Response:
         response = web.json_response(
             status=200,
@@ -72,30 +195,7 @@ class Server(object):
     async def _create_stub(self, request: web.Request) -> web.Response:
         # Validate request format
         req_body = self._load_json(await request.text())
-        self._validator.validate(
-            value=req_body,
-            schema={
-                "type": "object",
-                "required": ["stub"],
-                "properties": {
-                    "stub": {
-                        "type": "object",
-                        "required": [
-                            "id",
-                            "handler",
-                        ],
-                        "properties": {
-                            "id": {"type": "string"},
-                            "description": {"type": "string"},
-                            "handler": {"type": "string"},
-                            "yang": {"type": "string"},
-                            "enabled": {"type": "boolean"},
-                            "metadata": {"type": "object"},
-                        },
-                    }
-                },
-            },
-        )
+        self._validator.validate(value=req_body, schema=CREATE_STUB_SCHEMA)
 
         # Setup variables
         req_stub = req_body["stub"]
@@ -116,6 +216,52 @@ class Server(object):
         )
         return response
 
+    async def _bulk_create_stubs(self, request: web.Request) -> web.StreamResponse:
+        # NDJSON: each line is the request body of 'POST /stubs'. The result of each
+        # line is written as soon as it is created, so the body is never held at once
+        response = web.StreamResponse(
+            status=200, headers={"Content-Type": "application/x-ndjson"}
+        )
+        await response.prepare(request)
+
+        async for line_number, line in read_lines(request.content):
+            if line is None:
+                result = oversized_line_result(line_number)
+            elif not line.strip():
+                continue
+            else:
+                result = {"line": line_number, **await self._create_stub_line(line)}
+            await response.write(json.dumps(result).encode() + b"\n")
+
+        await response.write_eof()
+        return response
+
+    async def _create_stub_line(self, line: bytes) -> dict[str, typing.Any]:
+        id = None
+        try:
+            req_body = self._load_json(line.decode(errors="replace"))
+            self._validator.validate(value=req_body, schema=CREATE_STUB_SCHEMA)
+            req_stub = req_body["stub"]
+            id = req_stub["id"]
+            await self._manager_app.create_stub(
+                id=id,
+                description=req_stub.get("description", ""),
+                handler=req_stub["handler"],
+                yang=req_stub.get("yang", ""),
+                enabled=req_stub.get("enabled", True),
+                metadata=req_stub.get("metadata", {}),
+            )
+            return {"stubId": id, "code": 200}
+        except Exception as e:
+            code = get_error_code(e)
+            if code == 500:
+                logger.exception("ScriptError: ")
+            return {
+                "stubId": id,
+                "code": code,
+                "errorMessage": f"{e.__class__.__name__}: {str(e)}",
+            }
+
     async def _list_stubs(self, request: web.Request) -> web.Response:
         # Validate request format
         query = http_client.to_query_dict(request.query_string)
@@ -123,13 +269,25 @@ class Server(object):
             value=query,
             schema={
                 "type": "object",
-                "properties": {"id": {"type": "array", "items": {"type": "string"}}},
+                "properties": {
+                    "id": {"type": "array", "items": {"type": "string"}},
+                    "handler": {"type": "array", "items": {"type": "string"}},
+                    "yang": {"type": "array", "items": {"type": "string"}},
+                    "enabled": {
+                        "type": "array",
+                        "items": {"type": "string", "enum": ["true", "false"]},
+                        "maxItems": 1,
+                    },
+                },
             },
         )
 
         # List
         stubs = await self._manager_app.list_stubs(
             id=query.get("id"),
+            handler=query.get("handler"),
+            yang=query.get("yang"),
+            enabled=(None if "enabled" not in query else query["enabled"][0] == "true"),
         )
 
         # Response
@@ -226,6 +384,7 @@ class Server(object):
 
         # Delete
         await self._manager_app.delete_stub(id=id)
+        await self.push(message={"event": "stubDeleted", "stubId": id})
 
         # Response
         response = web.Response(status=204)
@@ -234,6 +393,7 @@ class Server(object):
     async def _reload_stubs(self, request: web.Request) -> web.Response:
         # Reset
         stubs = await self._manager_app.reload_stubs()
+        await self.push(message={"event": "stubsReloaded"})
 
         # Response
         response = web.json_response(
@@ -287,10 +447,30 @@ class Server(object):
         )
         return response
 
+    async def _get_stats(self, request: web.Request) -> web.Response:
+        response = web.json_response(
+            status=200,
+            data={"stats": self._manager_app.get_stats()},
+        )
+        return response
+
     async def _handle_network_operation(self, request: web.Request) -> web.Response:
         # TODO: Validate request format
         id = request.match_info["id"]
 
+        if frame.is_frame(request.content_type):
+            try:
+                header, payload = frame.decode(await request.read())
+            except frame.FrameError as e:
+                raise exceptions.ValidationError(str(e))
+            body = None
+            json_body: typing.Optional[dict[str, typing.Any]] = frame.join(
+                header=header, payload=payload
+            )
+        else:
+            body = await request.text()
+            json_body = None
+
         _request = plugin.Request(
             scheme=request.scheme,
             method=request.method,
@@ -298,14 +478,22 @@ class Server(object):
             path=request.path,
             query=http_client.to_query_dict(request.query_string),
             headers=request.headers,
-            body=await request.text(),
+            body=body,
             stub_id=id,
+            json_body=json_body,
         )
 
         # Handle
         _response = await self._manager_app.handle_network_operation(_request)
 
         # Response
+        if frame.accepts_frame(request.headers.get("Accept")):
+            return web.Response(
+                body=_response.to_frame(),
+                status=200,
+                content_type=frame.MEDIA_TYPE,
+            )
+
         response = web.Response(
             body=_response.body,
             headers=_response.headers,
@@ -313,14 +501,109 @@ class Server(object):
         )
         return response
 
+    async def _connect_channel(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(heartbeat=30.0)
+        await ws.prepare(request)
+        self._channels.add(ws)
+        logger.info(f"Channel from '{request.remote}' established.")
+
+        send_lock = asyncio.Lock()
+        tasks: set[asyncio.Task[None]] = set()
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.BINARY:
+                    continue
+
+                try:
+                    header, payload = frame.decode(msg.data)
+                except frame.FrameError as e:
+                    logger.warning(f"Invalid frame from '{request.remote}': {e}")
+                    continue
+                if header["type"] != "request":
+                    continue
+
+                task = asyncio.create_task(
+                    self._handle_channel_request(
+                        ws=ws,
+                        send_lock=send_lock,
+                        request=request,
+                        header=header,
+                        payload=payload,
+                    )
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            self._channels.discard(ws)
+            for task in tasks:
+                task.cancel()
+            logger.info(f"Channel from '{request.remote}' closed.")
+
+        return ws
+
+    async def _handle_channel_request(
+        self,
+        ws: web.WebSocketResponse,
+        send_lock: asyncio.Lock,
+        request: web.Request,
+        header: dict[str, typing.Any],
+        payload: bytes,
+    ) -> None:
+        id = header["stubId"]
+        path = f"/stubs/{id}:handle"
+        reply_header = {"type": "response", "requestId": header["requestId"]}
+
+        try:
+            _request = plugin.Request(
+                scheme=request.scheme,
+                method="POST",
+                url=str(request.url.with_path(path)),
+                path=path,
+                query={},
+                headers=request.headers,
+                body=None,
+                stub_id=id,
+                json_body=frame.join(header=header["request"], payload=payload),
+            )
+            _response = await self._manager_app.handle_network_operation(_request)
+            code = 200
+            data = _response.to_frame(header={**reply_header, "framed": True})
+        except Exception as e:
+            code = get_error_code(e=e)
+            if code == 500:
+                logger.exception("ScriptError: ")
+            data = frame.encode(
+                header={
+                    **reply_header,
+                    "framed": False,
+                    "code": code,
+                    "headers": get_error_headers(e=e),
+                },
+                payload=create_error_message(code=code, e=e).encode("utf-8"),
+            )
+        logger.info(f"Responded: {code} (Channel: POST {path})")
+
+        async with send_lock:
+            if not ws.closed:
+                await ws.send_bytes(data)
+
+    async def push(self, message: dict[str, typing.Any]) -> None:
+        for ws in list(self._channels):
+            if not ws.closed:
+                await ws.send_str(json.dumps({"type": "push", **message}))
+
     async def _on_startup(self, app: typing.Any) -> None:
         logger.info("startup")
+        await self._manager_app.start()
 
     async def _on_shutdown(self, app: typing.Any) -> None:
         logger.info("shutdown")
+        for ws in list(self._channels):
+            await ws.close(code=aiohttp.WSCloseCode.GOING_AWAY)
 
     async def _on_cleanup(self, app: typing.Any) -> None:
         logger.info("cleanup")
+        await self._manager_app.stop()
 
     def _load_json(self, data: str) -> typing.Any:
         try:
@@ -329,16 +612,6 @@ class Server(object):
             raise exceptions.ValidationError("Invalid json format")
         return obj
 
-    def _create_error_message(self, code: int, e: Exception) -> str:
-        message = json.dumps(
-            {
-                "errorCode": code,
-                "errorMessage": f"{e.__class__.__name__}: {str(e)}",
-                "moreInfo": None,
-            }
-        )
-        return message
-
     @web.middleware
     async def _handle_error(
         self, request: web.Request, handler: typing.Any
@@ -353,57 +626,64 @@ class Server(object):
         except exceptions.ValidationError as e:
             logger.info(f"Responded: 400 (Request: {request.method} {request.path})")
             raise web.HTTPBadRequest(
-                text=self._create_error_message(code=400, e=e),
+                text=create_error_message(code=400, e=e),
                 content_type="application/json",
             )
         except exceptions.NotFoundError as e:
             logger.info(f"Responded: 404 (Request: {request.method} {request.path})")
             raise web.HTTPNotFound(
-                text=self._create_error_message(code=404, e=e),
+                text=create_error_message(code=404, e=e),
                 content_type="application/json",
             )
         except validator.ValidationError as e:
             logger.info(f"Responded: 400 (Request: {request.method} {request.path})")
             raise web.HTTPBadRequest(
-                text=self._create_error_message(code=400, e=e),
+                text=create_error_message(code=400, e=e),
                 content_type="application/json",
             )
         except app_exceptions.RelatedResourceNotFoundError as e:
             logger.info(f"Responded: 400 (Request: {request.method} {request.path})")
             raise web.HTTPBadRequest(
-                text=self._create_error_message(code=400, e=e),
+                text=create_error_message(code=400, e=e),
                 content_type="application/json",
             )
         except app_exceptions.ForbiddenError as e:
             logger.info(f"Responded: 403 (Request: {request.method} {request.path})")
             raise web.HTTPForbidden(
-                text=self._create_error_message(code=403, e=e),
+                text=create_error_message(code=403, e=e),
                 content_type="application/json",
             )
         except app_exceptions.NotFoundError as e:
             logger.info(f"Responded: 404 (Request: {request.method} {request.path})")
             raise web.HTTPNotFound(
-                text=self._create_error_message(code=404, e=e),
+                text=create_error_message(code=404, e=e),
                 content_type="application/json",
             )
         except app_exceptions.ConflictError as e:
             logger.info(f"Responded: 409 (Request: {request.method} {request.path})")
             raise web.HTTPConflict(
-                text=self._create_error_message(code=409, e=e),
+                text=create_error_message(code=409, e=e),
                 content_type="application/json",
             )
+        except app_exceptions.OverloadedError as e:
+            logger.info(f"Responded: 503 (Request: {request.method} {request.path})")
+            raise web.HTTPServiceUnavailable(
+                text=create_error_message(code=503, e=e),
+                content_type="application/json",
+                headers={"Retry-After": str(e.retry_after)},
+            )
         except web.HTTPException as e:
             logger.info(
                 f"Responded: {e.status_code} (Request: {request.method} {request.path})"
             )
-            e.text = self._create_error_message(code=e.status_code, e=e)
+            e.text = create_error_message(code=e.status_code, e=e)
             e.content_type = "application/json"
             raise e
         except Exception as e:
             logger.info(f"Responded: 500 (Request: {request.method} {request.path})")
             logger.exception("ScriptError: ")
             raise web.HTTPInternalServerError(
-                text=self._create_error_message(code=500, e=e),
+                text=create_error_message(code=500, e=e),
                 content_type="application/json",
             )
 
@@ -418,6 +698,7 @@ class Server(object):
                 web.route(method="*", path="/echo", handler=self._handle_echo),
                 # stubs
                 web.post(path="/stubs", handler=self._create_stub),
+                web.post(path="/stubs:bulk", handler=self._bulk_create_stubs),
                 web.get(path="/stubs", handler=self._list_stubs),
                 web.get(path="/stubs/{id}", handler=self._get_stub),
                 web.get(path="/stubs/{id}/{property}", handler=self._get_stub_property),
@@ -428,9 +709,12 @@ class Server(object):
                 web.post(
                     path="/stubs/{id}:handle", handler=self._handle_network_operation
                 ),
+                web.get(path="/stubs:connect", handler=self._connect_channel),
                 # yangs
                 web.get(path="/yangs", handler=self._list_yangs),
                 web.get(path="/yangs/{id}", handler=self._get_yang),
+                # stats
+                web.get(path="/stats", handler=self._get_stats),
             ]
         )
 
@@ -443,14 +727,20 @@ class Server(object):
         await runner.setup()
         site = web.TCPSite(runner, self._host, self._port)
         await site.start()
+        logger.info(f"Manager is running on {self._host}:{self._port}")
+        if self._unix_socket_path is not None:
+            unix_site = web.UnixSite(runner, self._unix_socket_path)
+            await unix_site.start()
+            logger.info(f"Manager is running on unix://{self._unix_socket_path}")
         self._runner = runner
         self._status = STATUS_RUNNING
-        logger.info(f"Manager is running on {self._host}:{self._port}")
 
     async def stop(self) -> None:
         if self._runner is not None:
             self._status = STATUS_STOPPING
             await self._runner.cleanup()
+            if self._unix_socket_path is not None:
+                pathlib.Path(self._unix_socket_path).unlink(missing_ok=True)
             self._status = STATUS_STOPPED
             self._runner = None
             logger.info(f"Stopped.")
@@ -0,0 +1,525 @@
+import logging
+import typing
+import json
+import asyncio
+import pathlib
+import collections
+
+import aiohttp
+from aiohttp import web
+
+from . import exceptions, manager_interface
+from .. import constants
+from ..libs import http_client, hash_ring, frame
+
+logger = logging.getLogger(__name__)
+
+# Lines of 'POST /stubs:bulk' forwarded to a shard in one request
+BULK_CHUNK_LINES: typing.Final = 500
+
+
+class Server(object):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        manager_endpoints: list[str],
+        unix_socket_path: typing.Optional[str] = None,
+        timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+        shard_endpoints: typing.Optional[list[list[str]]] = None,
+    ) -> None:
+        if not manager_endpoints:
+            raise ValueError("manager_endpoints must be set")
+        if shard_endpoints is not None and len(shard_endpoints) != len(
+            manager_endpoints
+        ):
+            raise ValueError("shard_endpoints must have one item per manager")
+
+        self._host = host
+        self._port = port
+        self._manager_endpoints = manager_endpoints
+        self._unix_socket_path = unix_socket_path
+        self._timeout = timeout
+        # Advertised to clients (GET /shards), in order of preference for each shard
+        self._shard_endpoints = (
+            [[e] for e in manager_endpoints]
+            if shard_endpoints is None
+            else shard_endpoints
+        )
+        self._ring = hash_ring.create_shard_ring(shard_count=len(manager_endpoints))
+        self._shards: list[tuple[str, http_client.Session]] = []
+        self._channels: set[web.WebSocketResponse] = set()
+        self._runner: typing.Optional[web.AppRunner] = None
+
+    def _get_shard_index(self, stub_id: str) -> int:
+        return int(self._ring.get_node(stub_id))
+
+    async def _forward(
+        self, request: web.Request, shard_index: int, body: typing.Optional[bytes]
+    ) -> http_client.ResponseData:
+        endpoint, session = self._shards[shard_index]
+        url = f"{endpoint}{request.raw_path}"
+
+        headers = {}
+        for name in ["Content-Type", "Accept"]:
+            if name in request.headers:
+                headers[name] = request.headers[name]
+
+        response = await session.request(
+            method=request.method,
+            url=url,
+            headers=headers,
+            body=body,
+            timeout=self._timeout,
+        )
+        return response
+
+    def _to_response(self, response: http_client.ResponseData) -> web.Response:
+        headers = {
+            "Content-Type": response.headers.get(
+                "Content-Type", "application/octet-stream"
+            )
+        }
+        # Lets stubs behind the router back off from an overloaded manager
+        if "Retry-After" in response.headers:
+            headers["Retry-After"] = response.headers["Retry-After"]
+        return web.Response(
+            status=response.code, body=response.content, headers=headers
+        )
+
+    async def _handle_echo(self, request: web.Request) -> web.Response:
+        response = web.json_response(
+            status=200,
+            data={
+                "echo": {
+                    "method": request.method,
+                    "path": request.path,
+                    "query": http_client.to_query_dict(request.query_string),
+                    "headers": dict(request.headers),
+                    "body": await request.text(),
+                }
+            },
+        )
+        return response
+
+    async def _create_stub(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        try:
+            id = json.loads(body)["stub"]["id"]
+        except (ValueError, KeyError, TypeError):
+            raise exceptions.ValidationError("Invalid request body")
+        if not isinstance(id, str):
+            raise exceptions.ValidationError("Invalid request body")
+
+        response = await self._forward(
+            request=request, shard_index=self._get_shard_index(id), body=body
+        )
+        return self._to_response(response)
+
+    async def _bulk_create_stubs(self, request: web.Request) -> web.StreamResponse:
+        # Streams the NDJSON lines to their shards in chunks (one in flight per shard)
+        # and the results back in line order, so the body is never held at once
+        response = web.StreamResponse(
+            status=200, headers={"Content-Type": "application/x-ndjson"}
+        )
+        await response.prepare(request)
+
+        chunks: list[list[tuple[int, str, bytes]]] = [[] for _ in self._shards]
+        tasks: dict[int, asyncio.Task[list[dict[str, typing.Any]]]] = {}
+        # Line numbers not written yet in order, the shard of each, and their results
+        pending: collections.deque[int] = collections.deque()
+        line_shards: dict[int, int] = {}
+        results: dict[int, dict[str, typing.Any]] = {}
+
+        async def _write_results() -> None:
+            while pending and pending[0] in results:
+                line_number = pending.popleft()
+                line_shards.pop(line_number, None)
+                result = results.pop(line_number)
+                await response.write(json.dumps(result).encode() + b"\n")
+
+        async def _collect(shard_index: int) -> None:
+            task = tasks.pop(shard_index, None)
+            if task is not None:
+                for result in await task:
+                    results[result["line"]] = result
+                await _write_results()
+
+        async def _send(shard_index: int) -> None:
+            await _collect(shard_index)
+            tasks[shard_index] = asyncio.ensure_future(
+                self._forward_bulk_chunk(
+                    request=request, shard_index=shard_index, chunk=chunks[shard_index]
+                )
+            )
+            chunks[shard_index] = []
+
+        try:
+            async for line_number, line in manager_interface.read_lines(
+                request.content
+            ):
+                if line is None:
+                    pending.append(line_number)
+                    results[line_number] = manager_interface.oversized_line_result(
+                        line_number
+                    )
+                    await _write_results()
+                    continue
+                if not line.strip():
+                    continue
+                pending.append(line_number)
+                try:
+                    id = json.loads(line)["stub"]["id"]
+                except (ValueError, KeyError, TypeError):
+                    id = None
+                if not isinstance(id, str):
+                    e = exceptions.ValidationError("Invalid request body")
+                    results[line_number] = {
+                        "line": line_number,
+                        "stubId": None,
+                        "code": 400,
+                        "errorMessage": f"{e.__class__.__name__}: {str(e)}",
+                    }
+                    await _write_results()
+                    continue
+
+                shard_index = self._get_shard_index(id)
+                line_shards[line_number] = shard_index
+                chunks[shard_index].append((line_number, id, line))
+                if len(chunks[shard_index]) >= BULK_CHUNK_LINES:
+                    await _send(shard_index)
+
+                # Results waiting for an earlier line are bounded: its chunk is sent
+                # or waited for
+                while len(pending) > BULK_CHUNK_LINES * (len(self._shards) + 1):
+                    shard_index = line_shards[pending[0]]
+                    if chunks[shard_index] and chunks[shard_index][0][0] == pending[0]:
+                        await _send(shard_index)
+                    await _collect(shard_index)
+
+            for shard_index, chunk in enumerate(chunks):
+                if chunk:
+                    await _send(shard_index)
+            for shard_index in range(len(self._shards)):
+                await _collect(shard_index)
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+        await response.write_eof()
+        return response
+
+    async def _forward_bulk_chunk(
+        self,
+        request: web.Request,
+        shard_index: int,
+        chunk: list[tuple[int, str, bytes]],
+    ) -> list[dict[str, typing.Any]]:
+        try:
+            response = await self._forward(
+                request=request,
+                shard_index=shard_index,
+                body=b"\n".join(line for _, _, line in chunk),
+            )
+        except Exception as e:
+            code, error_message = 502, f"{e.__class__.__name__}: {str(e)}"
+        else:
+            if response.code == 200:
+                results: dict[int, dict[str, typing.Any]] = {}
+                for line in response.content.splitlines():
+                    try:
+                        result = json.loads(line)
+                        index = result["line"] - 1
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    if 0 <= index < len(chunk):
+                        # Line numbers of the chunk -> line numbers of the request body
+                        result["line"] = chunk[index][0]
+                        results[result["line"]] = result
+
+                # Lines the shard never answered (e.g. its response was cut off)
+                error = exceptions.NetworkError("No result from the manager")
+                return [
+                    results.get(line_number)
+                    or {
+                        "line": line_number,
+                        "stubId": id,
+                        "code": 502,
+                        "errorMessage": f"{error.__class__.__name__}: {str(error)}",
+                    }
+                    for line_number, id, _ in chunk
+                ]
+            code, error_message = response.code, response.body
+
+        # The whole chunk failed
+        return [
+            {
+                "line": line_number,
+                "stubId": id,
+                "code": code,
+                "errorMessage": error_message,
+            }
+            for line_number, id, _ in chunk
+        ]
+
+    async def _forward_stub(self, request: web.Request) -> web.Response:
+        id = request.match_info["id"]
+        response = await self._forward(
+            request=request,
+            shard_index=self._get_shard_index(id),
+            body=await request.read(),
+        )
+        return self._to_response(response)
+
+    async def _forward_any(self, request: web.Request) -> web.Response:
+        # Every shard has the same yangs
+        response = await self._forward(
+            request=request, shard_index=0, body=await request.read()
+        )
+        return self._to_response(response)
+
+    async def _fan_out_stubs(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        responses = await asyncio.gather(
+            *[
+                self._forward(request=request, shard_index=i, body=body)
+                for i in range(len(self._shards))
+            ]
+        )
+
+        stubs: list[typing.Any] = []
+        for response in responses:
+            if response.code != 200:
+                return self._to_response(response)
+            stubs.extend(json.loads(response.body)["stubs"])
+
+        return web.json_response(status=200, data={"stubs": stubs})
+
+    async def _get_shards(self, request: web.Request) -> web.Response:
+        # Lets clients send requests straight to the owning shard (see RoutedClient)
+        return web.json_response(status=200, data={"shards": self._shard_endpoints})
+
+    async def _fan_out_stats(self, request: web.Request) -> web.Response:
+        responses = await asyncio.gather(
+            *[
+                self._forward(request=request, shard_index=i, body=None)
+                for i in range(len(self._shards))
+            ]
+        )
+
+        stats: dict[str, int] = {}
+        for response in responses:
+            if response.code != 200:
+                return self._to_response(response)
+            for k, v in json.loads(response.body)["stats"].items():
+                stats[k] = stats.get(k, 0) + v
+
+        return web.json_response(status=200, data={"stats": stats})
+
+    async def _connect_channel(self, request: web.Request) -> web.WebSocketResponse:
+        # Stubs with --manager-transport websocket; each request frame is forwarded
+        # to the owning shard over HTTP
+        ws = web.WebSocketResponse(heartbeat=30.0)
+        await ws.prepare(request)
+        self._channels.add(ws)
+        logger.info(f"Channel from '{request.remote}' established.")
+
+        send_lock = asyncio.Lock()
+        tasks: set[asyncio.Task[None]] = set()
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.BINARY:
+                    continue
+
+                try:
+                    header, payload = frame.decode(msg.data)
+                except frame.FrameError as e:
+                    logger.warning(f"Invalid frame from '{request.remote}': {e}")
+                    continue
+                if header["type"] != "request":
+                    continue
+
+                task = asyncio.create_task(
+                    self._forward_channel_request(
+                        ws=ws, send_lock=send_lock, header=header, payload=payload
+                    )
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            self._channels.discard(ws)
+            for task in tasks:
+                task.cancel()
+            logger.info(f"Channel from '{request.remote}' closed.")
+
+        return ws
+
+    async def _forward_channel_request(
+        self,
+        ws: web.WebSocketResponse,
+        send_lock: asyncio.Lock,
+        header: dict[str, typing.Any],
+        payload: bytes,
+    ) -> None:
+        id = header["stubId"]
+        reply_header = {"type": "response", "requestId": header["requestId"]}
+        endpoint, session = self._shards[self._get_shard_index(id)]
+
+        try:
+            response = await session.request(
+                method="POST",
+                url=f"{endpoint}/stubs/{id}:handle",
+                headers={"Content-Type": frame.MEDIA_TYPE, "Accept": frame.MEDIA_TYPE},
+                body=frame.encode(header=header["request"], payload=payload),
+                timeout=self._timeout,
+            )
+            if frame.is_frame(response.headers.get("Content-Type")):
+                res_header, res_payload = frame.decode(response.content)
+                data = frame.encode(
+                    header={**res_header, **reply_header, "framed": True},
+                    payload=res_payload,
+                )
+            else:
+                data = frame.encode(
+                    header={
+                        **reply_header,
+                        "framed": False,
+                        "code": response.code,
+                        "headers": response.headers,
+                    },
+                    payload=response.content,
+                )
+        except Exception as e:
+            code = (
+                502
+                if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+                else 500
+            )
+            if code == 500:
+                logger.exception("RouterError: ")
+            data = frame.encode(
+                header={
+                    **reply_header,
+                    "framed": False,
+                    "code": code,
+                    "headers": {"content-type": "application/json"},
+                },
+                payload=manager_interface.create_error_message(code=code, e=e).encode(
+                    "utf-8"
+                ),
+            )
+        logger.info(f"Forwarded: {id} (Channel: POST /stubs/{id}:handle)")
+
+        async with send_lock:
+            if not ws.closed:
+                await ws.send_bytes(data)
+
+    async def _on_shutdown(self, app: typing.Any) -> None:
+        for ws in list(self._channels):
+            await ws.close(code=aiohttp.WSCloseCode.GOING_AWAY)
+
+    @web.middleware
+    async def _handle_error(
+        self, request: web.Request, handler: typing.Any
+    ) -> web.Response:
+        try:
+            logger.info(f"Received: {request.method} {request.path}")
+            response: web.Response = await handler(request)
+            logger.info(
+                f"Responded: {response.status} (Request: {request.method} {request.path})"
+            )
+            return response
+        except exceptions.ValidationError as e:
+            logger.info(f"Responded: 400 (Request: {request.method} {request.path})")
+            raise web.HTTPBadRequest(
+                text=manager_interface.create_error_message(code=400, e=e),
+                content_type="application/json",
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.info(f"Responded: 502 (Request: {request.method} {request.path})")
+            raise web.HTTPBadGateway(
+                text=manager_interface.create_error_message(code=502, e=e),
+                content_type="application/json",
+            )
+        except web.HTTPException as e:
+            logger.info(
+                f"Responded: {e.status_code} (Request: {request.method} {request.path})"
+            )
+            e.text = manager_interface.create_error_message(code=e.status_code, e=e)
+            e.content_type = "application/json"
+            raise e
+        except Exception as e:
+            logger.info(f"Responded: 500 (Request: {request.method} {request.path})")
+            logger.exception("RouterError: ")
+            raise web.HTTPInternalServerError(
+                text=manager_interface.create_error_message(code=500, e=e),
+                content_type="application/json",
+            )
+
+    async def start(self) -> None:
+        for endpoint in self._manager_endpoints:
+            base_url, unix_socket_path = http_client.split_unix_endpoint(
+                endpoint.rstrip("/")
+            )
+            session = http_client.Session(
+                default_timeout=self._timeout,
+                limit=constants.DEFAULT_MANAGER_POOL_SIZE,
+                keepalive_timeout=constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+                unix_socket_path=unix_socket_path,
+            )
+            self._shards.append((base_url, session))
+
+        aiohttp_app = web.Application(
+            client_max_size=10 * 1024 * 1024,
+            middlewares=[self._handle_error],
+        )
+        aiohttp_app.on_shutdown.append(self._on_shutdown)
+        aiohttp_app.add_routes(
+            [
+                # echo
+                web.route(method="*", path="/echo", handler=self._handle_echo),
+                # stubs
+                web.post(path="/stubs", handler=self._create_stub),
+                web.post(path="/stubs:bulk", handler=self._bulk_create_stubs),
+                web.get(path="/stubs", handler=self._fan_out_stubs),
+                web.post(path="/stubs:reload", handler=self._fan_out_stubs),
+                web.post(path="/stubs:reset", handler=self._fan_out_stubs),
+                web.get(path="/stubs:connect", handler=self._connect_channel),
+                web.post(path="/stubs/{id}:handle", handler=self._forward_stub),
+                web.route(method="*", path="/stubs/{id}", handler=self._forward_stub),
+                web.get(path="/stubs/{id}/{property}", handler=self._forward_stub),
+                # yangs
+                web.get(path="/yangs", handler=self._forward_any),
+                web.get(path="/yangs/{id}", handler=self._forward_any),
+                # stats
+                web.get(path="/stats", handler=self._fan_out_stats),
+                # shards
+                web.get(path="/shards", handler=self._get_shards),
+            ]
+        )
+
+        # Start http server
+        runner = web.AppRunner(aiohttp_app, handle_signals=False)
+        await runner.setup()
+        site = web.TCPSite(runner, self._host, self._port)
+        await site.start()
+        logger.info(
+            f"Router is running on {self._host}:{self._port} "
+            f"({len(self._shards)} shards: {', '.join(self._manager_endpoints)})"
+        )
+        if self._unix_socket_path is not None:
+            unix_site = web.UnixSite(runner, self._unix_socket_path)
+            await unix_site.start()
+            logger.info(f"Router is running on unix://{self._unix_socket_path}")
+        self._runner = runner
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            if self._unix_socket_path is not None:
+                pathlib.Path(self._unix_socket_path).unlink(missing_ok=True)
+            self._runner = None
+        for _, session in self._shards:
+            await session.close()
+        self._shards = []
+        logger.info(f"Stopped.")
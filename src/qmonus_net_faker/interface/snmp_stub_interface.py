@@ -4,16 +4,18 @@ import json
 
 import snmp_agent
 
-from . import exceptions
-from ..libs import http_client
+from . import exceptions, manager_client
+from .. import constants
 
 logger = logging.getLogger(__name__)
 
+SNMP_ERROR_STATUS_GEN_ERR = 5
+
 
 class Handler(object):
-    def __init__(self, stub_id: str, manager_endpoint: str) -> None:
+    def __init__(self, stub_id: str, manager_client: manager_client.BaseClient) -> None:
         self._stub_id = stub_id
-        self._manager_endpoint = manager_endpoint.rstrip("/")
+        self._manager_client = manager_client
 
     async def handle(self, request: snmp_agent.SNMPRequest) -> snmp_agent.SNMPResponse:
         pdu_type: typing.Literal["GET", "GET_NEXT", "GET_BULK"]
@@ -50,6 +52,16 @@ class Handler(object):
             max_repetitions=request.max_repetitions,
             objects=objects,
         )
+        if r.overloaded:
+            # genErr lets the poller fail fast instead of waiting for its timeout
+            return request.create_response(
+                variable_bindings=[
+                    snmp_agent.VariableBinding(oid=vb.oid, value=snmp_agent.Null())
+                    for vb in request.variable_bindings
+                ],
+                error_status=SNMP_ERROR_STATUS_GEN_ERR,
+                error_index=0,
+            )
         if r.code != 200:
             raise exceptions.Error(f"Failed to get oids: {r.code} {r.body}")
 
@@ -102,8 +114,7 @@ class Handler(object):
         non_repeaters: int,
         max_repetitions: int,
         objects: list[dict[str, typing.Any]],
-    ) -> http_client.ResponseData:
-        url = f"{self._manager_endpoint}/stubs/{self._stub_id}:handle"
+    ) -> manager_client.Reply:
         body = {
             "id": self._stub_id,
             "protocol": "snmp",
@@ -115,12 +126,7 @@ class Handler(object):
             "max_repetitions": max_repetitions,
             "objects": objects,
         }
-        async with http_client.Session() as sess:
-            response = await sess.request(
-                method="POST",
-                url=url,
-                body=json.dumps(body),
-            )
+        response = await self._manager_client.handle(stub_id=self._stub_id, body=body)
         return response
 
 
@@ -129,8 +135,15 @@ class Server(object):
         self,
         host: str,
         port: int,
-        stub_id: str,
+        stub_id: typing.Union[str, dict[str, str]],
         manager_endpoint: str,
+        manager_pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+        manager_keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+        manager_timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+        manager_transport: typing.Literal[
+            "http", "websocket"
+        ] = constants.DEFAULT_MANAGER_TRANSPORT,
+        client: typing.Optional[manager_client.BaseClient] = None,
     ) -> None:
         if None in [host, port, stub_id, manager_endpoint]:
             raise ValueError("host, port, stub_id, and manager_endpoint must be set")
@@ -138,24 +151,51 @@ class Server(object):
         self._host = host
         self._port = port
         self._stub_id = stub_id
-        self._manager_endpoint = manager_endpoint
-        self._server: typing.Optional[snmp_agent.Server] = None
+        # A client passed in is shared with other stubs and is started/stopped by its owner
+        self._owns_manager_client = client is None
+        self._manager_client = (
+            manager_client.create_client(
+                manager_endpoint=manager_endpoint,
+                transport=manager_transport,
+                pool_size=manager_pool_size,
+                keepalive_timeout=manager_keepalive_timeout,
+                timeout=manager_timeout,
+            )
+            if client is None
+            else client
+        )
+        self._servers: list[snmp_agent.Server] = []
+
+    def get_stats(self) -> dict[str, int]:
+        return self._manager_client.get_stats()
 
     async def start(self) -> None:
-        handler = Handler(
-            stub_id=self._stub_id, manager_endpoint=self._manager_endpoint
-        )
+        if self._owns_manager_client:
+            await self._manager_client.start()
+
+        # A wildcard UDP socket cannot tell which address a datagram was sent to,
+        # so each assigned address gets its own socket
+        bindings: dict[str, str]
+        if isinstance(self._stub_id, str):
+            bindings = {self._host: self._stub_id}
+        else:
+            bindings = self._stub_id
 
-        server = snmp_agent.Server(
-            handler=handler.handle, host=self._host, port=self._port
-        )
-        await server.start()
-        self._server = server
+        for host, stub_id in bindings.items():
+            handler = Handler(stub_id=stub_id, manager_client=self._manager_client)
+            server = snmp_agent.Server(
+                handler=handler.handle, host=host, port=self._port
+            )
+            await server.start()
+            self._servers.append(server)
 
-        logger.info(f"SNMP server is running on {self._host}:{self._port}")
+            logger.info(f"SNMP server is running on {host}:{self._port}")
 
     async def stop(self) -> None:
-        if self._server is not None:
-            await self._server.stop()
-            self._server = None
+        if self._servers:
+            for server in self._servers:
+                await server.stop()
+            self._servers = []
+            if self._owns_manager_client:
+                await self._manager_client.stop()
             logger.info(f"Stopped.")
@@ -2,18 +2,28 @@ import typing
 import logging
 import json
 import pathlib
+import functools
 
 from asyncssh import misc
 from asyncssh import server
 from asyncssh import connection
 from asyncssh import process
+from asyncssh import public_key
 
-from . import exceptions
-from ..libs import xml_utils, http_client
+from . import exceptions, manager_client, stub_resolver
+from .. import constants
+from ..libs import xml_utils, netconf
 
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=None)
+def load_host_key() -> public_key.SSHKey:
+    # Shared by every ssh stub in the process
+    path = pathlib.Path(__file__).with_name("ssh_host_key").resolve()
+    return public_key.read_private_key(path)
+
+
 class SSHServer(server.SSHServer):
     def __init__(self) -> None:
         self.conn: typing.Optional[connection.SSHServerConnection] = None
@@ -46,17 +56,22 @@ class SSHServer(server.SSHServer):
 
 
 class Handler(object):
-    def __init__(self, stub_id: str, manager_endpoint: str) -> None:
-        self._stub_id = stub_id
-        self._manager_endpoint = manager_endpoint.rstrip("/")
+    def __init__(
+        self,
+        stub_id: typing.Union[str, dict[str, str]],
+        manager_client: manager_client.BaseClient,
+    ) -> None:
+        self._resolver = stub_resolver.Resolver(stub_id=stub_id)
+        self._manager_client = manager_client
         self._session_count = 0
 
     async def handle(self, process: process.SSHServerProcess[typing.Any]) -> None:
         try:
+            stub_id = self._resolver.resolve(process.get_extra_info("sockname"))
             if process.subsystem is None:
-                await self._handle_ssh(process=process)
+                await self._handle_ssh(process=process, stub_id=stub_id)
             elif process.subsystem == "netconf":
-                await self._handle_netconf(process=process)
+                await self._handle_netconf(process=process, stub_id=stub_id)
             else:
                 raise exceptions.InputValueError(
                     f"Invalid subsystem '{process.subsystem}'"
@@ -68,7 +83,9 @@ class Handler(object):
 
         process.exit(0)
 
-    async def _handle_ssh(self, process: process.SSHServerProcess[typing.Any]) -> None:
+    async def _handle_ssh(
+        self, process: process.SSHServerProcess[typing.Any], stub_id: str
+    ) -> None:
         self._session_count += 1
         session_id = self._session_count
         username = process.get_extra_info("username")
@@ -77,6 +94,7 @@ class Handler(object):
 
         # login message
         response = await self._send_ssh_data_to_manager(
+            stub_id=stub_id,
             session_id=session_id,
             username=username,
             connection_status="login",
@@ -100,6 +118,7 @@ class Handler(object):
                 logger.debug(line)
 
                 response = await self._send_ssh_data_to_manager(
+                    stub_id=stub_id,
                     session_id=session_id,
                     username=username,
                     connection_status="established",
@@ -108,6 +127,12 @@ class Handler(object):
                     state=state,
                 )
 
+                if response.overloaded:
+                    # The session survives; the input is dropped as on a busy device
+                    process.stdout.write(
+                        f"\n{constants.DEVICE_BUSY_MESSAGE}\n\n{prompt}"
+                    )
+                    continue
                 if response.code != 200:
                     sending = f"{response.code}: {response.body}\n"
                     raise exceptions.Error(sending)
@@ -121,7 +146,7 @@ class Handler(object):
             pass
 
     async def _handle_netconf(
-        self, process: process.SSHServerProcess[typing.Any]
+        self, process: process.SSHServerProcess[typing.Any], stub_id: str
     ) -> None:
         self._session_count += 1
         session_id = self._session_count
@@ -129,6 +154,7 @@ class Handler(object):
 
         # hello to client
         response = await self._send_netconf_data_to_manager(
+            stub_id=stub_id,
             session_id=session_id,
             username=username,
             connection_status="login",
@@ -153,13 +179,10 @@ class Handler(object):
             logger.debug("Received: " + received_with_sep)
 
             received_str = received_with_sep.replace("]]>]]>", "")
-            received_xml = xml_utils.from_string(received_str)
-            message_id = received_xml.attrib["message-id"]
+            # The manager parses the rpc; only its head is needed here
+            message_id, operation = netconf.peek_rpc(received_str)
 
-            if received_xml.xpath(
-                "./nc:close-session",
-                namespaces={"nc": "urn:ietf:params:xml:ns:netconf:base:1.0"},
-            ):
+            if operation == f"{{{netconf.YANG_NAMESPACE}}}close-session":
                 sending = f"""
                 <rpc-reply message-id="{message_id}" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
                     <ok/>
@@ -171,6 +194,7 @@ class Handler(object):
                 break
             else:
                 response = await self._send_netconf_data_to_manager(
+                    stub_id=stub_id,
                     session_id=session_id,
                     username=username,
                     connection_status="established",
@@ -181,34 +205,52 @@ class Handler(object):
                     sending = response.body + "]]>]]>"
                     logger.debug("Sending: " + sending)
                     process.stdout.write(sending)
+                elif response.overloaded:
+                    sending = self._create_rpc_error(
+                        message_id=message_id,
+                        type="application",
+                        tag="resource-denied",
+                        message=constants.DEVICE_BUSY_MESSAGE,
+                    )
+                    process.stdout.write(sending)
                 else:
                     msg = f"Invalid response from manager: {response.code}: {response.body}"
                     logger.error(msg)
-                    sending = f"""
-                    <rpc-reply message-id="{message_id}" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-                        <rpc-error>
-                            <error-type>protocol</error-type>
-                            <error-tag>operation-failed</error-tag>
-                            <error-severity>error</error-severity>
-                            <error-message>{msg}</error-message>
-                            <error-info></error-info>
-                        </rpc-error>
-                    </rpc-reply>]]>]]>
-                    """
+                    sending = self._create_rpc_error(
+                        message_id=message_id,
+                        type="protocol",
+                        tag="operation-failed",
+                        message=msg,
+                    )
                     process.stdout.write(sending)
 
+    def _create_rpc_error(
+        self, message_id: str, type: str, tag: str, message: str
+    ) -> str:
+        return f"""
+        <rpc-reply message-id="{message_id}" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+            <rpc-error>
+                <error-type>{type}</error-type>
+                <error-tag>{tag}</error-tag>
+                <error-severity>error</error-severity>
+                <error-message>{message}</error-message>
+                <error-info></error-info>
+            </rpc-error>
+        </rpc-reply>]]>]]>
+        """
+
     async def _send_ssh_data_to_manager(
         self,
+        stub_id: str,
         session_id: int,
         username: str,
         connection_status: str,
         input: str,
         prompt: str,
         state: dict[typing.Any, typing.Any],
-    ) -> http_client.ResponseData:
-        url = f"{self._manager_endpoint}/stubs/{self._stub_id}:handle"
+    ) -> manager_client.Reply:
         body = {
-            "id": self._stub_id,
+            "id": stub_id,
             "protocol": "ssh",
             "connectionStatus": connection_status,
             "sessionId": session_id,
@@ -218,17 +260,19 @@ class Handler(object):
             "state": state,
         }
 
-        async with http_client.Session() as sess:
-            response = await sess.request(method="POST", url=url, body=json.dumps(body))
-
+        response = await self._manager_client.handle(stub_id=stub_id, body=body)
         return response
 
     async def _send_netconf_data_to_manager(
-        self, session_id: int, username: str, connection_status: str, rpc: str
-    ) -> http_client.ResponseData:
-        url = f"{self._manager_endpoint}/stubs/{self._stub_id}:handle"
+        self,
+        stub_id: str,
+        session_id: int,
+        username: str,
+        connection_status: str,
+        rpc: str,
+    ) -> manager_client.Reply:
         body = {
-            "id": self._stub_id,
+            "id": stub_id,
             "protocol": "netconf",
             "connectionStatus": connection_status,
             "sessionId": session_id,
@@ -236,15 +280,26 @@ class Handler(object):
             "rpc": rpc,
         }
 
-        async with http_client.Session() as sess:
-            response = await sess.request(method="POST", url=url, body=json.dumps(body))
-
+        response = await self._manager_client.handle(
+            stub_id=stub_id, body=body, payload_field="rpc"
+        )
         return response
 
 
 class Server(object):
     def __init__(
-        self, host: str, port: int, stub_id: str, manager_endpoint: str
+        self,
+        host: str,
+        port: int,
+        stub_id: typing.Union[str, dict[str, str]],
+        manager_endpoint: str,
+        manager_pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+        manager_keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+        manager_timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+        manager_transport: typing.Literal[
+            "http", "websocket"
+        ] = constants.DEFAULT_MANAGER_TRANSPORT,
+        client: typing.Optional[manager_client.BaseClient] = None,
     ) -> None:
         if None in [host, port, stub_id, manager_endpoint]:
             raise ValueError("host, port, stub_id, and manager_endpoint must be set")
@@ -252,23 +307,37 @@ class Server(object):
         self._host = host
         self._port = port
         self._stub_id = stub_id
-        self._manager_endpoint = manager_endpoint
+        # A client passed in is shared with other stubs and is started/stopped by its owner
+        self._owns_manager_client = client is None
+        self._manager_client = (
+            manager_client.create_client(
+                manager_endpoint=manager_endpoint,
+                transport=manager_transport,
+                pool_size=manager_pool_size,
+                keepalive_timeout=manager_keepalive_timeout,
+                timeout=manager_timeout,
+            )
+            if client is None
+            else client
+        )
         self._server: typing.Optional[connection.SSHAcceptor] = None
 
+    def get_stats(self) -> dict[str, int]:
+        return self._manager_client.get_stats()
+
     async def start(self) -> None:
-        handler = Handler(
-            stub_id=self._stub_id, manager_endpoint=self._manager_endpoint
-        )
+        if self._owns_manager_client:
+            await self._manager_client.start()
+        handler = Handler(stub_id=self._stub_id, manager_client=self._manager_client)
 
         def create_ssh_server() -> SSHServer:
             return SSHServer()
 
-        ssh_host_key = pathlib.Path(__file__).with_name("ssh_host_key").resolve()
         self._server = await connection.create_server(
             create_ssh_server,
             self._host,
             self._port,
-            server_host_keys=[ssh_host_key],
+            server_host_keys=[load_host_key()],
             process_factory=handler.handle,
         )
 
@@ -279,4 +348,6 @@ class Server(object):
             self._server.close()
             await self._server.wait_closed()
             self._server = None
+            if self._owns_manager_client:
+                await self._manager_client.stop()
             logger.info(f"Stopped.")
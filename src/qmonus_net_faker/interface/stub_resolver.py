@@ -0,0 +1,28 @@
+import typing
+
+from . import exceptions
+
+
+class Resolver(object):
+    def __init__(self, stub_id: typing.Union[str, dict[str, str]]) -> None:
+        # stub_id: a single stub-id, or local address -> stub-id for listeners shared by many stubs
+        self._stub_id = stub_id
+
+    @property
+    def stub_ids(self) -> list[str]:
+        if isinstance(self._stub_id, str):
+            return [self._stub_id]
+        return list(self._stub_id.values())
+
+    def resolve(self, sockname: typing.Any) -> str:
+        if isinstance(self._stub_id, str):
+            return self._stub_id
+
+        address = sockname[0] if sockname else ""
+        if address.startswith("::ffff:"):
+            address = address[len("::ffff:") :]
+
+        stub_id = self._stub_id.get(address)
+        if stub_id is None:
+            raise exceptions.NotFoundError(f"No stub is assigned to '{address}'")
+        return stub_id
@@ -4,28 +4,36 @@ import json
 
 import telnetlib3
 
-from . import exceptions
-from ..libs import str_utils, http_client
+from . import exceptions, manager_client, stub_resolver
+from .. import constants
+from ..libs import str_utils
 
 logger = logging.getLogger(__name__)
 
 
 class Handler(object):
-    def __init__(self, stub_id: str, manager_endpoint: str) -> None:
-        self._stub_id = stub_id
-        self._manager_endpoint = manager_endpoint.rstrip("/")
+    def __init__(
+        self,
+        stub_id: typing.Union[str, dict[str, str]],
+        manager_client: manager_client.BaseClient,
+    ) -> None:
+        self._resolver = stub_resolver.Resolver(stub_id=stub_id)
+        self._manager_client = manager_client
         self._session_count = 0
 
     async def handle(self, reader: typing.Any, writer: typing.Any) -> None:
         try:
-            await self._handle(reader=reader, writer=writer)
+            stub_id = self._resolver.resolve(writer.get_extra_info("sockname"))
+            await self._handle(reader=reader, writer=writer, stub_id=stub_id)
         except Exception as e:
             logger.exception(e)
             await self._write(writer=writer, string=str(e))
 
         writer.close()
 
-    async def _handle(self, reader: typing.Any, writer: typing.Any) -> None:
+    async def _handle(
+        self, reader: typing.Any, writer: typing.Any, stub_id: str
+    ) -> None:
         self._session_count += 1
         session_id = self._session_count
         prompt = ""
@@ -35,6 +43,7 @@ class Handler(object):
 
         # login message
         response = await self._send_to_manager(
+            stub_id=stub_id,
             input="",
             prompt=prompt,
             state=state,
@@ -76,6 +85,7 @@ class Handler(object):
                 logger.debug(line)
 
                 response = await self._send_to_manager(
+                    stub_id=stub_id,
                     input=line,
                     prompt=prompt,
                     state=state,
@@ -83,6 +93,11 @@ class Handler(object):
                     connection_status="established",
                 )
 
+                if response.overloaded:
+                    # The session survives; the input is dropped as on a busy device
+                    sending = f"\n{constants.DEVICE_BUSY_MESSAGE}\n\n{prompt}"
+                    await self._write(writer=writer, string=sending)
+                    continue
                 if response.code != 200:
                     sending = f"{response.code}: {response.body}\n"
                     raise exceptions.Error(sending)
@@ -100,15 +115,15 @@ class Handler(object):
 
     async def _send_to_manager(
         self,
+        stub_id: str,
         input: str,
         prompt: str,
         state: dict[typing.Any, typing.Any],
         session_id: int,
         connection_status: str,
-    ) -> http_client.ResponseData:
-        url = f"{self._manager_endpoint}/stubs/{self._stub_id}:handle"
+    ) -> manager_client.Reply:
         body = {
-            "id": self._stub_id,
+            "id": stub_id,
             "protocol": "telnet",
             "connectionStatus": connection_status,
             "sessionId": session_id,
@@ -117,15 +132,24 @@ class Handler(object):
             "state": state,
         }
 
-        async with http_client.Session() as sess:
-            response = await sess.request(method="POST", url=url, body=json.dumps(body))
-
+        response = await self._manager_client.handle(stub_id=stub_id, body=body)
         return response
 
 
 class Server(object):
     def __init__(
-        self, host: str, port: int, stub_id: str, manager_endpoint: str
+        self,
+        host: str,
+        port: int,
+        stub_id: typing.Union[str, dict[str, str]],
+        manager_endpoint: str,
+        manager_pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+        manager_keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+        manager_timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+        manager_transport: typing.Literal[
+            "http", "websocket"
+        ] = constants.DEFAULT_MANAGER_TRANSPORT,
+        client: typing.Optional[manager_client.BaseClient] = None,
     ) -> None:
         if None in [host, port, stub_id, manager_endpoint]:
             raise ValueError("host, port, stub_id, and manager_endpoint must be set")
@@ -133,13 +157,28 @@ class Server(object):
         self._host = host
         self._port = port
         self._stub_id = stub_id
-        self._manager_endpoint = manager_endpoint
+        # A client passed in is shared with other stubs and is started/stopped by its owner
+        self._owns_manager_client = client is None
+        self._manager_client = (
+            manager_client.create_client(
+                manager_endpoint=manager_endpoint,
+                transport=manager_transport,
+                pool_size=manager_pool_size,
+                keepalive_timeout=manager_keepalive_timeout,
+                timeout=manager_timeout,
+            )
+            if client is None
+            else client
+        )
         self._server: typing.Optional[typing.Any] = None
 
+    def get_stats(self) -> dict[str, int]:
+        return self._manager_client.get_stats()
+
     async def start(self) -> None:
-        handler = Handler(
-            stub_id=self._stub_id, manager_endpoint=self._manager_endpoint
-        )
+        if self._owns_manager_client:
+            await self._manager_client.start()
+        handler = Handler(stub_id=self._stub_id, manager_client=self._manager_client)
         self._server = await telnetlib3.create_server(
             host=self._host,
             port=self._port,
@@ -153,4 +192,6 @@ class Server(object):
             self._server.close()
             await self._server.wait_closed()
             self._server = None
+            if self._owns_manager_client:
+                await self._manager_client.stop()
             logger.info(f"Stopped.")
@@ -0,0 +1,124 @@
+import typing
+import asyncio
+import collections
+import contextlib
+
+
+class OverloadedError(Exception):
+    pass
+
+
+class AdmissionController(object):
+    # Bounds the requests in flight, in total and per key (0: unlimited).
+    # Requests over a limit, and requests arriving while others wait, wait in one FIFO
+    # queue; they are rejected at once when 'max_queue' requests are already waiting,
+    # or after waiting 'queue_timeout' seconds (0: rejected instead of waiting).
+    def __init__(
+        self,
+        max_inflight: int = 0,
+        max_inflight_per_key: int = 0,
+        max_queue: int = 0,
+        queue_timeout: float = 0.0,
+    ) -> None:
+        if min(max_inflight, max_inflight_per_key, max_queue, queue_timeout) < 0:
+            raise ValueError("Limits must not be negative")
+
+        self._max_inflight = max_inflight
+        self._max_inflight_per_key = max_inflight_per_key
+        self._max_queue = max_queue
+        self._queue_timeout = queue_timeout
+        self._inflight = 0
+        self._inflight_by_key: dict[str, int] = {}
+        self._waiters: collections.deque[tuple[str, asyncio.Future[None]]] = (
+            collections.deque()
+        )
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0}
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            **self._stats,
+            "inflight": self._inflight,
+            "waiting": len(self._waiters),
+        }
+
+    def _has_slot(self, key: str) -> bool:
+        if self._max_inflight and self._inflight >= self._max_inflight:
+            return False
+        if (
+            self._max_inflight_per_key
+            and self._inflight_by_key.get(key, 0) >= self._max_inflight_per_key
+        ):
+            return False
+        return True
+
+    def _take(self, key: str) -> None:
+        self._inflight += 1
+        self._inflight_by_key[key] = self._inflight_by_key.get(key, 0) + 1
+        self._stats["admitted"] += 1
+
+    def _release(self, key: str) -> None:
+        self._inflight -= 1
+        self._inflight_by_key[key] -= 1
+        if self._inflight_by_key[key] == 0:
+            del self._inflight_by_key[key]
+        self._hand_over()
+
+    def _hand_over(self) -> None:
+        # Hand the free slots over to the oldest waiters that can use them
+        for waiter in list(self._waiters):
+            if self._max_inflight and self._inflight >= self._max_inflight:
+                break
+            waiter_key, future = waiter
+            if future.done() or not self._has_slot(waiter_key):
+                continue
+            self._waiters.remove(waiter)
+            self._take(waiter_key)
+            future.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def admit(self, key: str) -> typing.AsyncIterator[None]:
+        if not self._waiters and self._has_slot(key):
+            self._take(key)
+        else:
+            # Behind the requests already waiting
+            await self._wait(key)
+
+        try:
+            yield
+        finally:
+            self._release(key)
+
+    async def _wait(self, key: str) -> None:
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        waiter = (key, future)
+        self._waiters.append(waiter)
+        # Taken at once if no earlier waiter can use the free slots
+        self._hand_over()
+        if future.done():
+            return
+
+        if self._max_queue and len(self._waiters) > self._max_queue:
+            self._waiters.remove(waiter)
+            self._stats["rejected"] += 1
+            raise OverloadedError(f"Too many requests waiting ({len(self._waiters)})")
+        if not self._queue_timeout:
+            self._waiters.remove(waiter)
+            self._stats["rejected"] += 1
+            raise OverloadedError("Limits reached and queue_timeout is 0")
+
+        self._stats["queued"] += 1
+        try:
+            await asyncio.wait_for(future, timeout=self._queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the waiter gave up
+                self._release(key)
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+            if isinstance(e, asyncio.TimeoutError):
+                self._stats["rejected"] += 1
+                raise OverloadedError(
+                    f"Waited more than {self._queue_timeout} seconds"
+                ) from None
+            raise
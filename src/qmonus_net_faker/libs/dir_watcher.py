@@ -0,0 +1,264 @@
+import abc
+import typing
+import logging
+import os
+import sys
+import ctypes
+import ctypes.util
+import struct
+import pathlib
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+MODE_AUTO: typing.Final = "auto"
+MODE_INOTIFY: typing.Final = "inotify"
+MODE_POLL: typing.Final = "poll"
+
+# inotify(7)
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_IN_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+)
+_EVENT = struct.Struct("iIII")
+
+# Written by the interpreter itself on import; never a reason to reload
+_IGNORED_NAMES = {"__pycache__"}
+
+
+class Watcher(abc.ABC):
+    def __init__(
+        self,
+        path: pathlib.Path,
+        on_change: typing.Callable[[], None],
+        pattern: typing.Optional[str] = None,
+    ) -> None:
+        # pattern: only files whose path relative to 'path' matches it are watched
+        self._path = path
+        self._on_change = on_change
+        self._pattern = pattern
+
+    def is_target(self, path: pathlib.Path) -> bool:
+        try:
+            relative_path = path.relative_to(self._path)
+        except ValueError:
+            return False
+        if _IGNORED_NAMES.intersection(relative_path.parts):
+            return False
+        if self._pattern is None:
+            return True
+        return relative_path.match(self._pattern)
+
+    @abc.abstractmethod
+    async def start(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def stop(self) -> None:
+        pass
+
+
+class PollingWatcher(Watcher):
+    def __init__(
+        self,
+        path: pathlib.Path,
+        on_change: typing.Callable[[], None],
+        pattern: typing.Optional[str] = None,
+        interval: float = 1.0,
+    ) -> None:
+        super().__init__(path=path, on_change=on_change, pattern=pattern)
+        self._interval = interval
+        self._task: typing.Optional[asyncio.Task[None]] = None
+
+    def get_current_stat(self) -> dict[str, float]:
+        stat: dict[str, float] = {}
+        for file in self._path.glob("**/*"):
+            if not self.is_target(file):
+                continue
+            try:
+                stat[str(file)] = file.stat().st_mtime
+            except FileNotFoundError:
+                pass
+        return stat
+
+    async def _poll(self, previous_stat: dict[str, float]) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            current_stat = await asyncio.to_thread(self.get_current_stat)
+            if current_stat != previous_stat:
+                previous_stat = current_stat
+                self._on_change()
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        previous_stat = await asyncio.to_thread(self.get_current_stat)
+        self._task = asyncio.create_task(self._poll(previous_stat=previous_stat))
+        logger.info(f"Polling '{self._path}' every {self._interval} seconds.")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class InotifyWatcher(Watcher):
+    def __init__(
+        self,
+        path: pathlib.Path,
+        on_change: typing.Callable[[], None],
+        pattern: typing.Optional[str] = None,
+    ) -> None:
+        super().__init__(path=path, on_change=on_change, pattern=pattern)
+        self._libc = _load_libc()
+        self._fd: typing.Optional[int] = None
+        self._watches: dict[int, pathlib.Path] = {}
+
+    def _add_watch(self, path: pathlib.Path) -> bool:
+        # Watches 'path' and its subdirectories; returns True if a target file exists under it
+        if self._fd is None or path.name in _IGNORED_NAMES:
+            return False
+
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(str(path)), ctypes.c_uint32(_IN_MASK)
+        )
+        if wd < 0:
+            logger.warning(
+                f"Failed to watch '{path}': {os.strerror(ctypes.get_errno())}"
+            )
+            return False
+        self._watches[wd] = path
+
+        found = False
+        try:
+            children = list(path.iterdir())
+        except OSError:
+            return False
+        for child in children:
+            if child.is_dir() and not child.is_symlink():
+                found = self._add_watch(child) or found
+            elif self.is_target(child):
+                found = True
+        return found
+
+    def _read(self) -> None:
+        if self._fd is None:
+            return
+
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size : offset + _EVENT.size + length]
+                offset += _EVENT.size + length
+
+                if mask & _IN_Q_OVERFLOW:
+                    changed = True
+                    continue
+                if mask & _IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+
+                parent = self._watches.get(wd)
+                if parent is None:
+                    continue
+                path = parent.joinpath(os.fsdecode(name.rstrip(b"\0")))
+
+                if mask & _IN_ISDIR:
+                    if mask & (_IN_CREATE | _IN_MOVED_TO):
+                        # Files may be written before the new directory is watched
+                        changed = self._add_watch(path) or changed
+                    elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                        changed = True
+                elif self.is_target(path):
+                    changed = True
+
+        if changed:
+            self._on_change()
+
+    async def start(self) -> None:
+        if self._fd is not None:
+            return
+
+        fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+        self._add_watch(self._path)
+        asyncio.get_running_loop().add_reader(fd, self._read)
+        logger.info(f"Watching '{self._path}' with inotify.")
+
+    async def stop(self) -> None:
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+            self._watches = {}
+
+
+def _load_libc() -> typing.Any:
+    if not sys.platform.startswith("linux"):
+        raise OSError("inotify is not available on this platform")
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError("inotify is not available in libc")
+    return libc
+
+
+def create_watcher(
+    path: pathlib.Path,
+    on_change: typing.Callable[[], None],
+    pattern: typing.Optional[str] = None,
+    mode: typing.Literal["auto", "inotify", "poll"] = MODE_AUTO,
+    interval: float = 1.0,
+) -> Watcher:
+    if mode == MODE_INOTIFY:
+        return InotifyWatcher(path=path, on_change=on_change, pattern=pattern)
+    elif mode == MODE_POLL:
+        return PollingWatcher(
+            path=path, on_change=on_change, pattern=pattern, interval=interval
+        )
+    elif mode == MODE_AUTO:
+        if path.is_dir():
+            try:
+                return InotifyWatcher(path=path, on_change=on_change, pattern=pattern)
+            except OSError as e:
+                logger.info(f"Falling back to polling: {e}")
+        return PollingWatcher(
+            path=path, on_change=on_change, pattern=pattern, interval=interval
+        )
+    else:
+        raise ValueError(f"Invalid mode: '{mode}'")
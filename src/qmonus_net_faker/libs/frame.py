@@ -0,0 +1,72 @@
+import typing
+import json
+import struct
+
+# Frame layout: 4-byte big-endian header length, JSON header, raw payload
+MEDIA_TYPE = "application/x-netfaker-frame"
+
+_LENGTH = struct.Struct("!I")
+
+
+class FrameError(Exception):
+    pass
+
+
+def encode(header: dict[str, typing.Any], payload: bytes = b"") -> bytes:
+    _header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return _LENGTH.pack(len(_header)) + _header + payload
+
+
+def decode(data: bytes) -> tuple[dict[str, typing.Any], bytes]:
+    if len(data) < _LENGTH.size:
+        raise FrameError("Frame is too short")
+
+    (length,) = _LENGTH.unpack_from(data)
+    end = _LENGTH.size + length
+    if len(data) < end:
+        raise FrameError("Frame header is truncated")
+
+    try:
+        header = json.loads(data[_LENGTH.size : end])
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise FrameError("Invalid frame header")
+    if not isinstance(header, dict):
+        raise FrameError("Invalid frame header")
+
+    return header, data[end:]
+
+
+def is_frame(content_type: typing.Optional[str]) -> bool:
+    if content_type is None:
+        return False
+    return content_type.split(";")[0].strip().lower() == MEDIA_TYPE
+
+
+def accepts_frame(accept: typing.Optional[str]) -> bool:
+    if accept is None:
+        return False
+    return any(is_frame(v) for v in accept.split(","))
+
+
+def split(
+    body: dict[str, typing.Any], payload_field: typing.Optional[str] = None
+) -> tuple[dict[str, typing.Any], bytes]:
+    # Move one bulky text field (e.g. NETCONF rpc) out of the header into the payload
+    if payload_field is None or body.get(payload_field) is None:
+        return body, b""
+
+    header = dict(body)
+    payload = header.pop(payload_field).encode("utf-8")
+    header["payloadField"] = payload_field
+    return header, payload
+
+
+def join(header: dict[str, typing.Any], payload: bytes) -> dict[str, typing.Any]:
+    payload_field = header.get("payloadField")
+    if payload_field is None:
+        return header
+
+    body = dict(header)
+    del body["payloadField"]
+    body[payload_field] = payload.decode("utf-8")
+    return body
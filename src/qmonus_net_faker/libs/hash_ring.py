@@ -0,0 +1,39 @@
+import typing
+import bisect
+import hashlib
+
+
+class HashRing(object):
+    def __init__(self, nodes: typing.Sequence[str], replicas: int = 160) -> None:
+        if not nodes:
+            raise ValueError("nodes must not be empty")
+        if len(set(nodes)) != len(nodes):
+            raise ValueError("nodes must be unique")
+
+        self._nodes = list(nodes)
+        ring: list[tuple[int, str]] = []
+        for node in self._nodes:
+            for i in range(replicas):
+                ring.append((_hash(f"{node}#{i}"), node))
+        ring.sort()
+        self._keys = [k for k, _ in ring]
+        self._ring_nodes = [n for _, n in ring]
+
+    @property
+    def nodes(self) -> list[str]:
+        return list(self._nodes)
+
+    def get_node(self, key: str) -> str:
+        if len(self._nodes) == 1:
+            return self._nodes[0]
+        i = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._ring_nodes[i]
+
+
+def create_shard_ring(shard_count: int) -> HashRing:
+    # Shards are named by index so that managers, stubs and routers agree on placement
+    return HashRing(nodes=[str(i) for i in range(shard_count)])
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
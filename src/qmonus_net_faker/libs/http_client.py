@@ -20,7 +20,7 @@ class RequestData(object):
         path: str,
         query: dict[str, list[str]],
         headers: dict[str, str],
-        body: typing.Optional[str],
+        body: typing.Union[str, bytes, None],
     ) -> None:
         self.scheme = scheme
         self.method = method
@@ -49,15 +49,25 @@ class ResponseData(object):
         reason: typing.Optional[str],
         rtt: float,
         headers: dict[str, str],
-        body: str,
         request: RequestData,
+        content: bytes = b"",
+        encoding: str = "utf-8",
     ) -> None:
         self.code = code
         self.reason = reason
         self.rtt = rtt
         self.headers = headers
-        self.body = body
         self.request = request
+        self.content = content
+        self.encoding = encoding
+        self._body: typing.Optional[str] = None
+
+    @property
+    def body(self) -> str:
+        # Decoded from content on first access; framed responses never need it
+        if self._body is None:
+            self._body = self.content.decode(self.encoding, errors="replace")
+        return self._body
 
     def to_dict(self) -> dict[str, typing.Any]:
         return {
@@ -71,9 +81,53 @@ class ResponseData(object):
 
 
 class Session(object):
-    def __init__(self, default_timeout: int = 300) -> None:
+    def __init__(
+        self,
+        default_timeout: int = 300,
+        limit: int = 100,
+        keepalive_timeout: float = 15.0,
+        unix_socket_path: typing.Optional[str] = None,
+    ) -> None:
         self._default_timeout = default_timeout
-        self._session = aiohttp.ClientSession()
+        self._stats = {
+            "requests": 0,
+            "connectionsCreated": 0,
+            "connectionsReused": 0,
+        }
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+
+        connector: aiohttp.BaseConnector
+        if unix_socket_path is not None:
+            connector = aiohttp.UnixConnector(
+                path=unix_socket_path,
+                limit=limit,
+                keepalive_timeout=keepalive_timeout,
+            )
+        else:
+            connector = aiohttp.TCPConnector(
+                limit=limit,
+                keepalive_timeout=keepalive_timeout,
+            )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            trace_configs=[trace_config],
+        )
+
+    async def _on_connection_create_end(
+        self, session: typing.Any, ctx: typing.Any, params: typing.Any
+    ) -> None:
+        self._stats["connectionsCreated"] += 1
+
+    async def _on_connection_reuseconn(
+        self, session: typing.Any, ctx: typing.Any, params: typing.Any
+    ) -> None:
+        self._stats["connectionsReused"] += 1
+
+    def get_stats(self) -> dict[str, int]:
+        return dict(self._stats)
 
     async def close(self) -> None:
         await self._session.close()
@@ -93,7 +147,7 @@ class Session(object):
         query: typing.Optional[dict[str, list[str]]] = None,
         headers: typing.Optional[dict[str, str]] = None,
         basic_auth: typing.Optional[dict[str, str]] = None,
-        body: typing.Optional[str] = None,
+        body: typing.Union[str, bytes, None] = None,
         json_body: typing.Optional[typing.Any] = None,
         timeout: typing.Optional[int] = None,
         ssl: bool = False,
@@ -129,8 +183,9 @@ class Session(object):
         # url = add_query(url, query)
 
         logger.debug(
-            "Sending: {} {} headers: {} body: {}".format(method, url, headers, body)
+            "Sending: {} {} headers: {} body: {!r}".format(method, url, headers, body)
         )
+        self._stats["requests"] += 1
         sent_at = time.time()
 
         async with self._session.request(
@@ -140,7 +195,7 @@ class Session(object):
             headers=headers,
             data=body,
             ssl=_ssl,
-            timeout=timeout,
+            timeout=aiohttp.ClientTimeout(total=timeout),
         ) as resp:
             received_at = time.time()
 
@@ -159,13 +214,23 @@ class Session(object):
                 reason=resp.reason,
                 rtt=received_at - sent_at,
                 headers=dict(resp.headers),
-                body=await resp.text(),
                 request=req,
+                content=await resp.read(),
+                encoding=resp.charset or "utf-8",
             )
 
-        logger.debug(f"Received: {res.to_dict()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Received: {res.to_dict()}")
         return res
 
+    async def ws_connect(
+        self, url: str, heartbeat: typing.Optional[float] = None
+    ) -> typing.Any:  # aiohttp.ClientWebSocketResponse
+        logger.debug(f"Connecting: {url}")
+        self._stats["requests"] += 1
+        ws = await self._session.ws_connect(url=url, heartbeat=heartbeat)
+        return ws
+
     async def get(self, *args: typing.Any, **kwargs: typing.Any) -> ResponseData:
         return await self.request(*args, method="GET", **kwargs)  # type: ignore
 
@@ -203,6 +268,17 @@ class Session(object):
 #     return new_url
 
 
+def split_unix_endpoint(endpoint: str) -> tuple[str, typing.Optional[str]]:
+    # 'unix:///path/to/socket' -> ('http://localhost', '/path/to/socket')
+    parsed = urllib.parse.urlparse(endpoint)
+    if parsed.scheme != "unix":
+        return endpoint, None
+
+    if parsed.netloc or not parsed.path:
+        raise ValueError(f"Invalid unix endpoint: '{endpoint}'")
+    return "http://localhost", parsed.path
+
+
 def to_query_string(query_dict: dict[str, list[str]]) -> str:
     return urllib.parse.urlencode(
         [(key, value) for key, values in query_dict.items() for value in values]
@@ -1,4 +1,7 @@
 import typing
+import functools
+
+from lxml import etree
 
 from . import str_utils
 from . import yang, xml_utils
@@ -9,6 +12,56 @@ logger = logging.getLogger(__name__)
 
 YANG_NAMESPACE = "urn:ietf:params:xml:ns:netconf:base:1.0"
 
+_HELLO_TEMPLATE = """
+<hello xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+    <capabilities>
+        {% for capability in capabilities %}
+        <capability>{{ capability }}</capability>
+        {% endfor %}
+    </capabilities>
+    <session-id>{{ session_id }}</session-id>
+</hello>
+"""
+_SESSION_ID_PLACEHOLDER = "__SESSION_ID__"
+
+
+@functools.lru_cache(maxsize=256)
+def _split_hello_message(capabilities: tuple[str, ...]) -> tuple[str, str]:
+    # Rendered once per set of capabilities, around a placeholder for the session id
+    hello = str_utils.render(
+        template=_HELLO_TEMPLATE,
+        variables={"session_id": _SESSION_ID_PLACEHOLDER, "capabilities": capabilities},
+    )
+    prefix, suffix = hello.split(_SESSION_ID_PLACEHOLDER)
+    return prefix, suffix
+
+
+def render_hello_message(
+    session_id: typing.Union[str, int, None], capabilities: typing.Iterable[str]
+) -> str:
+    prefix, suffix = _split_hello_message(tuple(capabilities))
+    return f"{prefix}{session_id}{suffix}"
+
+
+def peek_rpc(text: str, chunk_size: int = 1024) -> tuple[str, str]:
+    # Reads only as far as the first child of <rpc>: (message-id, operation tag in Clark notation)
+    data = text.lstrip().encode("utf-8")
+    parser = etree.XMLPullParser(events=("start",), remove_blank_text=True)
+    elements: list[typing.Any] = []
+    for i in range(0, len(data), chunk_size):
+        parser.feed(data[i : i + chunk_size])
+        elements.extend(el for _, el in parser.read_events())
+        if len(elements) >= 2:
+            break
+    else:
+        parser.close()
+
+    if not elements:
+        raise ValueError("Empty rpc")
+    message_id = elements[0].attrib["message-id"]
+    operation = elements[1].tag if len(elements) >= 2 else ""
+    return message_id, operation
+
 
 class Netconf(object):
     """Support basic protocol only"""
@@ -96,20 +149,11 @@ class Netconf(object):
 
     @classmethod
     def create_hello_message(
-        cls, session_id: str, capabilities: list[str]
+        cls, session_id: typing.Union[str, int, None], capabilities: list[str]
     ) -> typing.Any:
-        variables = {"session_id": session_id, "capabilities": capabilities}
-        template = """
-        <hello xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-            <capabilities>
-                {% for capability in capabilities %}
-                <capability>{{ capability }}</capability>
-                {% endfor %}
-            </capabilities>
-            <session-id>{{ session_id }}</session-id>
-        </hello>
-        """
-        hello_str = str_utils.render(template=template, variables=variables)
+        hello_str = render_hello_message(
+            session_id=session_id, capabilities=capabilities
+        )
         hello = xml_utils.from_string(hello_str)
         return hello
 
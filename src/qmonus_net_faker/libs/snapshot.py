@@ -0,0 +1,219 @@
+import logging
+import typing
+import io
+import os
+import asyncio
+import gzip
+import zlib
+import struct
+import pickle
+import pathlib
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+
+_RECORD_HEADER = struct.Struct(">I")
+
+
+class _Unpickler(pickle.Unpickler):
+    # Snapshots hold plain values only (dict, list, tuple, str, bytes, numbers),
+    # so no class is ever imported while loading one
+    def find_class(self, module: str, name: str) -> typing.Any:
+        raise pickle.UnpicklingError(f"Unexpected object '{module}.{name}'")
+
+
+def _loads(data: bytes) -> typing.Any:
+    return _Unpickler(io.BytesIO(data)).load()
+
+
+def dumps(value: typing.Any) -> bytes:
+    # Compact form of plain values, e.g. the state of one stub
+    return zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+
+def loads(data: bytes) -> typing.Any:
+    return _loads(zlib.decompress(data))
+
+
+def dump(
+    path: pathlib.Path,
+    records: typing.Iterable[dict[str, typing.Any]],
+    generation: int = 0,
+    extra: typing.Optional[dict[str, typing.Any]] = None,
+) -> None:
+    # Written to a temporary file and renamed, so a crash never leaves a torn snapshot.
+    # 'generation' is the first journal generation not contained in the snapshot,
+    # 'extra' holds plain values besides the records. Records are pickled one by one
+    # after a header, so they need not be in memory at once
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with gzip.open(tmp_path, "wb", compresslevel=1) as f:
+        header = {
+            "version": FORMAT_VERSION,
+            "generation": generation,
+            "extra": {} if extra is None else extra,
+        }
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for record in records:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load(
+    path: pathlib.Path,
+) -> tuple[list[dict[str, typing.Any]], int, dict[str, typing.Any]]:
+    with gzip.open(path, "rb") as f:
+        header = _Unpickler(f).load()
+        if not isinstance(header, dict) or header.get("version") not in (
+            1,
+            FORMAT_VERSION,
+        ):
+            raise ValueError(f"Unsupported snapshot format: '{path}'")
+        generation: int = header["generation"]
+        extra: dict[str, typing.Any] = header.get("extra", {})
+        if header["version"] == 1:
+            # The records are in the header
+            records: list[dict[str, typing.Any]] = header["records"]
+            return records, generation, extra
+
+        records = []
+        while True:
+            try:
+                records.append(_Unpickler(f).load())
+            except EOFError:
+                break
+    return records, generation, extra
+
+
+class Journal(object):
+    # Append-only log of (key, operation) records next to a snapshot file.
+    # Each checkpoint rotates to a new generation file; files older than the
+    # generation stored in the snapshot are contained in it and deleted.
+    # Records are dropped while the journal is closed (e.g. during restore).
+    # Records appended in one tick of the event loop are written and fsynced together
+    # in a thread (group commit); sync() waits until they are on disk
+    def __init__(self, path: pathlib.Path) -> None:
+        self._path = path
+        self._generation = 0
+        self._file: typing.Optional[typing.BinaryIO] = None
+        self._size = 0
+        # Chunks of the batch being collected and the task writing it
+        self._batch: typing.Optional[tuple[list[bytes], asyncio.Task[None]]] = None
+        self._last_write: typing.Optional[asyncio.Task[None]] = None
+        self._write_lock = asyncio.Lock()
+        # Files with batches not written yet; closed after the last one
+        self._file_writes: dict[typing.BinaryIO, int] = {}
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    @property
+    def size(self) -> int:
+        # Bytes appended to the current generation
+        return self._size
+
+    def get_path(self, generation: int) -> pathlib.Path:
+        return self._path.with_name(f"{self._path.name}.journal.{generation}")
+
+    def list_generations(self) -> list[int]:
+        prefix = f"{self._path.name}.journal."
+        generations = []
+        for p in self._path.parent.glob(f"{prefix}*"):
+            suffix = p.name[len(prefix) :]
+            if suffix.isdigit():
+                generations.append(int(suffix))
+        return sorted(generations)
+
+    def open(self, generation: int) -> None:
+        self.close()
+        self._generation = generation
+        self._file = open(self.get_path(generation), "ab")
+        self._size = self._file.tell()
+
+    def close(self) -> None:
+        # A batch being collected is still written to the closed generation
+        self._batch = None
+        if self._file is not None:
+            if not self._file_writes.get(self._file):
+                self._file.close()
+            self._file = None
+
+    def rotate(self) -> int:
+        # Starts the next generation and returns it; the caller checkpoints the
+        # state as of now before deleting the older generations
+        self.open(self._generation + 1)
+        return self._generation
+
+    def append(self, records: list[tuple[str, tuple[typing.Any, ...]]]) -> None:
+        # Called on the event loop in the order of the operations; see sync()
+        if self._file is None or not records:
+            return
+        chunks = []
+        for record in records:
+            data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+            chunks.append(_RECORD_HEADER.pack(len(data)))
+            chunks.append(data)
+        if self._batch is None:
+            batch: list[bytes] = []
+            self._file_writes[self._file] = self._file_writes.get(self._file, 0) + 1
+            task = asyncio.ensure_future(self._write(self._file, batch))
+            self._batch = (batch, task)
+            self._last_write = task
+        self._batch[0].extend(chunks)
+        self._size += sum(len(c) for c in chunks)
+
+    async def sync(self) -> None:
+        # Returns once the records appended so far are on disk
+        if self._last_write is not None:
+            await asyncio.shield(self._last_write)
+
+    async def _write(self, file: typing.BinaryIO, batch: list[bytes]) -> None:
+        # Records appended until the next tick join the batch
+        await asyncio.sleep(0)
+        if self._batch is not None and self._batch[0] is batch:
+            self._batch = None
+        try:
+            # Batches are written one at a time, in order
+            async with self._write_lock:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, _write_and_sync, file, b"".join(batch)
+                )
+        finally:
+            self._file_writes[file] -= 1
+            if not self._file_writes[file]:
+                del self._file_writes[file]
+                if file is not self._file:
+                    file.close()
+
+    def read(self, generation: int) -> list[tuple[str, tuple[typing.Any, ...]]]:
+        path = self.get_path(generation)
+        data = path.read_bytes()
+        records = []
+        offset = 0
+        while offset < len(data):
+            end = offset + _RECORD_HEADER.size
+            if end > len(data):
+                break
+            (length,) = _RECORD_HEADER.unpack_from(data, offset)
+            if end + length > len(data):
+                break
+            records.append(_loads(data[end : end + length]))
+            offset = end + length
+        if offset < len(data):
+            # The last record was torn by a crash while being written
+            logger.warning(f"Ignored a torn record at the end of '{path}'")
+        return records
+
+    def remove_before(self, generation: int) -> None:
+        for g in self.list_generations():
+            if g < generation:
+                self.get_path(g).unlink(missing_ok=True)
+
+
+def _write_and_sync(file: typing.BinaryIO, data: bytes) -> None:
+    file.write(data)
+    file.flush()
+    os.fsync(file.fileno())
@@ -1,9 +1,13 @@
 import typing
 import uuid
 import re
+import collections
+import threading
 
 import jinja2
 
+TEMPLATE_CACHE_SIZE: typing.Final = 256
+
 
 def generate_uuid() -> str:
     return uuid.uuid4().hex
@@ -21,13 +25,116 @@ def split_string(string: str, size: int) -> list[str]:
     return results
 
 
+class Environment(jinja2.Environment):
+    # Templates compiled by from_string() are kept in a bounded LRU keyed by source
+    def __init__(
+        self, template_cache_size: int = TEMPLATE_CACHE_SIZE, **kwargs: typing.Any
+    ) -> None:
+        super().__init__(**kwargs)
+        self._template_cache_size = template_cache_size
+        self._template_cache: collections.OrderedDict[str, jinja2.Template] = (
+            collections.OrderedDict()
+        )
+        self._template_cache_lock = threading.Lock()
+
+    def from_string(
+        self,
+        source: typing.Any,
+        globals: typing.Optional[typing.MutableMapping[str, typing.Any]] = None,
+        template_class: typing.Optional[type[jinja2.Template]] = None,
+    ) -> jinja2.Template:
+        if not isinstance(source, str) or globals or template_class is not None:
+            return super().from_string(source, globals, template_class)
+
+        with self._template_cache_lock:
+            template = self._template_cache.get(source)
+            if template is not None:
+                self._template_cache.move_to_end(source)
+                return template
+
+        template = super().from_string(source)
+        with self._template_cache_lock:
+            self._template_cache[source] = template
+            while len(self._template_cache) > self._template_cache_size:
+                self._template_cache.popitem(last=False)
+        return template
+
+
+_environment = Environment(
+    loader=jinja2.BaseLoader(),
+    undefined=jinja2.StrictUndefined,
+    autoescape=False,
+    trim_blocks=True,
+    lstrip_blocks=False,
+)
+
+
+def get_environment() -> Environment:
+    # Shared by the whole process; plugins get it as ctx.template_env
+    return _environment
+
+
 def render(template: str, variables: typing.Any) -> str:
-    env = jinja2.Environment(
-        loader=jinja2.BaseLoader(),
-        undefined=jinja2.StrictUndefined,
-        autoescape=False,
-        trim_blocks=True,
-        lstrip_blocks=False,
-    )
-
-    return env.from_string(template).render(variables)
+    return _environment.from_string(template).render(variables)
+
+
+_RANGE_PATTERN = re.compile(r"{(\d+)\.\.(\d+)}")
+
+
+def has_range(string: str) -> bool:
+    return _RANGE_PATTERN.search(string) is not None
+
+
+def validate_range(string: str) -> None:
+    # Raises ValueError if expand_range() would, without expanding
+    for m in _RANGE_PATTERN.finditer(string):
+        if int(m.group(1)) > int(m.group(2)):
+            raise ValueError(f"Invalid range: '{m.group(0)}'")
+
+
+def iter_range(string: str) -> typing.Iterator[str]:
+    # Lazy form of expand_range()
+    m = _RANGE_PATTERN.search(string)
+    if m is None:
+        yield string
+        return
+
+    start, end = int(m.group(1)), int(m.group(2))
+    if start > end:
+        raise ValueError(f"Invalid range: '{m.group(0)}'")
+
+    width = len(m.group(1)) if m.group(1).startswith("0") else 0
+    for i in range(start, end + 1):
+        prefix = string[: m.start()] + str(i).zfill(width)
+        for s in iter_range(string[m.end() :]):
+            yield prefix + s
+
+
+def expand_range(string: str) -> list[str]:
+    # 'edge-{08..10}' -> ['edge-08', 'edge-09', 'edge-10']
+    return list(iter_range(string))
+
+
+def match_range(pattern: str, string: str) -> bool:
+    # True if 'string' is one of expand_range(pattern), without expanding it
+    m = _RANGE_PATTERN.search(pattern)
+    if m is None:
+        return pattern == string
+
+    prefix = pattern[: m.start()]
+    if not string.startswith(prefix):
+        return False
+
+    start, end = int(m.group(1)), int(m.group(2))
+    width = len(m.group(1)) if m.group(1).startswith("0") else 0
+    rest = string[len(prefix) :]
+    digits = len(rest) - len(rest.lstrip("0123456789"))
+    for n in range(1, digits + 1):
+        number = rest[:n]
+        if (
+            start <= int(number) <= end
+            and str(int(number)).zfill(width) == number
+            and match_range(pattern[m.end() :], rest[n:])
+        ):
+            return True
+    return False
@@ -1,15 +1,21 @@
 import logging
+import typing
 import pathlib
 import sys
+import ipaddress
 
+from . import constants
 from .interface import (
     manager_interface,
     http_stub_interface,
     ssh_stub_interface,
     telnet_stub_interface,
     snmp_stub_interface,
+    manager_client,
+    router_interface,
 )
 from .application import manager_application
+from .libs import snapshot
 from .infrastructure import (
     file_infrastructure,
     stub_infrastructure,
@@ -23,6 +29,23 @@ async def create_manager(
     host: str,
     port: int,
     project_path: str,
+    unix_socket_path: typing.Optional[str] = None,
+    shard_index: int = 0,
+    shard_count: int = 1,
+    hot_reload: typing.Literal[
+        "auto", "inotify", "poll", "off"
+    ] = constants.DEFAULT_HOT_RELOAD,
+    hot_reload_interval: float = constants.DEFAULT_HOT_RELOAD_INTERVAL,
+    executor_threads: int = constants.DEFAULT_EXECUTOR_THREADS,
+    max_inflight: int = constants.DEFAULT_MAX_INFLIGHT,
+    max_inflight_per_stub: int = constants.DEFAULT_MAX_INFLIGHT_PER_STUB,
+    max_queue: int = constants.DEFAULT_MAX_QUEUE,
+    queue_timeout: float = constants.DEFAULT_QUEUE_TIMEOUT,
+    snapshot_path: typing.Optional[str] = None,
+    snapshot_interval: float = constants.DEFAULT_SNAPSHOT_INTERVAL,
+    config_idle_timeout: float = constants.DEFAULT_CONFIG_IDLE_TIMEOUT,
+    memory_budget: int = constants.DEFAULT_MEMORY_BUDGET,
+    spill_path: typing.Optional[str] = None,
 ) -> manager_interface.Server:
     # Setup project directory
     _project_path = pathlib.Path(project_path).resolve()
@@ -33,7 +56,21 @@ async def create_manager(
 
     # Setup repositories
     file_repo = file_infrastructure.Repository(dir_path=_project_path)
-    stub_repo = stub_infrastructure.Repository()
+    # Each shard keeps the snapshot and journal of its own stubs
+    _snapshot_path: typing.Optional[pathlib.Path] = None
+    journal: typing.Optional[snapshot.Journal] = None
+    if snapshot_path is not None:
+        _snapshot_path = pathlib.Path(snapshot_path).resolve()
+        if shard_count > 1:
+            _snapshot_path = _snapshot_path.with_name(
+                f"{_snapshot_path.name}.{shard_index}"
+            )
+        journal = snapshot.Journal(path=_snapshot_path)
+    stub_repo = stub_infrastructure.Repository(
+        journal=journal,
+        memory_budget=memory_budget,
+        spill_path=None if spill_path is None else pathlib.Path(spill_path).resolve(),
+    )
     yang_tree_repo = yang_tree_infrastructure.Repository()
 
     # Setup applications
@@ -42,77 +79,295 @@ async def create_manager(
         stub_repo=stub_repo,
         yang_tree_repo=yang_tree_repo,
         project_path=_project_path,
+        shard_index=shard_index,
+        shard_count=shard_count,
+        hot_reload=hot_reload,
+        hot_reload_interval=hot_reload_interval,
+        executor_threads=executor_threads,
+        max_inflight=max_inflight,
+        max_inflight_per_stub=max_inflight_per_stub,
+        max_queue=max_queue,
+        queue_timeout=queue_timeout,
+        snapshot_path=_snapshot_path,
+        snapshot_interval=snapshot_interval,
+        journal=journal,
+        config_idle_timeout=config_idle_timeout,
     )
     await manager_app.reload_stubs()
     await manager_app.reload_yangs()
+    await manager_app.restore_snapshot()
 
     # Setup interface
     _server = manager_interface.Server(
         host=host,
         port=port,
         manager_app=manager_app,
+        unix_socket_path=unix_socket_path,
     )
 
     return _server
 
 
+def create_router(
+    host: str,
+    port: int,
+    manager_endpoints: list[str],
+    unix_socket_path: typing.Optional[str] = None,
+    shard_endpoints: typing.Optional[list[list[str]]] = None,
+) -> router_interface.Server:
+    _server = router_interface.Server(
+        host=host,
+        port=port,
+        manager_endpoints=manager_endpoints,
+        unix_socket_path=unix_socket_path,
+        shard_endpoints=shard_endpoints,
+    )
+    return _server
+
+
 async def create_http_stub(
-    host: str, port: int, stub_id: str, manager_endpoint: str
+    host: str,
+    port: int,
+    stub_id: typing.Union[str, dict[str, str]],
+    manager_endpoint: str,
+    manager_pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+    manager_keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+    manager_timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+    manager_transport: typing.Literal[
+        "http", "websocket"
+    ] = constants.DEFAULT_MANAGER_TRANSPORT,
+    client: typing.Optional[manager_client.BaseClient] = None,
 ) -> http_stub_interface.Server:
     _server = http_stub_interface.Server(
         host=host,
         port=port,
         stub_id=stub_id,
         manager_endpoint=manager_endpoint,
+        manager_pool_size=manager_pool_size,
+        manager_keepalive_timeout=manager_keepalive_timeout,
+        manager_timeout=manager_timeout,
+        manager_transport=manager_transport,
+        client=client,
         ssl=False,
     )
     return _server
 
 
 async def create_https_stub(
-    host: str, port: int, stub_id: str, manager_endpoint: str
+    host: str,
+    port: int,
+    stub_id: typing.Union[str, dict[str, str]],
+    manager_endpoint: str,
+    manager_pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+    manager_keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+    manager_timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+    manager_transport: typing.Literal[
+        "http", "websocket"
+    ] = constants.DEFAULT_MANAGER_TRANSPORT,
+    client: typing.Optional[manager_client.BaseClient] = None,
 ) -> http_stub_interface.Server:
     _server = http_stub_interface.Server(
         host=host,
         port=port,
         stub_id=stub_id,
         manager_endpoint=manager_endpoint,
+        manager_pool_size=manager_pool_size,
+        manager_keepalive_timeout=manager_keepalive_timeout,
+        manager_timeout=manager_timeout,
+        manager_transport=manager_transport,
+        client=client,
         ssl=True,
     )
     return _server
 
 
 async def create_ssh_stub(
-    host: str, port: int, stub_id: str, manager_endpoint: str
+    host: str,
+    port: int,
+    stub_id: typing.Union[str, dict[str, str]],
+    manager_endpoint: str,
+    manager_pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+    manager_keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+    manager_timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+    manager_transport: typing.Literal[
+        "http", "websocket"
+    ] = constants.DEFAULT_MANAGER_TRANSPORT,
+    client: typing.Optional[manager_client.BaseClient] = None,
 ) -> ssh_stub_interface.Server:
     _server = ssh_stub_interface.Server(
         host=host,
         port=port,
         stub_id=stub_id,
         manager_endpoint=manager_endpoint,
+        manager_pool_size=manager_pool_size,
+        manager_keepalive_timeout=manager_keepalive_timeout,
+        manager_timeout=manager_timeout,
+        manager_transport=manager_transport,
+        client=client,
     )
     return _server
 
 
 async def create_telnet_stub(
-    host: str, port: int, stub_id: str, manager_endpoint: str
+    host: str,
+    port: int,
+    stub_id: typing.Union[str, dict[str, str]],
+    manager_endpoint: str,
+    manager_pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+    manager_keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+    manager_timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+    manager_transport: typing.Literal[
+        "http", "websocket"
+    ] = constants.DEFAULT_MANAGER_TRANSPORT,
+    client: typing.Optional[manager_client.BaseClient] = None,
 ) -> telnet_stub_interface.Server:
     _server = telnet_stub_interface.Server(
         host=host,
         port=port,
         stub_id=stub_id,
         manager_endpoint=manager_endpoint,
+        manager_pool_size=manager_pool_size,
+        manager_keepalive_timeout=manager_keepalive_timeout,
+        manager_timeout=manager_timeout,
+        manager_transport=manager_transport,
+        client=client,
     )
     return _server
 
 
 async def create_snmp_stub(
-    host: str, port: int, stub_id: str, manager_endpoint: str
+    host: str,
+    port: int,
+    stub_id: typing.Union[str, dict[str, str]],
+    manager_endpoint: str,
+    manager_pool_size: int = constants.DEFAULT_MANAGER_POOL_SIZE,
+    manager_keepalive_timeout: float = constants.DEFAULT_MANAGER_KEEPALIVE_TIMEOUT,
+    manager_timeout: int = constants.DEFAULT_MANAGER_TIMEOUT,
+    manager_transport: typing.Literal[
+        "http", "websocket"
+    ] = constants.DEFAULT_MANAGER_TRANSPORT,
+    client: typing.Optional[manager_client.BaseClient] = None,
 ) -> snmp_stub_interface.Server:
     _server = snmp_stub_interface.Server(
         host=host,
         port=port,
         stub_id=stub_id,
         manager_endpoint=manager_endpoint,
+        manager_pool_size=manager_pool_size,
+        manager_keepalive_timeout=manager_keepalive_timeout,
+        manager_timeout=manager_timeout,
+        manager_transport=manager_transport,
+        client=client,
     )
     return _server
+
+
+async def create_stubs(
+    stub_ids: list[str],
+    manager_endpoint: str,
+    host: str,
+    http_port: int,
+    https_port: int,
+    ssh_port: int,
+    telnet_port: int,
+    snmp_port: int,
+    protocols: list[typing.Literal["ssh", "http", "https", "telnet", "snmp"]],
+    allocation: typing.Literal["ip-alias", "port"],
+    first_address: str,
+    client: manager_client.BaseClient,
+) -> list[
+    typing.Union[
+        ssh_stub_interface.Server,
+        http_stub_interface.Server,
+        telnet_stub_interface.Server,
+        snmp_stub_interface.Server,
+    ]
+]:
+    ports = {
+        "ssh": ssh_port,
+        "http": http_port,
+        "https": https_port,
+        "telnet": telnet_port,
+        "snmp": snmp_port,
+    }
+
+    # Setup which stub-id is served on which address and port
+    assignments: list[tuple[int, typing.Union[str, dict[str, str]]]]
+    if allocation == "ip-alias":
+        # One listener per protocol; the local address a client connected to selects the stub
+        start = ipaddress.ip_address(first_address)
+        stub_id_map = {str(start + i): stub_id for i, stub_id in enumerate(stub_ids)}
+        assignments = [(0, stub_id_map)]
+    elif allocation == "port":
+        # One listener per stub and protocol on consecutive ports
+        selected = sorted((ports[protocol], protocol) for protocol in set(protocols))
+        for (port, protocol), (next_port, next_protocol) in zip(selected, selected[1:]):
+            if port + len(stub_ids) > next_port:
+                raise ValueError(
+                    f"Port range of {protocol} ({port}-{port + len(stub_ids) - 1}) "
+                    f"overlaps with {next_protocol} ({next_port})"
+                )
+        assignments = [(i, stub_id) for i, stub_id in enumerate(stub_ids)]
+    else:
+        raise ValueError(f"Invalid allocation: '{allocation}'")
+
+    stubs: list[
+        typing.Union[
+            ssh_stub_interface.Server,
+            http_stub_interface.Server,
+            telnet_stub_interface.Server,
+            snmp_stub_interface.Server,
+        ]
+    ] = []
+    for offset, stub_id in assignments:
+        if "ssh" in protocols:
+            stubs.append(
+                await create_ssh_stub(
+                    host=host,
+                    port=ssh_port + offset,
+                    stub_id=stub_id,
+                    manager_endpoint=manager_endpoint,
+                    client=client,
+                )
+            )
+        if "http" in protocols:
+            stubs.append(
+                await create_http_stub(
+                    host=host,
+                    port=http_port + offset,
+                    stub_id=stub_id,
+                    manager_endpoint=manager_endpoint,
+                    client=client,
+                )
+            )
+        if "https" in protocols:
+            stubs.append(
+                await create_https_stub(
+                    host=host,
+                    port=https_port + offset,
+                    stub_id=stub_id,
+                    manager_endpoint=manager_endpoint,
+                    client=client,
+                )
+            )
+        if "telnet" in protocols:
+            stubs.append(
+                await create_telnet_stub(
+                    host=host,
+                    port=telnet_port + offset,
+                    stub_id=stub_id,
+                    manager_endpoint=manager_endpoint,
+                    client=client,
+                )
+            )
+        if "snmp" in protocols:
+            stubs.append(
+                await create_snmp_stub(
+                    host=host,
+                    port=snmp_port + offset,
+                    stub_id=stub_id,
+                    manager_endpoint=manager_endpoint,
+                    client=client,
+                )
+            )
+    return stubs
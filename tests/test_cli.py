@@ -10,6 +10,7 @@ import pytest
 import aiohttp
 import pysnmp.hlapi
 from qmonus_net_faker import __main__
+from qmonus_net_faker.interface import manager_client
 
 from . import http_client
 
@@ -119,6 +120,95 @@ async def test_runs_manager(
             await process.wait()
 
 
+@pytest.mark.asyncio
+async def test_runs_manager_with_workers(
+    project_path: pathlib.Path,
+    tmp_path: pathlib.Path,
+    http_client: http_client.HttpClient,
+):
+    process = None
+    client = None
+    try:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-u",
+            "-m",
+            "qmonus_net_faker",
+            "run",
+            "manager",
+            str(project_path),
+            "--host",
+            "127.0.0.1",
+            "--port",
+            "10090",
+            "--workers",
+            "2",
+            "--log-file-path",
+            str(tmp_path.joinpath("manager.log")),
+        )
+
+        expired_at = datetime.datetime.now() + datetime.timedelta(seconds=MAX_WAIT_TIME)
+        while True:
+            try:
+                # Stubs of all workers are merged
+                resp = await http_client.request(
+                    method="GET", url="http://127.0.0.1:10090/stubs", timeout=3
+                )
+                assert resp.status == 200
+                assert len(resp.json["stubs"]) == 3
+            except Exception:
+                if expired_at <= datetime.datetime.now():
+                    raise
+                await asyncio.sleep(1)
+                continue
+            break
+
+        stub_ids = [stub["id"] for stub in resp.json["stubs"]]
+        for stub_id in stub_ids:
+            resp = await http_client.request(
+                method="GET", url=f"http://127.0.0.1:10090/stubs/{stub_id}"
+            )
+            assert resp.status == 200
+
+        # Clients send requests straight to the workers
+        resp = await http_client.request(
+            method="GET", url="http://127.0.0.1:10090/shards"
+        )
+        assert resp.status == 200
+        assert [shard[1] for shard in resp.json["shards"]] == [
+            "http://127.0.0.1:10091",
+            "http://127.0.0.1:10092",
+        ]
+        client = manager_client.create_client(manager_endpoint="http://127.0.0.1:10090")
+        await client.start()
+        assert client._sharded_client is not None
+        for stub_id in stub_ids:
+            reply = await client.handle(
+                stub_id=stub_id,
+                body={
+                    "id": stub_id,
+                    "protocol": "http",
+                    "method": "GET",
+                    "path": "/",
+                    "query": {},
+                    "headers": {},
+                    "body": "",
+                },
+                payload_field="body",
+            )
+            assert reply.framed is True
+
+        # Each worker logs to its own file
+        for i in range(2):
+            assert tmp_path.joinpath(f"manager.worker-{i}.log").exists()
+    finally:
+        if client:
+            await client.stop()
+        if process:
+            process.terminate()
+            await process.wait()
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "options",
@@ -74,6 +74,7 @@ def test_exits_with_error_when_invalid_args_are_passed_for_run_command():
                 "project_path": ".",
                 "host": "0.0.0.0",
                 "port": 10080,
+                "unix_socket_path": None,
             },
         },
         {
@@ -93,6 +94,8 @@ def test_exits_with_error_when_invalid_args_are_passed_for_run_command():
                 "127.0.0.1",
                 "--port",
                 "80",
+                "--unix-socket-path",
+                "/tmp/manager.sock",
             ],
             "expected": {
                 "log_level": "debug",
@@ -102,6 +105,7 @@ def test_exits_with_error_when_invalid_args_are_passed_for_run_command():
                 "project_path": "project_path",
                 "host": "127.0.0.1",
                 "port": 80,
+                "unix_socket_path": "/tmp/manager.sock",
             },
         },
     ],
@@ -117,6 +121,7 @@ def test_returns_parsed_args_when_valid_args_are_passed_for_run_manager_command(
     assert args.project_path == case["expected"]["project_path"]
     assert args.host == case["expected"]["host"]
     assert args.port == case["expected"]["port"]
+    assert args.unix_socket_path == case["expected"]["unix_socket_path"]
 
 
 def test_exits_with_error_when_invalid_args_are_passed_for_run_manager_command():
@@ -144,6 +149,10 @@ def test_exits_with_error_when_invalid_args_are_passed_for_run_manager_command()
                 "telnet_port": 20023,
                 "snmp_port": 20161,
                 "protocols": ["ssh", "http", "https", "telnet", "snmp"],
+                "manager_pool_size": 100,
+                "manager_keepalive_timeout": 60.0,
+                "manager_timeout": 300,
+                "manager_transport": "http",
             },
         },
         {
@@ -175,6 +184,14 @@ def test_exits_with_error_when_invalid_args_are_passed_for_run_manager_command()
                 "--protocol",
                 "ssh",
                 "http",
+                "--manager-pool-size",
+                "10",
+                "--manager-keepalive-timeout",
+                "5",
+                "--manager-timeout",
+                "30",
+                "--manager-transport",
+                "websocket",
             ],
             "expected": {
                 "log_level": "debug",
@@ -190,6 +207,10 @@ def test_exits_with_error_when_invalid_args_are_passed_for_run_manager_command()
                 "telnet_port": 23,
                 "snmp_port": 161,
                 "protocols": ["ssh", "http"],
+                "manager_pool_size": 10,
+                "manager_keepalive_timeout": 5.0,
+                "manager_timeout": 30,
+                "manager_transport": "websocket",
             },
         },
     ],
@@ -211,6 +232,12 @@ def test_returns_parsed_args_when_valid_args_are_passed_for_run_stub_command(
     assert args.telnet_port == case["expected"]["telnet_port"]
     assert args.snmp_port == case["expected"]["snmp_port"]
     assert args.protocols == case["expected"]["protocols"]
+    assert args.manager_pool_size == case["expected"]["manager_pool_size"]
+    assert (
+        args.manager_keepalive_timeout == case["expected"]["manager_keepalive_timeout"]
+    )
+    assert args.manager_timeout == case["expected"]["manager_timeout"]
+    assert args.manager_transport == case["expected"]["manager_transport"]
 
 
 @pytest.mark.parametrize(
@@ -224,3 +251,307 @@ def test_exits_with_error_when_invalid_args_are_passed_for_run_stub_command(case
     with pytest.raises(SystemExit) as e:
         __main__.parse_args(args=case["args"])
     assert e.value.code != 0
+
+
+@pytest.mark.parametrize(
+    "case",
+    [
+        {
+            "args": ["run", "stubs", "netfaker-stub-0", "http://127.0.0.1:10080"],
+            "expected": {
+                "stub_ids": ["netfaker-stub-0"],
+                "manager_endpoint": "http://127.0.0.1:10080",
+                "allocation": "ip-alias",
+                "first_address": "127.0.0.1",
+                "host": "0.0.0.0",
+                "http_port": 20080,
+                "protocols": ["ssh", "http", "https", "telnet", "snmp"],
+            },
+        },
+        {
+            "args": [
+                "run",
+                "stubs",
+                "edge-{08..10},core-1",
+                "unix:///tmp/manager.sock",
+                "--allocation",
+                "port",
+                "--first-address",
+                "10.0.0.1",
+                "--host",
+                "127.0.0.1",
+                "--http-port",
+                "30080",
+                "--protocol",
+                "http",
+            ],
+            "expected": {
+                "stub_ids": ["edge-08", "edge-09", "edge-10", "core-1"],
+                "manager_endpoint": "unix:///tmp/manager.sock",
+                "allocation": "port",
+                "first_address": "10.0.0.1",
+                "host": "127.0.0.1",
+                "http_port": 30080,
+                "protocols": ["http"],
+            },
+        },
+    ],
+)
+def test_returns_parsed_args_when_valid_args_are_passed_for_run_stubs_command(
+    case: dict,
+):
+    args = __main__.parse_args(args=case["args"])
+    assert args.stub_ids == case["expected"]["stub_ids"]
+    assert args.manager_endpoint == case["expected"]["manager_endpoint"]
+    assert args.allocation == case["expected"]["allocation"]
+    assert args.first_address == case["expected"]["first_address"]
+    assert args.host == case["expected"]["host"]
+    assert args.http_port == case["expected"]["http_port"]
+    assert args.protocols == case["expected"]["protocols"]
+
+
+@pytest.mark.parametrize(
+    "case",
+    [
+        {"args": ["run", "stubs", "netfaker-stub-0"]},
+        {"args": ["run", "stubs", "edge-{10..08}", "http://127.0.0.1:10080"]},
+    ],
+)
+def test_exits_with_error_when_invalid_args_are_passed_for_run_stubs_command(
+    case: dict,
+):
+    with pytest.raises(SystemExit) as e:
+        __main__.parse_args(args=case["args"])
+    assert e.value.code != 0
+
+
+@pytest.mark.parametrize(
+    "case",
+    [
+        {
+            "args": ["run", "embedded", "."],
+            "expected": {
+                "project_path": ".",
+                "stub_ids": None,
+                "manager_host": "0.0.0.0",
+                "manager_port": 10080,
+                "allocation": "ip-alias",
+            },
+        },
+        {
+            "args": [
+                "run",
+                "embedded",
+                "project_path",
+                "edge-{1..2}",
+                "--manager-host",
+                "127.0.0.1",
+                "--manager-port",
+                "80",
+                "--allocation",
+                "port",
+            ],
+            "expected": {
+                "project_path": "project_path",
+                "stub_ids": ["edge-1", "edge-2"],
+                "manager_host": "127.0.0.1",
+                "manager_port": 80,
+                "allocation": "port",
+            },
+        },
+    ],
+)
+def test_returns_parsed_args_when_valid_args_are_passed_for_run_embedded_command(
+    case: dict,
+):
+    args = __main__.parse_args(args=case["args"])
+    assert args.project_path == case["expected"]["project_path"]
+    assert args.stub_ids == case["expected"]["stub_ids"]
+    assert args.manager_host == case["expected"]["manager_host"]
+    assert args.manager_port == case["expected"]["manager_port"]
+    assert args.allocation == case["expected"]["allocation"]
+
+
+@pytest.mark.parametrize(
+    "case",
+    [
+        {
+            "args": ["run", "manager", ".", "--shard-index", "1", "--shard-count", "4"],
+            "expected": {"shard_index": 1, "shard_count": 4, "workers": 1},
+        },
+        {
+            "args": ["run", "manager", ".", "--workers", "8"],
+            "expected": {"shard_index": 0, "shard_count": 1, "workers": 8},
+        },
+    ],
+)
+def test_returns_parsed_args_when_shard_options_are_passed_for_run_manager_command(
+    case: dict,
+):
+    args = __main__.parse_args(args=case["args"])
+    assert args.shard_index == case["expected"]["shard_index"]
+    assert args.shard_count == case["expected"]["shard_count"]
+    assert args.workers == case["expected"]["workers"]
+
+
+@pytest.mark.parametrize(
+    "case",
+    [
+        {
+            "args": ["run", "manager", "."],
+            "expected": {
+                "max_inflight": 0,
+                "max_inflight_per_stub": 0,
+                "max_queue": 0,
+                "queue_timeout": 10.0,
+            },
+        },
+        {
+            "args": [
+                "run",
+                "embedded",
+                ".",
+                "--max-inflight",
+                "200",
+                "--max-inflight-per-stub",
+                "1",
+                "--max-queue",
+                "1000",
+                "--queue-timeout",
+                "5",
+            ],
+            "expected": {
+                "max_inflight": 200,
+                "max_inflight_per_stub": 1,
+                "max_queue": 1000,
+                "queue_timeout": 5.0,
+            },
+        },
+    ],
+)
+def test_returns_parsed_args_when_admission_options_are_passed(case: dict):
+    args = __main__.parse_args(args=case["args"])
+    assert args.max_inflight == case["expected"]["max_inflight"]
+    assert args.max_inflight_per_stub == case["expected"]["max_inflight_per_stub"]
+    assert args.max_queue == case["expected"]["max_queue"]
+    assert args.queue_timeout == case["expected"]["queue_timeout"]
+
+
+@pytest.mark.parametrize(
+    "case",
+    [
+        {
+            "args": ["run", "manager", "."],
+            "expected": {"snapshot_path": None, "snapshot_interval": 60.0},
+        },
+        {
+            "args": [
+                "run",
+                "embedded",
+                ".",
+                "--snapshot-path",
+                "/var/lib/netfaker/stubs.snapshot",
+                "--snapshot-interval",
+                "10",
+            ],
+            "expected": {
+                "snapshot_path": "/var/lib/netfaker/stubs.snapshot",
+                "snapshot_interval": 10.0,
+            },
+        },
+    ],
+)
+def test_returns_parsed_args_when_snapshot_options_are_passed(case: dict):
+    args = __main__.parse_args(args=case["args"])
+    assert args.snapshot_path == case["expected"]["snapshot_path"]
+    assert args.snapshot_interval == case["expected"]["snapshot_interval"]
+
+
+@pytest.mark.parametrize(
+    "case",
+    [
+        {"args": ["run", "manager", "."], "expected": 0.0},
+        {
+            "args": ["run", "embedded", ".", "--config-idle-timeout", "300"],
+            "expected": 300.0,
+        },
+    ],
+)
+def test_returns_parsed_args_when_config_idle_timeout_is_passed(case: dict):
+    args = __main__.parse_args(args=case["args"])
+    assert args.config_idle_timeout == case["expected"]
+
+
+@pytest.mark.parametrize(
+    "case",
+    [
+        {
+            "args": ["run", "manager", "."],
+            "expected": {"memory_budget": 0, "spill_path": None},
+        },
+        {
+            "args": [
+                "run",
+                "manager",
+                ".",
+                "--memory-budget",
+                "1073741824",
+                "--spill-path",
+                "/var/tmp/netfaker",
+            ],
+            "expected": {
+                "memory_budget": 1073741824,
+                "spill_path": "/var/tmp/netfaker",
+            },
+        },
+    ],
+)
+def test_returns_parsed_args_when_memory_budget_options_are_passed(case: dict):
+    args = __main__.parse_args(args=case["args"])
+    assert args.memory_budget == case["expected"]["memory_budget"]
+    assert args.spill_path == case["expected"]["spill_path"]
+
+
+@pytest.mark.parametrize(
+    "case",
+    [
+        {
+            "args": [
+                "run",
+                "router",
+                "http://127.0.0.1:10081,http://127.0.0.1:10082",
+            ],
+            "expected": {
+                "manager_endpoints": [
+                    "http://127.0.0.1:10081",
+                    "http://127.0.0.1:10082",
+                ],
+                "host": "0.0.0.0",
+                "port": 10080,
+            },
+        },
+        {
+            "args": [
+                "run",
+                "router",
+                "unix:///tmp/manager.sock",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                "80",
+            ],
+            "expected": {
+                "manager_endpoints": ["unix:///tmp/manager.sock"],
+                "host": "127.0.0.1",
+                "port": 80,
+            },
+        },
+    ],
+)
+def test_returns_parsed_args_when_valid_args_are_passed_for_run_router_command(
+    case: dict,
+):
+    args = __main__.parse_args(args=case["args"])
+    assert args.manager_endpoints == case["expected"]["manager_endpoints"]
+    assert args.host == case["expected"]["host"]
+    assert args.port == case["expected"]["port"]
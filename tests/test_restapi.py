@@ -1,8 +1,11 @@
+import json
 import pathlib
 
 import pytest
 import pytest_asyncio
 from qmonus_net_faker import action, server
+from qmonus_net_faker.libs import hash_ring
+from qmonus_net_faker.interface import manager_interface, router_interface
 
 from . import http_client
 
@@ -88,6 +91,41 @@ async def test_shows_stubs(http_client: http_client.HttpClient, initial_stubs: l
     assert stubs[0] == initial_stubs[0]
 
 
+@pytest.mark.asyncio
+async def test_filters_stubs(http_client: http_client.HttpClient):
+    resp = await http_client.request(
+        method="PATCH",
+        url="http://127.0.0.1:10080/stubs/netfaker-stub-1",
+        data={"stub": {"enabled": False}},
+    )
+    assert resp.status == 200
+
+    async def _list(query: str) -> list:
+        resp = await http_client.request(
+            method="GET", url=f"http://127.0.0.1:10080/stubs?{query}"
+        )
+        assert resp.status == 200
+        return [stub["id"] for stub in resp.json["stubs"]]
+
+    # Filtered lists keep the order of the full list
+    assert await _list("id=netfaker-stub-2&id=netfaker-stub-0&id=dummy") == [
+        "netfaker-stub-0",
+        "netfaker-stub-2",
+    ]
+    assert await _list("enabled=false") == ["netfaker-stub-1"]
+    assert await _list("handler=junos&enabled=true") == [
+        "netfaker-stub-0",
+        "netfaker-stub-2",
+    ]
+    assert await _list("yang=junos&id=netfaker-stub-1") == ["netfaker-stub-1"]
+    assert await _list("handler=dummy") == []
+
+    resp = await http_client.request(
+        method="GET", url="http://127.0.0.1:10080/stubs?enabled=yes"
+    )
+    assert resp.status == 400
+
+
 @pytest.mark.asyncio
 async def test_shows_a_stub(http_client: http_client.HttpClient, initial_stubs: list):
     resp = await http_client.request(
@@ -214,6 +252,81 @@ async def test_shows_conflict_error_when_creating_a_duplicate_stub(
     assert resp.status == 409
 
 
+@pytest.mark.asyncio
+async def test_creates_stubs_in_bulk(http_client: http_client.HttpClient):
+    lines = [
+        json.dumps({"stub": {"id": "id_0", "handler": "handler_0"}}),
+        json.dumps({"stub": {"id": "id_1", "handler": "handler_1", "enabled": False}}),
+        "",
+        json.dumps({"stub": {"id": "id_0", "handler": "handler_0"}}),
+        json.dumps({"stub": {"id": "id_2"}}),
+        "{",
+    ]
+    resp = await http_client.request(
+        method="POST",
+        url="http://127.0.0.1:10080/stubs:bulk",
+        headers={"Content-Type": "application/x-ndjson"},
+        data="\n".join(lines) + "\n",
+    )
+    assert resp.status == 200
+    results = [json.loads(line) for line in resp.data.splitlines()]
+    assert [(r["line"], r["stubId"], r["code"]) for r in results] == [
+        (1, "id_0", 200),
+        (2, "id_1", 200),
+        (4, "id_0", 409),
+        (5, None, 400),
+        (6, None, 400),
+    ]
+    assert "errorMessage" not in results[0]
+    assert results[2]["errorMessage"].startswith("ConflictError: ")
+
+    resp = await http_client.request(
+        method="GET",
+        url="http://127.0.0.1:10080/stubs/id_1",
+    )
+    assert resp.status == 200
+    assert resp.json["stub"]["handler"] == "handler_1"
+    assert resp.json["stub"]["enabled"] is False
+
+
+@pytest.mark.asyncio
+async def test_rejects_oversized_lines_in_bulk(
+    http_client: http_client.HttpClient, monkeypatch: pytest.MonkeyPatch
+):
+    # Past aiohttp's own line limit too; only the long lines fail
+    monkeypatch.setattr(manager_interface, "BULK_MAX_LINE_SIZE", 1024)
+    long_line = json.dumps(
+        {"stub": {"id": "id_1", "handler": "h", "description": "x" * 200000}}
+    )
+    lines = [
+        json.dumps({"stub": {"id": "id_0", "handler": "handler_0"}}),
+        long_line,
+        json.dumps({"stub": {"id": "id_2", "handler": "handler_2"}}),
+        long_line,
+    ]
+    resp = await http_client.request(
+        method="POST",
+        url="http://127.0.0.1:10080/stubs:bulk",
+        headers={"Content-Type": "application/x-ndjson"},
+        data="\n".join(lines),
+    )
+    assert resp.status == 200
+    results = [json.loads(line) for line in resp.data.splitlines()]
+    assert [(r["line"], r["stubId"], r["code"]) for r in results] == [
+        (1, "id_0", 200),
+        (2, None, 400),
+        (3, "id_2", 200),
+        (4, None, 400),
+    ]
+    assert results[1]["errorMessage"].startswith("ValidationError: ")
+
+    resp = await http_client.request(
+        method="GET",
+        url="http://127.0.0.1:10080/stubs/id_1",
+    )
+    assert resp.status == 404
+
+
 @pytest.mark.asyncio
 async def test_updates_a_stub(http_client: http_client.HttpClient):
     # Prepare
@@ -391,3 +504,157 @@ async def test_shows_not_found_error_when_getting_a_non_existing_yang(
         url="http://127.0.0.1:10080/yangs/dummy",
     )
     assert resp.status == 404
+
+
+@pytest.mark.asyncio
+async def test_routes_requests_to_sharded_managers(
+    project_path: pathlib.Path,
+    http_client: http_client.HttpClient,
+    initial_stubs: list,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    shards = [
+        await server.create_manager(
+            host="127.0.0.1",
+            port=10081 + i,
+            project_path=str(project_path),
+            shard_index=i,
+            shard_count=2,
+        )
+        for i in range(2)
+    ]
+    router = server.create_router(
+        host="127.0.0.1",
+        port=10090,
+        manager_endpoints=["http://127.0.0.1:10081", "http://127.0.0.1:10082"],
+    )
+    ring = hash_ring.create_shard_ring(shard_count=2)
+    for shard in shards:
+        await shard.start()
+    await router.start()
+    try:
+        # Each shard only loads the stubs placed on it
+        for i in range(2):
+            resp = await http_client.request(
+                method="GET", url=f"http://127.0.0.1:{10081 + i}/stubs"
+            )
+            assert resp.status == 200
+            assert [stub["id"] for stub in resp.json["stubs"]] == [
+                stub["id"]
+                for stub in initial_stubs
+                if ring.get_node(stub["id"]) == str(i)
+            ]
+
+        # List and reload are merged across shards
+        resp = await http_client.request(
+            method="GET", url="http://127.0.0.1:10090/stubs"
+        )
+        assert resp.status == 200
+        assert sorted(resp.json["stubs"], key=lambda x: x["id"]) == initial_stubs
+
+        resp = await http_client.request(
+            method="POST", url="http://127.0.0.1:10090/stubs:reload"
+        )
+        assert resp.status == 200
+        assert sorted(resp.json["stubs"], key=lambda x: x["id"]) == initial_stubs
+
+        # Per-stub requests are forwarded to the owning shard
+        for stub in initial_stubs:
+            resp = await http_client.request(
+                method="GET", url=f"http://127.0.0.1:10090/stubs/{stub['id']}"
+            )
+            assert resp.status == 200
+            assert resp.json["stub"] == stub
+
+        resp = await http_client.request(
+            method="POST",
+            url="http://127.0.0.1:10090/stubs",
+            data={"stub": {"id": "new-stub", "handler": "junos"}},
+        )
+        assert resp.status == 200
+        owner = int(ring.get_node("new-stub"))
+        resp = await http_client.request(
+            method="GET", url=f"http://127.0.0.1:{10081 + owner}/stubs/new-stub"
+        )
+        assert resp.status == 200
+
+        resp = await http_client.request(
+            method="GET", url="http://127.0.0.1:10090/stubs/dummy"
+        )
+        assert resp.status == 404
+
+        # Bulk lines are streamed to the shards in chunks, and their results merged
+        # in line order
+        monkeypatch.setattr(router_interface, "BULK_CHUNK_LINES", 2)
+        ids = [f"bulk-{i}" for i in range(8)]
+        resp = await http_client.request(
+            method="POST",
+            url="http://127.0.0.1:10090/stubs:bulk",
+            data="\n".join(
+                [json.dumps({"stub": {"id": id, "handler": "junos"}}) for id in ids]
+                + ["{}", json.dumps({"stub": {"id": "new-stub", "handler": "junos"}})]
+            ),
+        )
+        assert resp.status == 200
+        results = [json.loads(line) for line in resp.data.splitlines()]
+        assert [(r["line"], r["stubId"], r["code"]) for r in results] == [
+            *[(i + 1, id, 200) for i, id in enumerate(ids)],
+            (9, None, 400),
+            (10, "new-stub", 409),
+        ]
+        for id in ids:
+            owner = int(ring.get_node(id))
+            resp = await http_client.request(
+                method="GET", url=f"http://127.0.0.1:{10081 + owner}/stubs/{id}"
+            )
+            assert resp.status == 200
+
+        # An oversized line is answered by the router; the others still reach a shard
+        monkeypatch.setattr(manager_interface, "BULK_MAX_LINE_SIZE", 1024)
+        resp = await http_client.request(
+            method="POST",
+            url="http://127.0.0.1:10090/stubs:bulk",
+            data="\n".join(
+                [
+                    json.dumps({"stub": {"id": "bulk-8", "handler": "x" * 200000}}),
+                    json.dumps({"stub": {"id": "bulk-9", "handler": "junos"}}),
+                ]
+            ),
+        )
+        assert resp.status == 200
+        results = [json.loads(line) for line in resp.data.splitlines()]
+        assert [(r["line"], r["stubId"], r["code"]) for r in results] == [
+            (1, None, 400),
+            (2, "bulk-9", 200),
+        ]
+
+        # Lines missing from a shard's response (cut off) still get a result
+        forward = router_interface.Server._forward
+
+        async def _forward(self, request, shard_index, body):  # type: ignore
+            response = await forward(self, request, shard_index, body)
+            if request.path == "/stubs:bulk":
+                response.content = response.content.splitlines(keepends=True)[0]
+            return response
+
+        monkeypatch.setattr(router_interface.Server, "_forward", _forward)
+        ids = ["bulk-10", "bulk-11"]
+        while ring.get_node(ids[1]) != ring.get_node(ids[0]):
+            ids[1] += "-"
+        resp = await http_client.request(
+            method="POST",
+            url="http://127.0.0.1:10090/stubs:bulk",
+            data="\n".join(
+                json.dumps({"stub": {"id": id, "handler": "junos"}}) for id in ids
+            ),
+        )
+        assert resp.status == 200
+        results = [json.loads(line) for line in resp.data.splitlines()]
+        assert [(r["line"], r["stubId"], r["code"]) for r in results] == [
+            (1, ids[0], 200),
+            (2, ids[1], 502),
+        ]
+    finally:
+        await router.stop()
+        for shard in shards:
+            await shard.stop()
@@ -1,4 +1,5 @@
 import typing
+import json
 import pathlib
 import asyncio
 import functools
@@ -11,6 +12,11 @@ import pytest_asyncio
 from ncclient import manager
 import pysnmp.hlapi
 from qmonus_net_faker import action, server
+from qmonus_net_faker.interface import manager_client
+from qmonus_net_faker.application import exceptions as app_exceptions, plugin
+from qmonus_net_faker.libs import admission, netconf, snapshot, str_utils, xml_utils
+from qmonus_net_faker.domain import stub_domain, yang_tree_domain
+from qmonus_net_faker.infrastructure import stub_infrastructure
 
 from . import http_client
 
@@ -49,7 +55,10 @@ async def setup_function(project_path: pathlib.Path):
     await action.init(project_path=str(project_path))
     await action.build(project_path=str(project_path), yang_name="junos")
     manager = await server.create_manager(
-        host=MANAGER.host, port=MANAGER.port, project_path=str(project_path)
+        host=MANAGER.host,
+        port=MANAGER.port,
+        project_path=str(project_path),
+        unix_socket_path=str(project_path.joinpath("manager.sock")),
     )
 
     stubs = []
@@ -526,6 +535,7 @@ async def test_handles_http(http_client: http_client.HttpClient):
             method="GET", url=f"http://{STUB.host}:{STUB.http_port}"
         )
         assert resp.status == 200
+        assert resp.data == "<ok/>"
 
 
 @pytest.mark.asyncio
@@ -561,6 +571,28 @@ async def test_handles_ssh():
             output = await asyncio.wait_for(process.stdout.readuntil(">"), timeout=10)
             assert "Screen length set to 0" in output
 
+            # Abbreviated keywords
+            process.stdin.write("set cli screen-w 511\n")
+            output = await asyncio.wait_for(process.stdout.readuntil(">"), timeout=10)
+            assert "Screen width set to 511" in output
+
+            process.stdin.write("set cli screen 0\n")
+            output = await asyncio.wait_for(process.stdout.readuntil(">"), timeout=10)
+            assert "ambiguous command." in output
+
+            # Modes switch the prompt
+            process.stdin.write("conf\n")
+            output = await asyncio.wait_for(process.stdout.readuntil("#"), timeout=10)
+            assert "Entering configuration mode" in output
+
+            process.stdin.write("configure\n")
+            output = await asyncio.wait_for(process.stdout.readuntil("#"), timeout=10)
+            assert "unknown command." in output
+
+            process.stdin.write("exit\n")
+            output = await asyncio.wait_for(process.stdout.readuntil(">"), timeout=10)
+            assert "Exiting configuration mode" in output
+
 
 @pytest.mark.asyncio
 async def test_handles_telnet():
@@ -659,3 +691,1467 @@ async def test_handles_snmp():
         await asyncio.get_event_loop().run_in_executor(
             None, functools.partial(_test, STUB=STUB)
         )
+
+
+@pytest.mark.asyncio
+async def test_reuses_connections_to_manager():
+    client = manager_client.Client(manager_endpoint=MANAGER.endpoint, pool_size=1)
+    await client.start()
+    try:
+        for request_id in range(3):
+            response = await client.handle(
+                stub_id=STUBS[0].stub_id,
+                body={
+                    "id": STUBS[0].stub_id,
+                    "protocol": "snmp",
+                    "pduType": "GET",
+                    "version": "v2c",
+                    "requestId": request_id,
+                    "community": "public",
+                    "non_repeaters": 0,
+                    "max_repetitions": 0,
+                    "objects": [
+                        {"oid": "1.3.6.1.2.1.2.2.1.1.1", "value": None, "type": None}
+                    ],
+                },
+            )
+            assert response.code == 200
+
+        stats = client.get_stats()
+        assert stats["requests"] == 3
+        assert stats["connectionsCreated"] == 1
+        assert stats["connectionsReused"] == 2
+    finally:
+        await client.stop()
+
+
+@pytest.mark.asyncio
+async def test_multiplexes_requests_over_websocket():
+    client = manager_client.WebSocketClient(manager_endpoint=MANAGER.endpoint)
+    await client.start()
+    try:
+        responses = await asyncio.gather(
+            *[
+                client.handle(
+                    stub_id=STUBS[0].stub_id,
+                    body={
+                        "id": STUBS[0].stub_id,
+                        "protocol": "snmp",
+                        "pduType": "GET",
+                        "version": "v2c",
+                        "requestId": request_id,
+                        "community": "public",
+                        "non_repeaters": 0,
+                        "max_repetitions": 0,
+                        "objects": [
+                            {
+                                "oid": "1.3.6.1.2.1.2.2.1.1.1",
+                                "value": None,
+                                "type": None,
+                            }
+                        ],
+                    },
+                )
+                for request_id in range(5)
+            ]
+        )
+        for response in responses:
+            assert response.code == 200
+            assert json.loads(response.body)["objects"][0]["value"] is not None
+
+        stats = client.get_stats()
+        assert stats["requests"] == 1
+        assert stats["connectionsCreated"] == 1
+    finally:
+        await client.stop()
+
+
+@pytest.mark.asyncio
+async def test_handles_requests_over_unix_socket(project_path: pathlib.Path):
+    client = manager_client.Client(
+        manager_endpoint=f"unix://{project_path.joinpath('manager.sock')}"
+    )
+    await client.start()
+    try:
+        response = await client.handle(
+            stub_id=STUBS[0].stub_id,
+            body={
+                "id": STUBS[0].stub_id,
+                "protocol": "snmp",
+                "pduType": "GET",
+                "version": "v2c",
+                "requestId": 0,
+                "community": "public",
+                "non_repeaters": 0,
+                "max_repetitions": 0,
+                "objects": [
+                    {"oid": "1.3.6.1.2.1.2.2.1.1.1", "value": None, "type": None}
+                ],
+            },
+        )
+        assert response.code == 200
+        assert response.framed is True
+    finally:
+        await client.stop()
+
+
+@pytest.mark.asyncio
+async def test_negotiates_envelope_format_for_handle(
+    http_client: http_client.HttpClient,
+):
+    body = {
+        "id": STUBS[0].stub_id,
+        "protocol": "http",
+        "method": "GET",
+        "path": "/",
+        "query": {},
+        "headers": {},
+        "body": "",
+    }
+
+    # JSON envelope
+    resp = await http_client.request(
+        method="POST",
+        url=f"{MANAGER.endpoint}/stubs/{STUBS[0].stub_id}:handle",
+        data=body,
+    )
+    assert resp.status == 200
+    assert resp.json["code"] == 200
+    assert resp.json["headers"]["content-type"] == "application/xml"
+    assert resp.json["body"] == "<ok/>"
+
+    # Frame envelope
+    client = manager_client.Client(manager_endpoint=MANAGER.endpoint)
+    await client.start()
+    try:
+        response = await client.handle(
+            stub_id=STUBS[0].stub_id, body=body, payload_field="body"
+        )
+        assert response.framed is True
+        assert response.code == 200
+        assert response.headers["content-type"] == "application/xml"
+        assert response.payload == b"<ok/>"
+    finally:
+        await client.stop()
+
+
+@pytest.mark.asyncio
+async def test_hosts_many_stubs_on_shared_listeners(
+    http_client: http_client.HttpClient,
+):
+    resp = await http_client.request(
+        method="PATCH",
+        url=f"{MANAGER.endpoint}/stubs/{STUBS[1].stub_id}",
+        data={"stub": {"enabled": False}},
+    )
+    assert resp.status == 200
+
+    client = manager_client.Client(manager_endpoint=MANAGER.endpoint)
+    stubs = await server.create_stubs(
+        stub_ids=[STUB.stub_id for STUB in STUBS],
+        manager_endpoint=MANAGER.endpoint,
+        host="0.0.0.0",
+        http_port=30080,
+        https_port=30443,
+        ssh_port=30022,
+        telnet_port=30023,
+        snmp_port=30161,
+        protocols=["http", "snmp"],
+        allocation="ip-alias",
+        first_address=STUBS[0].host,
+        client=client,
+    )
+    assert len(stubs) == 2
+
+    await client.start()
+    await asyncio.gather(*[stub.start() for stub in stubs])
+    try:
+        # The local address selects the stub
+        resp = await http_client.request(
+            method="GET", url=f"http://{STUBS[0].host}:30080"
+        )
+        assert resp.status == 200
+        resp = await http_client.request(
+            method="GET", url=f"http://{STUBS[1].host}:30080"
+        )
+        assert resp.status == 500
+        assert client.get_stats()["requests"] == 2
+    finally:
+        await asyncio.gather(*[stub.stop() for stub in stubs])
+        await client.stop()
+
+
+@pytest.mark.asyncio
+async def test_rejects_overlapping_port_ranges():
+    with pytest.raises(ValueError):
+        await server.create_stubs(
+            stub_ids=["stub-0", "stub-1"],
+            manager_endpoint=MANAGER.endpoint,
+            host="127.0.0.1",
+            http_port=30080,
+            https_port=30443,
+            ssh_port=30022,
+            telnet_port=30023,
+            snmp_port=30161,
+            protocols=["ssh", "telnet"],
+            allocation="port",
+            first_address="127.0.0.1",
+            client=manager_client.Client(manager_endpoint=MANAGER.endpoint),
+        )
+
+
+@pytest.mark.asyncio
+async def test_handles_requests_in_embedded_mode(
+    project_path: pathlib.Path, http_client: http_client.HttpClient
+):
+    manager = await server.create_manager(
+        host=MANAGER.host, port=MANAGER.port + 1, project_path=str(project_path)
+    )
+    client = manager_client.DirectClient(manager_app=manager.manager_app)
+    assert isinstance(client, manager_client.BaseClient)
+    assert not isinstance(client, manager_client.Client)
+    stubs = await server.create_stubs(
+        stub_ids=[STUBS[0].stub_id],
+        manager_endpoint=MANAGER.endpoint,
+        host=STUBS[0].host,
+        http_port=30080,
+        https_port=30443,
+        ssh_port=30022,
+        telnet_port=30023,
+        snmp_port=30161,
+        protocols=["http"],
+        allocation="port",
+        first_address=STUBS[0].host,
+        client=client,
+    )
+    await client.start()
+    await asyncio.gather(*[stub.start() for stub in stubs])
+    try:
+        resp = await http_client.request(
+            method="GET", url=f"http://{STUBS[0].host}:30080"
+        )
+        assert resp.status == 200
+        assert resp.data == "<ok/>"
+
+        response = await client.handle(
+            stub_id="dummy",
+            body={
+                "id": "dummy",
+                "protocol": "http",
+                "method": "GET",
+                "path": "/",
+                "query": {},
+                "headers": {},
+                "body": "",
+            },
+        )
+        assert response.framed is False
+        assert response.code == 404
+        assert client.get_stats()["requests"] == 2
+    finally:
+        await asyncio.gather(*[stub.stop() for stub in stubs])
+        await client.stop()
+
+
+@pytest.mark.asyncio
+async def test_routes_requests_to_sharded_managers(project_path: pathlib.Path):
+    shards = [
+        await server.create_manager(
+            host=MANAGER.host,
+            port=MANAGER.port + 1 + i,
+            project_path=str(project_path),
+            shard_index=i,
+            shard_count=2,
+        )
+        for i in range(2)
+    ]
+    client = manager_client.create_client(
+        manager_endpoint=",".join(
+            f"http://{MANAGER.host}:{MANAGER.port + 1 + i}" for i in range(2)
+        )
+    )
+    assert isinstance(client, manager_client.ShardedClient)
+    assert not isinstance(client, manager_client.Client)
+
+    for shard in shards:
+        await shard.start()
+    await client.start()
+    try:
+        for STUB in STUBS:
+            response = await client.handle(
+                stub_id=STUB.stub_id,
+                body={
+                    "id": STUB.stub_id,
+                    "protocol": "http",
+                    "method": "GET",
+                    "path": "/",
+                    "query": {},
+                    "headers": {},
+                    "body": "",
+                },
+                payload_field="body",
+            )
+            assert response.framed is True
+            assert response.code == 200
+        assert client.get_stats()["requests"] == len(STUBS)
+    finally:
+        await client.stop()
+        for shard in shards:
+            await shard.stop()
+
+
+@pytest.mark.asyncio
+async def test_sends_requests_to_a_plain_manager_without_shards():
+    client = manager_client.create_client(manager_endpoint=MANAGER.endpoint)
+    assert isinstance(client, manager_client.RoutedClient)
+    await client.start()
+    try:
+        # A manager has no GET /shards, so it is used as-is
+        assert client._sharded_client is None
+        response = await client.handle(
+            stub_id=STUBS[0].stub_id,
+            body={
+                "id": STUBS[0].stub_id,
+                "protocol": "http",
+                "method": "GET",
+                "path": "/",
+                "query": {},
+                "headers": {},
+                "body": "",
+            },
+            payload_field="body",
+        )
+        assert response.framed is True
+        assert response.code == 200
+    finally:
+        await client.stop()
+
+
+@pytest.mark.asyncio
+async def test_proxies_websocket_channels_through_router(project_path: pathlib.Path):
+    shards = [
+        await server.create_manager(
+            host=MANAGER.host,
+            port=MANAGER.port + 1 + i,
+            project_path=str(project_path),
+            shard_index=i,
+            shard_count=2,
+        )
+        for i in range(2)
+    ]
+    router = server.create_router(
+        host=MANAGER.host,
+        port=MANAGER.port + 3,
+        manager_endpoints=[
+            f"http://{MANAGER.host}:{MANAGER.port + 1 + i}" for i in range(2)
+        ],
+    )
+    client = manager_client.WebSocketClient(
+        manager_endpoint=f"http://{MANAGER.host}:{MANAGER.port + 3}"
+    )
+
+    for shard in shards:
+        await shard.start()
+    await router.start()
+    await client.start()
+    try:
+        for STUB in [*STUBS, *STUBS]:
+            response = await client.handle(
+                stub_id=STUB.stub_id,
+                body={
+                    "id": STUB.stub_id,
+                    "protocol": "http",
+                    "method": "GET",
+                    "path": "/",
+                    "query": {},
+                    "headers": {},
+                    "body": "",
+                },
+                payload_field="body",
+            )
+            assert response.framed is True
+            assert response.code == 200
+
+            # The next request opens a new channel
+            await client._ws.close()
+
+        response = await client.handle(
+            stub_id="dummy", body={"id": "dummy", "protocol": "snmp"}
+        )
+        assert response.framed is False
+        assert response.code == 404
+    finally:
+        await client.stop()
+        await router.stop()
+        for shard in shards:
+            await shard.stop()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "case",
+    [
+        {"hot_reload": "inotify", "reloaded": True},
+        {"hot_reload": "poll", "reloaded": True},
+        {"hot_reload": "off", "reloaded": False},
+    ],
+)
+async def test_reloads_modified_handler(project_path: pathlib.Path, case: dict):
+    handler = f"hot_reload_{case['hot_reload']}"
+    handler_path = project_path.joinpath("module", "handlers", handler)
+    handler_path.mkdir(exist_ok=True)
+    template = (
+        "from qmonus_net_faker.application import plugin\n"
+        "\n"
+        "\n"
+        "async def setup(ctx):\n"
+        "    return Handler()\n"
+        "\n"
+        "\n"
+        "class Handler(plugin.Handler):\n"
+        "    async def handle_http(self, ctx):\n"
+        "        return ctx.request.http.create_response(code=200, body='{}')\n"
+    )
+    handler_path.joinpath("__init__.py").write_text(template.format("first"))
+
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload=case["hot_reload"],
+        hot_reload_interval=0.1,
+    )
+    await manager.manager_app.create_stub(
+        id=handler,
+        description="",
+        handler=handler,
+        yang="",
+        enabled=True,
+        metadata={},
+    )
+    client = manager_client.DirectClient(manager_app=manager.manager_app)
+    body = {
+        "id": handler,
+        "protocol": "http",
+        "method": "GET",
+        "path": "/",
+        "query": {},
+        "headers": {},
+        "body": "",
+    }
+
+    await manager.start()
+    try:
+        response = await client.handle(stub_id=handler, body=body)
+        assert response.payload == b"first"
+
+        # A different size keeps a stale .pyc from being picked up within the same second
+        handler_path.joinpath("__init__.py").write_text(
+            template.format("second-version")
+        )
+        for _ in range(30):
+            await asyncio.sleep(0.1)
+            response = await client.handle(stub_id=handler, body=body)
+            if response.payload != b"first":
+                break
+
+        if case["reloaded"]:
+            assert response.payload == b"second-version"
+        else:
+            assert response.payload == b"first"
+    finally:
+        await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_caches_handler_instances(project_path: pathlib.Path):
+    handler = "lifecycle"
+    handler_path = project_path.joinpath("module", "handlers", handler)
+    handler_path.mkdir(exist_ok=True)
+    handler_path.joinpath("__init__.py").write_text(
+        "import asyncio\n"
+        "\n"
+        "from qmonus_net_faker.application import plugin\n"
+        "\n"
+        "EVENTS = []\n"
+        "\n"
+        "\n"
+        "async def setup(ctx):\n"
+        "    await asyncio.sleep(0.05)\n"
+        "    EVENTS.append('setup')\n"
+        "    return Handler()\n"
+        "\n"
+        "\n"
+        "class Handler(plugin.Handler):\n"
+        "    async def on_load(self, ctx):\n"
+        "        EVENTS.append('load')\n"
+        "\n"
+        "    async def on_unload(self):\n"
+        "        EVENTS.append('unload')\n"
+        "\n"
+        "    async def handle_http(self, ctx):\n"
+        "        return ctx.request.http.create_response(\n"
+        "            code=200, body=','.join(EVENTS)\n"
+        "        )\n"
+    )
+
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload="off",
+    )
+    manager_app = manager.manager_app
+    await manager_app.create_stub(
+        id=handler,
+        description="",
+        handler=handler,
+        yang="",
+        enabled=True,
+        metadata={},
+    )
+    client = manager_client.DirectClient(manager_app=manager_app)
+    body = {
+        "id": handler,
+        "protocol": "http",
+        "method": "GET",
+        "path": "/",
+        "query": {},
+        "headers": {},
+        "body": "",
+    }
+
+    responses = await asyncio.gather(
+        *[client.handle(stub_id=handler, body=body) for _ in range(3)]
+    )
+    assert [r.payload for r in responses] == [b"setup,load"] * 3
+
+    # Updating the stub drops its cached instance
+    await manager_app.update_stub(id=handler, metadata={"k": "v"})
+    response = await client.handle(stub_id=handler, body=body)
+    assert response.payload == b"setup,load,unload,setup,load"
+
+    await manager_app.stop()
+    response = await client.handle(stub_id=handler, body=body)
+    assert response.payload == b"setup,load,unload,setup,load,unload,setup,load"
+
+    # A handler still in setup() is unloaded once it is set up
+    await manager_app.update_stub(id=handler, metadata={"k": "v2"})
+    task = asyncio.ensure_future(client.handle(stub_id=handler, body=body))
+    await asyncio.sleep(0.01)
+    await manager_app.update_stub(id=handler, metadata={"k": "v3"})
+    await task
+    response = await client.handle(stub_id=handler, body=body)
+    assert response.payload.endswith(b",unload,setup,load,unload,setup,load")
+    assert response.payload.count(b"unload") == 4
+
+
+@pytest.mark.asyncio
+async def test_offloads_datastore_operations_to_threads(project_path: pathlib.Path):
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload="off",
+        executor_threads=4,
+    )
+    client = manager_client.DirectClient(manager_app=manager.manager_app)
+
+    def _create_body(message_id: int, rpc: str) -> dict:
+        return {
+            "id": STUBS[0].stub_id,
+            "protocol": "netconf",
+            "connectionStatus": "established",
+            "sessionId": 1,
+            "username": "root",
+            "rpc": (
+                f'<rpc xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="{message_id}">'
+                f"{rpc}</rpc>"
+            ),
+        }
+
+    edit_config = """
+        <edit-config>
+            <target><candidate/></target>
+            <config>
+                <configuration xmlns="http://yang.juniper.net/junos/conf/root">
+                    <interfaces xmlns="http://yang.juniper.net/junos/conf/interfaces">
+                        <interface>
+                            <name>xe-0/0/{}</name>
+                        </interface>
+                    </interfaces>
+                </configuration>
+            </config>
+        </edit-config>
+    """
+
+    # Edits to one stub are serialized, so none of them is lost
+    responses = await asyncio.gather(
+        *[
+            client.handle(
+                stub_id=STUBS[0].stub_id,
+                body=_create_body(message_id=i, rpc=edit_config.format(i)),
+            )
+            for i in range(20)
+        ]
+    )
+    assert all("<ok/>" in response.body for response in responses)
+
+    response = await client.handle(
+        stub_id=STUBS[0].stub_id,
+        body=_create_body(
+            message_id=100,
+            rpc="<get-config><source><candidate/></source></get-config>",
+        ),
+    )
+    assert response.body.count(":interface>") == 40
+
+
+@pytest.mark.asyncio
+async def test_decodes_each_request_layer_once(http_client: http_client.HttpClient):
+    async def _get_stats() -> dict:
+        resp = await http_client.request(method="GET", url=f"{MANAGER.endpoint}/stats")
+        assert resp.status == 200
+        return resp.json["stats"]
+
+    http_body = {
+        "id": STUBS[0].stub_id,
+        "protocol": "http",
+        "method": "GET",
+        "path": "/",
+        "query": {},
+        "headers": {},
+        "body": "",
+    }
+    netconf_body = {
+        "id": STUBS[0].stub_id,
+        "protocol": "netconf",
+        "connectionStatus": "established",
+        "sessionId": 1,
+        "username": "root",
+        "rpc": (
+            '<rpc xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1">'
+            "<get-config><source><running/></source>"
+            '<filter type="subtree"/></get-config></rpc>'
+        ),
+    }
+    stats = await _get_stats()
+
+    # Legacy JSON envelope: the body is decoded once, never re-encoded
+    resp = await http_client.request(
+        method="POST",
+        url=f"{MANAGER.endpoint}/stubs/{STUBS[0].stub_id}:handle",
+        data=http_body,
+    )
+    assert resp.status == 200
+
+    # Framed requests need no body decode; only NETCONF parses its rpc
+    client = manager_client.Client(manager_endpoint=MANAGER.endpoint)
+    await client.start()
+    try:
+        response = await client.handle(
+            stub_id=STUBS[0].stub_id, body=http_body, payload_field="body"
+        )
+        assert response.code == 200
+        response = await client.handle(
+            stub_id=STUBS[0].stub_id, body=netconf_body, payload_field="rpc"
+        )
+        assert 'message-id="1"' in response.body
+    finally:
+        await client.stop()
+
+    new_stats = await _get_stats()
+    assert new_stats["requests"] - stats["requests"] == 3
+    assert new_stats["bodyDecodes"] - stats["bodyDecodes"] == 1
+    assert new_stats["bodyEncodes"] - stats["bodyEncodes"] == 0
+    assert new_stats["xmlParses"] - stats["xmlParses"] == 1
+    # Only the filter subtree is copied out of the rpc tree
+    assert new_stats["xmlCopies"] - stats["xmlCopies"] == 1
+
+
+def test_sends_rewritten_http_response_body():
+    response = plugin.HttpResponse(code=200, headers={}, body="before")
+    envelope = json.loads(response.body)
+    envelope["body"] = "after"
+    response.body = json.dumps(envelope)
+    assert response.to_envelope() == ({"code": 200, "headers": {}}, b"after")
+
+    response.http_code = 201
+    assert json.loads(response.body)["code"] == 201
+
+
+@pytest.mark.asyncio
+async def test_dispatches_http_routes(project_path: pathlib.Path):
+    handler = "routes"
+    handler_path = project_path.joinpath("module", "handlers", handler)
+    handler_path.mkdir(exist_ok=True)
+    handler_path.joinpath("__init__.py").write_text(
+        "from qmonus_net_faker.application import plugin\n"
+        "\n"
+        "\n"
+        "async def setup(ctx):\n"
+        "    return Handler()\n"
+        "\n"
+        "\n"
+        "class Handler(plugin.Handler):\n"
+        "    @plugin.route('GET', '/restconf/data/interfaces')\n"
+        "    async def list_interfaces(self, ctx):\n"
+        "        return ctx.request.http.create_response(code=200, body='list')\n"
+        "\n"
+        "    @plugin.route('GET', '/restconf/data/interfaces/interface={name}')\n"
+        "    @plugin.route('DELETE', '/restconf/data/interfaces/interface={name}')\n"
+        "    async def interface(self, ctx, name):\n"
+        "        method = ctx.request.http.method\n"
+        "        return ctx.request.http.create_response(code=200, body=f'{method} {name}')\n"
+        "\n"
+        "    @plugin.route('GET', '/restconf/data/interfaces/interface=lo0')\n"
+        "    async def loopback(self, ctx):\n"
+        "        return ctx.request.http.create_response(code=200, body='loopback')\n"
+        "\n"
+        "    @plugin.route('*', '/{a}/{b}')\n"
+        "    async def any_method(self, ctx, a, b):\n"
+        "        return ctx.request.http.create_response(code=200, body=f'{b}/{a}')\n"
+    )
+
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload="off",
+    )
+    await manager.manager_app.create_stub(
+        id=handler,
+        description="",
+        handler=handler,
+        yang="",
+        enabled=True,
+        metadata={},
+    )
+    client = manager_client.DirectClient(manager_app=manager.manager_app)
+
+    async def _request(method: str, path: str) -> manager_client.Reply:
+        body = {
+            "id": handler,
+            "protocol": "http",
+            "method": method,
+            "path": path,
+            "query": {},
+            "headers": {},
+            "body": "",
+        }
+        return await client.handle(stub_id=handler, body=body)
+
+    response = await _request("GET", "/restconf/data/interfaces")
+    assert (response.code, response.payload) == (200, b"list")
+    response = await _request("DELETE", "/restconf/data/interfaces/interface=xe-0")
+    assert (response.code, response.payload) == (200, b"DELETE xe-0")
+    # Static segments win over templated ones
+    response = await _request("GET", "/restconf/data/interfaces/interface=lo0")
+    assert (response.code, response.payload) == (200, b"loopback")
+    response = await _request("PATCH", "/x/y")
+    assert (response.code, response.payload) == (200, b"y/x")
+
+    response = await _request("PUT", "/restconf/data/interfaces")
+    assert response.code == 405
+    assert response.headers["allow"] == "GET"
+    response = await _request("GET", "/restconf/data/unknown")
+    assert response.code == 404
+
+
+@pytest.mark.asyncio
+async def test_shares_compiled_templates(project_path: pathlib.Path):
+    handler = "templates"
+    handler_path = project_path.joinpath("module", "handlers", handler)
+    handler_path.mkdir(exist_ok=True)
+    handler_path.joinpath("__init__.py").write_text(
+        "from qmonus_net_faker.application import plugin\n"
+        "\n"
+        "TEMPLATES = set()\n"
+        "\n"
+        "\n"
+        "async def setup(ctx):\n"
+        "    return Handler()\n"
+        "\n"
+        "\n"
+        "class Handler(plugin.Handler):\n"
+        "    async def handle_http(self, ctx):\n"
+        "        template = ctx.template_env.from_string('{{ path }}:{{ n }}')\n"
+        "        TEMPLATES.add(id(template))\n"
+        "        body = template.render(path=ctx.request.http.path, n=len(TEMPLATES))\n"
+        "        return ctx.request.http.create_response(code=200, body=body)\n"
+    )
+
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload="off",
+    )
+    await manager.manager_app.create_stub(
+        id=handler,
+        description="",
+        handler=handler,
+        yang="",
+        enabled=True,
+        metadata={},
+    )
+    client = manager_client.DirectClient(manager_app=manager.manager_app)
+    for path in ["/a", "/b"]:
+        body = {
+            "id": handler,
+            "protocol": "http",
+            "method": "GET",
+            "path": path,
+            "query": {},
+            "headers": {},
+            "body": "",
+        }
+        response = await client.handle(stub_id=handler, body=body)
+        # The template is compiled on the first request only
+        assert response.payload == f"{path}:1".encode()
+
+    # Hello messages are rendered once per set of capabilities
+    hello = netconf.render_hello_message(session_id=1, capabilities=["urn:a"])
+    assert "<session-id>1</session-id>" in hello
+    hello = netconf.render_hello_message(session_id=2, capabilities=["urn:a"])
+    assert "<session-id>2</session-id>" in hello
+    assert "<capability>urn:a</capability>" in hello
+
+
+@pytest.mark.asyncio
+async def test_rejects_requests_over_limits(
+    project_path: pathlib.Path, http_client: http_client.HttpClient
+):
+    handler = "slow"
+    handler_path = project_path.joinpath("module", "handlers", handler)
+    handler_path.mkdir(exist_ok=True)
+    handler_path.joinpath("__init__.py").write_text(
+        "import asyncio\n"
+        "from qmonus_net_faker.application import plugin\n"
+        "\n"
+        "\n"
+        "async def setup(ctx):\n"
+        "    return Handler()\n"
+        "\n"
+        "\n"
+        "class Handler(plugin.Handler):\n"
+        "    async def handle_http(self, ctx):\n"
+        "        await asyncio.sleep(0.5)\n"
+        "        return ctx.request.http.create_response(code=200, body='done')\n"
+    )
+
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload="off",
+        max_inflight_per_stub=1,
+        max_queue=1,
+    )
+    await manager.manager_app.create_stub(
+        id=handler,
+        description="",
+        handler=handler,
+        yang="",
+        enabled=True,
+        metadata={},
+    )
+    client = manager_client.DirectClient(manager_app=manager.manager_app)
+    stub = await server.create_http_stub(
+        host=STUBS[0].host,
+        port=30080,
+        stub_id=handler,
+        manager_endpoint=MANAGER.endpoint,
+        client=client,
+    )
+    await stub.start()
+    try:
+        # One runs, one waits, and the third fails fast while the queue is full
+        responses = await asyncio.gather(
+            *[
+                http_client.request(method="GET", url=f"http://{STUBS[0].host}:30080")
+                for _ in range(3)
+            ]
+        )
+        assert sorted(r.status for r in responses) == [200, 200, 503]
+        rejected = [r for r in responses if r.status == 503][0]
+        assert rejected.headers["Retry-After"] == "1"
+
+        stats = manager.manager_app.get_stats()
+        assert stats["admitted"] == 2
+        assert stats["rejected"] == 1
+        assert stats["inflight"] == 0
+    finally:
+        await stub.stop()
+
+
+@pytest.mark.asyncio
+async def test_admits_waiting_requests_first():
+    controller = admission.AdmissionController(max_inflight=1, queue_timeout=5.0)
+    order = []
+
+    async def _request(name: str, key: str) -> None:
+        async with controller.admit(key):
+            order.append(name)
+            await asyncio.sleep(0.05)
+
+    # 'b' waits for 'a'; 'c' arrives while 'b' waits and must not overtake it
+    first = asyncio.create_task(_request("a", "x"))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(_request("b", "y"))
+    await asyncio.sleep(0.01)
+    await asyncio.gather(first, second, _request("c", "z"))
+    assert order == ["a", "b", "c"]
+
+    # 0 rejects instead of waiting
+    controller = admission.AdmissionController(max_inflight=1, queue_timeout=0.0)
+    async with controller.admit("x"):
+        with pytest.raises(admission.OverloadedError):
+            async with controller.admit("y"):
+                pass
+    assert controller.get_stats()["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_shares_unmodified_state_between_stub_snapshots():
+    repo = stub_infrastructure.Repository()
+    stub = stub_domain.Entity(
+        id=stub_domain.Id(value="cow"),
+        description=stub_domain.Description(value=""),
+        handler=stub_domain.Handler(value="junos"),
+        yang=yang_tree_domain.Id(value=""),
+        enabled=stub_domain.Enabled(value=True),
+    )
+    stub.set_candidate_config(
+        xml_utils.from_string("<root><hostname>a</hostname></root>")
+    )
+    stub.set_snmp_object(oid="1.3.6.1.2.1.1.5.0", type="OCTET_STRING", value="a")
+    await repo.save(stub)
+
+    # Committing shares the candidate tree instead of copying it
+    loaded = await repo.get(id=stub_domain.Id(value="cow"))
+    loaded.commit_config()
+    loaded.set_snmp_object(oid="1.3.6.1.2.1.1.5.0", type="OCTET_STRING", value="b")
+    assert loaded._running_config is loaded._candidate_config
+
+    # Writes to a snapshot never reach the stored entity until it is saved
+    stored = await repo.get(id=stub_domain.Id(value="cow"))
+    assert stored._candidate_config is loaded._candidate_config
+    assert "hostname" not in xml_utils.to_string(stored.get_running_config())
+    assert stored.get_snmp_object(oid="1.3.6.1.2.1.1.5.0").value == "a"
+
+    await repo.save(loaded)
+    stored = await repo.get(id=stub_domain.Id(value="cow"))
+    assert "<hostname>a</hostname>" in xml_utils.to_string(stored.get_running_config())
+    assert stored.get_snmp_object(oid="1.3.6.1.2.1.1.5.0").value == "b"
+
+
+@pytest.mark.asyncio
+async def test_saves_only_changed_parts_of_stubs():
+    repo = stub_infrastructure.Repository()
+    stub = stub_domain.Entity(
+        id=stub_domain.Id(value="dirty"),
+        description=stub_domain.Description(value=""),
+        handler=stub_domain.Handler(value="junos"),
+        yang=yang_tree_domain.Id(value=""),
+        enabled=stub_domain.Enabled(value=True),
+    )
+    await repo.save(stub)
+    assert stub.get_changes() == set()
+
+    # Saving an unchanged snapshot leaves the stored entity as it is
+    stored = repo._entity_map["dirty"]
+    loaded = await repo.get(id=stub_domain.Id(value="dirty"))
+    await repo.save(loaded)
+    assert repo._entity_map["dirty"] is stored
+
+    # Snapshots changing different parts do not overwrite each other
+    first = await repo.get(id=stub_domain.Id(value="dirty"))
+    second = await repo.get(id=stub_domain.Id(value="dirty"))
+    first.set_running_config(
+        xml_utils.from_string("<root><hostname>a</hostname></root>")
+    )
+    second.set_snmp_object(oid="1.3.6.1.2.1.1.5.0", type="OCTET_STRING", value="a")
+    second.enabled = stub_domain.Enabled(value=False)
+    assert first.get_changes() == {"running"}
+    assert second.get_changes() == {"snmp", "enabled"}
+    await repo.save(first)
+    await repo.save(second)
+
+    stored = await repo.get(id=stub_domain.Id(value="dirty"))
+    assert "<hostname>a</hostname>" in xml_utils.to_string(stored.get_running_config())
+    assert stored.get_snmp_object(oid="1.3.6.1.2.1.1.5.0").value == "a"
+    assert stored.enabled.value is False
+    assert await repo.list(enabled=stub_domain.Enabled(value=False)) != []
+
+
+@pytest.mark.asyncio
+async def test_restores_stub_state_from_snapshot(project_path: pathlib.Path):
+    snapshot_path = project_path.joinpath("stubs.snapshot")
+    stub_id = STUBS[0].stub_id
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload="off",
+        snapshot_path=str(snapshot_path),
+    )
+    stub_repo = manager.manager_app._stub_repo
+    stub = await stub_repo.get(id=stub_domain.Id(value=stub_id))
+    stub.set_candidate_config(
+        xml_utils.from_string("<root><hostname>restored</hostname></root>")
+    )
+    stub.commit_config()
+    stub.set_metadata(value={"site": "a"})
+    stub.set_snmp_object(oid="1.3.6.1.2.1.1.5.0", type="OCTET_STRING", value="a")
+    await stub_repo.save(stub)
+    assert await manager.manager_app.save_snapshot() == len(STUBS)
+
+    # A new manager restores the state of the stubs defined in stubs.yaml
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload="off",
+        snapshot_path=str(snapshot_path),
+    )
+    stub = await manager.manager_app.get_stub(id=stub_id)
+    assert "<hostname>restored</hostname>" in xml_utils.to_string(
+        stub.get_running_config()
+    )
+    # The committed tree is still shared between candidate and running
+    assert stub._candidate_config is stub._running_config
+    assert stub.get_metadata() == {"site": "a"}
+    assert stub.get_snmp_object(oid="1.3.6.1.2.1.1.5.0").value == "a"
+
+
+@pytest.mark.asyncio
+async def test_replays_journaled_operations(project_path: pathlib.Path):
+    snapshot_path = project_path.joinpath("stubs.snapshot")
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload="off",
+        snapshot_path=str(snapshot_path),
+    )
+    client = manager_client.DirectClient(manager_app=manager.manager_app)
+
+    def _create_body(message_id: int, rpc: str) -> dict:
+        return {
+            "id": STUBS[0].stub_id,
+            "protocol": "netconf",
+            "connectionStatus": "established",
+            "sessionId": 1,
+            "username": "root",
+            "rpc": (
+                f'<rpc xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="{message_id}">'
+                f"{rpc}</rpc>"
+            ),
+        }
+
+    edit_config = """
+        <edit-config>
+            <target><candidate/></target>
+            <config>
+                <configuration xmlns="http://yang.juniper.net/junos/conf/root">
+                    <interfaces xmlns="http://yang.juniper.net/junos/conf/interfaces">
+                        <interface>
+                            <name>xe-0/0/{}</name>
+                        </interface>
+                    </interfaces>
+                </configuration>
+            </config>
+        </edit-config>
+    """
+    for i, rpc in enumerate(
+        [edit_config.format(1), "<commit/>", edit_config.format(2)]
+    ):
+        response = await client.handle(
+            stub_id=STUBS[0].stub_id, body=_create_body(message_id=i, rpc=rpc)
+        )
+        assert "<ok/>" in response.body
+
+    # The edits are only in the journal, not in the snapshot taken at startup
+    journal = snapshot.Journal(path=snapshot_path)
+    records = journal.read(journal.list_generations()[-1])
+    assert [operation[0] for _, operation in records] == [
+        "edit-config",
+        "commit",
+        "edit-config",
+    ]
+
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload="off",
+        snapshot_path=str(snapshot_path),
+    )
+    stub = await manager.manager_app.get_stub(id=STUBS[0].stub_id)
+    running = xml_utils.to_string(stub.get_running_config())
+    candidate = xml_utils.to_string(stub.get_candidate_config())
+    assert "xe-0/0/1" in running and "xe-0/0/2" not in running
+    assert "xe-0/0/1" in candidate and "xe-0/0/2" in candidate
+
+    # Restoring checkpoints the journal into the snapshot
+    assert len(journal.list_generations()) == 1
+    assert journal.read(journal.list_generations()[0]) == []
+
+
+@pytest.mark.asyncio
+async def test_commits_journal_records_in_groups(tmp_path: pathlib.Path):
+    journal = snapshot.Journal(path=tmp_path.joinpath("stubs.snapshot"))
+    journal.open(1)
+    journal.append([("a", ("commit",))])
+    journal.append([("b", ("commit",))])
+    await journal.sync()
+    assert journal.read(1) == [("a", ("commit",)), ("b", ("commit",))]
+
+    # Records appended before a rotation stay in their generation
+    journal.append([("c", ("commit",))])
+    assert journal.rotate() == 2
+    journal.append([("d", ("commit",))])
+    await journal.sync()
+    assert journal.read(1)[-1] == ("c", ("commit",))
+    assert journal.read(2) == [("d", ("commit",))]
+    journal.close()
+
+
+@pytest.mark.asyncio
+async def test_restores_stubs_created_over_api(project_path: pathlib.Path):
+    snapshot_path = project_path.joinpath("stubs.snapshot")
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload="off",
+        snapshot_path=str(snapshot_path),
+    )
+    manager_app = manager.manager_app
+    await manager_app.create_stub(
+        id="api-stub-0",
+        description="created",
+        handler="junos",
+        yang="junos",
+        enabled=True,
+        metadata={"site": "a"},
+    )
+    await manager_app.save_snapshot()
+
+    # Changed after the snapshot, i.e. only in the journal
+    await manager_app.update_stub(id="api-stub-0", description="patched", enabled=False)
+    await manager_app.create_stub(
+        id="api-stub-1",
+        description="",
+        handler="junos",
+        yang="junos",
+        enabled=True,
+        metadata={},
+    )
+    await manager_app.create_stub(
+        id="api-stub-2",
+        description="",
+        handler="junos",
+        yang="junos",
+        enabled=True,
+        metadata={},
+    )
+    await manager_app.delete_stub(id="api-stub-2")
+    await manager_app.update_stub(id=STUBS[1].stub_id, description="patched")
+    await manager_app.delete_stub(id=STUBS[2].stub_id)
+
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload="off",
+        snapshot_path=str(snapshot_path),
+    )
+    manager_app = manager.manager_app
+    stub = await manager_app.get_stub(id="api-stub-0")
+    assert stub.description.value == "patched"
+    assert stub.handler.value == "junos"
+    assert stub.yang.value == "junos"
+    assert stub.enabled.value is False
+    assert stub.get_metadata() == {"site": "a"}
+    assert (await manager_app.get_stub(id="api-stub-1")).enabled.value is True
+    stub = await manager_app.get_stub(id=STUBS[1].stub_id)
+    assert stub.description.value == "patched"
+    for id in ["api-stub-2", STUBS[2].stub_id]:
+        with pytest.raises(app_exceptions.NotFoundError):
+            await manager_app.get_stub(id=id)
+
+    # The restored stubs and the deletions are in the new snapshot as well
+    for _ in range(2):
+        manager = await server.create_manager(
+            host=MANAGER.host,
+            port=MANAGER.port + 1,
+            project_path=str(project_path),
+            hot_reload="off",
+            snapshot_path=str(snapshot_path),
+        )
+        stub = await manager.manager_app.get_stub(id="api-stub-0")
+        assert stub.description.value == "patched"
+        for id in ["api-stub-2", STUBS[2].stub_id]:
+            with pytest.raises(app_exceptions.NotFoundError):
+                await manager.manager_app.get_stub(id=id)
+
+    # Reloading stubs.yaml creates the deleted stub again
+    await manager.manager_app.reload_stubs()
+    assert (await manager.manager_app.get_stub(id=STUBS[2].stub_id)) is not None
+
+
+@pytest.mark.asyncio
+async def test_shares_identical_configs_between_stubs():
+    repo = stub_infrastructure.Repository()
+    stubs = [
+        stub_domain.Entity(
+            id=stub_domain.Id(value=f"dedup-{i}"),
+            description=stub_domain.Description(value=""),
+            handler=stub_domain.Handler(value="junos"),
+            yang=yang_tree_domain.Id(value=""),
+            enabled=stub_domain.Enabled(value=True),
+        )
+        for i in range(3)
+    ]
+    # Empty datastores of all stubs are one tree
+    assert stubs[0]._startup_config._data is stubs[2]._candidate_config._data
+
+    for stub in stubs:
+        stub.set_running_config(
+            xml_utils.from_string("<root><hostname>baseline</hostname></root>")
+        )
+    await repo.save(stubs)
+    configs = [(await repo.get(id=stub.id))._running_config for stub in stubs]
+    # Changes are not serialized; equal configs are shared once they are
+    assert configs[0]._data is not configs[1]._data
+    size = configs[0].estimate_memory_size()
+    for config in configs:
+        config.to_string()
+    assert configs[0]._data is configs[1]._data is configs[2]._data
+    # The size of a shared config is split among the stubs
+    assert configs[0].estimate_memory_size() == size / 3
+
+    # Owners drop out of the shared data as their entities are freed
+    shared = [
+        stub_domain.ConfigEntity.from_string("<root><hostname>owned</hostname></root>")
+        for _ in range(2)
+    ]
+    assert shared[0]._data is shared[1]._data
+    assert shared[1]._data.owners == 2
+    del shared[0]
+    assert shared[0]._data.owners == 1
+
+    # A modified config gets its own tree; the others keep sharing theirs
+    stubs[0].set_running_config(
+        xml_utils.from_string("<root><hostname>modified</hostname></root>")
+    )
+    await repo.save(stubs[0])
+    stored = [await repo.get(id=stub.id) for stub in stubs]
+    assert stored[0]._running_config._data is not configs[0]._data
+    assert stored[1]._running_config._data is stored[2]._running_config._data
+    assert stored[1]._running_config._data is configs[0]._data
+    assert "modified" in xml_utils.to_string(stored[0].get_running_config())
+    assert "baseline" in xml_utils.to_string(stored[1].get_running_config())
+
+
+@pytest.mark.asyncio
+async def test_keeps_idle_configs_compressed(project_path: pathlib.Path):
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(project_path),
+        hot_reload="off",
+        config_idle_timeout=0.2,
+    )
+    stub = await manager.manager_app.get_stub(id=STUBS[0].stub_id)
+    stub.set_running_config(
+        xml_utils.from_string("<root><hostname>idle</hostname></root>")
+    )
+    await manager.manager_app._stub_repo.save(stub)
+    # Configs not held by the manager's stubs are left alone
+    other = stub_domain.ConfigEntity.create(
+        value=xml_utils.from_string("<root><hostname>other</hostname></root>")
+    )
+
+    await manager.manager_app.start()
+    try:
+        await asyncio.sleep(0.6)
+        stub = await manager.manager_app.get_stub(id=STUBS[0].stub_id)
+        assert stub._running_config._data.value is None
+        assert other._data.value is not None
+        materialized = manager.manager_app.get_stats()["materializedConfigs"]
+
+        # The tree is parsed again on the next access
+        config = xml_utils.to_string(stub.get_running_config())
+        assert "<hostname>idle</hostname>" in config
+        assert stub._running_config._data.value is not None
+        stats = manager.manager_app.get_stats()
+        assert stats["materializedConfigs"] == materialized + 1
+    finally:
+        await manager.manager_app.stop()
+
+
+@pytest.mark.asyncio
+async def test_spills_least_recently_used_stubs(project_path: pathlib.Path):
+    spill_path = project_path.joinpath("spill")
+    repo = stub_infrastructure.Repository(memory_budget=400, spill_path=spill_path)
+    for i in range(3):
+        stub = stub_domain.Entity(
+            id=stub_domain.Id(value=f"spill-{i}"),
+            description=stub_domain.Description(value=""),
+            handler=stub_domain.Handler(value="junos"),
+            yang=yang_tree_domain.Id(value=""),
+            enabled=stub_domain.Enabled(value=True),
+        )
+        stub.set_running_config(
+            xml_utils.from_string(f"<root><hostname>{'x' * 100}{i}</hostname></root>")
+        )
+        stub.set_snmp_object(oid="1.3.6.1.2.1.1.5.0", type="OCTET_STRING", value=i)
+        stub.set_metadata(value={"index": i})
+        await repo.save(stub)
+
+    # Only two states fit in the budget
+    stats = repo.get_stats()
+    assert stats["stubEvictions"] == 1
+    assert stats["spilledStubs"] == 1 and stats["residentStubs"] == 2
+    assert stats["residentBytes"] <= 400
+    assert len(list(spill_path.iterdir())) == 1
+
+    # Listing reads spilled states back without making them resident
+    stubs = await repo.list(handler=[stub_domain.Handler(value="junos")])
+    assert [s.get_snmp_object(oid="1.3.6.1.2.1.1.5.0").value for s in stubs] == [
+        0,
+        1,
+        2,
+    ]
+    assert repo.get_stats()["spilledStubs"] == 1
+    assert repo.get_stats()["stubReloads"] == 1
+
+    # Listing without the states and holding them for a snapshot read no stub back
+    stubs = await repo.list(include_state=False)
+    assert [s.get_metadata() for s in stubs] == [{"index": i} for i in range(3)]
+    with repo.hold_states() as states:
+        assert [dump()["snmpObjects"][0][2] for _, dump in states] == [0, 1, 2]
+    assert repo.get_stats()["stubReloads"] == 1
+
+    # Getting a spilled stub loads it back and spills the least recently used one
+    stub = await repo.get(id=stub_domain.Id(value="spill-0"))
+    assert "x0</hostname>" in xml_utils.to_string(stub.get_running_config())
+    stats = repo.get_stats()
+    assert stats["stubReloads"] == 2
+    assert stats["stubEvictions"] == 2
+    assert "spill-1" in repo._spill_files
+
+    # A stub read while its state is being spilled stays resident
+    stub = stub_domain.Entity(
+        id=stub_domain.Id(value="spill-3"),
+        description=stub_domain.Description(value=""),
+        handler=stub_domain.Handler(value="junos"),
+        yang=yang_tree_domain.Id(value=""),
+        enabled=stub_domain.Enabled(value=True),
+    )
+    stub.set_running_config(
+        xml_utils.from_string(f"<root><hostname>{'x' * 200}3</hostname></root>")
+    )
+    victim = next(iter(repo._resident))
+    await asyncio.gather(repo.save(stub), repo.get(id=stub_domain.Id(value=victim)))
+    assert victim not in repo._spill_files
+    assert victim in repo._resident
+    assert repo.get_stats()["stubEvictions"] == 2
+
+    await repo.remove_all()
+    assert list(spill_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_creates_templated_stubs_on_first_access(tmp_path: pathlib.Path):
+    await action.init(project_path=str(tmp_path))
+    with open(tmp_path.joinpath("stubs", "stubs.yaml"), "a") as f:
+        f.write(
+            "  - id: edge-{0000..9999}\n"
+            "    description: edge\n"
+            "    handler: junos\n"
+            "    yang: junos\n"
+        )
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(tmp_path),
+        hot_reload="off",
+    )
+    manager_app = manager.manager_app
+    client = manager_client.DirectClient(manager_app=manager_app)
+
+    # Nothing is created for the range until a stub of it is accessed
+    assert len(await manager_app.list_stubs()) == len(STUBS)
+    assert len(await manager_app.list_stub_ids()) == len(STUBS) + 10000
+
+    response = await client.handle(
+        stub_id="edge-0042",
+        body={
+            "id": "edge-0042",
+            "protocol": "netconf",
+            "connectionStatus": "established",
+            "sessionId": 1,
+            "username": "root",
+            "rpc": (
+                '<rpc xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1">'
+                "<get-config><source><running/></source></get-config></rpc>"
+            ),
+        },
+    )
+    assert "<nc:data/>" in response.body
+    stub = await manager_app.get_stub(id="edge-0042")
+    assert stub.description.value == "edge"
+    assert [stub.id.value for stub in await manager_app.list_stubs()][-1] == (
+        "edge-0042"
+    )
+    assert len(await manager_app.list_stubs(id="edge-9999")) == 1
+    assert len(await manager_app.list_stubs()) == len(STUBS) + 2
+
+    # Out of the range
+    for id in ["edge-10000", "edge-42", "edge-00042"]:
+        with pytest.raises(app_exceptions.NotFoundError):
+            await manager_app.get_stub(id=id)
+
+    # Deleted stubs are not created again until the next reload
+    await manager_app.delete_stub(id="edge-0042")
+    with pytest.raises(app_exceptions.NotFoundError):
+        await manager_app.get_stub(id="edge-0042")
+    await manager_app.reload_stubs()
+    assert (await manager_app.get_stub(id="edge-0042")).id.value == "edge-0042"
+
+    # Deleted stubs stay deleted across restarts, whether the deletion is in the
+    # snapshot or only in the journal
+    snapshot_path = tmp_path.joinpath("stubs.snapshot")
+    for id in ["edge-0001", "edge-0002"]:
+        manager = await server.create_manager(
+            host=MANAGER.host,
+            port=MANAGER.port + 1,
+            project_path=str(tmp_path),
+            hot_reload="off",
+            snapshot_path=str(snapshot_path),
+        )
+        await manager.manager_app.delete_stub(id=id)
+    manager = await server.create_manager(
+        host=MANAGER.host,
+        port=MANAGER.port + 1,
+        project_path=str(tmp_path),
+        hot_reload="off",
+        snapshot_path=str(snapshot_path),
+    )
+    for id in ["edge-0001", "edge-0002"]:
+        with pytest.raises(app_exceptions.NotFoundError):
+            await manager.manager_app.get_stub(id=id)
+    assert len(await manager.manager_app.list_stub_ids()) == len(STUBS) + 9998
+
+
+def test_validates_ranges_without_expanding():
+    str_utils.validate_range("edge-{0..999999999999}-{0..9}")
+    with pytest.raises(ValueError):
+        str_utils.validate_range("edge-{0..9}-{9..0}")
+    ids = str_utils.iter_range("edge-{0..999999999999}")
+    assert [next(ids), next(ids)] == ["edge-0", "edge-1"]
+    assert str_utils.expand_range("edge-{08..10}") == ["edge-08", "edge-09", "edge-10"]